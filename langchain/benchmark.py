@@ -0,0 +1,343 @@
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+import typer
+
+from main import LangChainMain, register_handlers
+from utils.benchmarkFakes import (
+    CannedLatencyChatModel,
+    FakeS3Resource,
+    FakeTelegramBot,
+    FakeTranscribeClient,
+    FakeTranscriptHttp,
+    HashingEmbeddings,
+    OfflineBedrockClient,
+    ThrottlingBedrockClient,
+)
+from utils.bedrockUtils import BedrockUtils
+from utils.dispatcher import UserDispatcher
+from utils.metrics import metrics
+from utils.s3Utils import S3Utils
+from utils.sessionCache import SessionCache
+from utils.telegramStreamer import TelegramStreamer
+from utils.transcribeUtils import Trasncribe
+from utils.transcriptCache import TranscriptCache
+from utils.transcriptionScheduler import TranscriptionScheduler
+
+BUCKET_NAME = 'benchmark-bucket'
+EMBEDDING_MODEL = 'amazon.titan-embed-text-v2:0'
+MODEL_ID = 'amazon.nova-pro-v1:0'
+DEFAULT_DATASET = Path(__file__).resolve().parent.parent / 'dataset' / 'juridicos.zip'
+
+QUESTIONS = [
+    "O que foi decidido no acórdão dos embargos de declaração?",
+    "Qual o prazo prescricional da pretensão executória?",
+    "O que diz o art. 1.022 do CPC sobre embargos de declaração?",
+    "Quais os fundamentos do recurso extraordinário?",
+    "A decisão de admissibilidade admitiu o recurso?",
+    "O que diz o art. 5º, inciso XXXV, da Constituição Federal?",
+    "Qual foi o valor da condenação?",
+    "Quem é o relator do processo?",
+    "Houve repercussão geral reconhecida?",
+    "Quais as teses da parte recorrente?",
+]
+# Métricas comparadas com --compare (seção, métrica)
+COMPARED_METRICS = [
+    ('ingestion', 'pdfs_per_second'), ('ingestion', 'chunks_per_second'), ('warm_start', 'seconds'),
+    ('retrieval', 'p50'), ('retrieval', 'p95'), ('retrieval', 'p99'),
+    ('answer', 'p50'), ('answer', 'p95'), ('answer', 'p99'),
+    ('voice_answer', 'p50'), ('voice_answer', 'p95'), ('sessions', 'bytes_per_session'),
+]
+
+app = typer.Typer(help="Benchmark offline do bot com dublês locais de S3, Bedrock, Transcribe e Telegram.")
+
+
+def latency_summary(samples):
+    """
+    Percentis (p50/p95/p99), média e máximo de uma lista de latências em segundos.
+    """
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+    return {'count': len(ordered), 'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99),
+            'mean': statistics.fmean(ordered), 'max': ordered[-1]}
+
+
+def prepare_bucket(dataset, bucket_dir):
+    """
+    Copia os PDFs do dataset (pasta ou .zip) para o bucket local. Retorna o número de PDFs.
+    """
+    os.makedirs(bucket_dir, exist_ok=True)
+    if zipfile.is_zipfile(dataset):
+        with zipfile.ZipFile(dataset) as archive:
+            members = [name for name in archive.namelist() if name.lower().endswith('.pdf')]
+            archive.extractall(bucket_dir, members)
+        return len(members)
+
+    count = 0
+    for path in Path(dataset).rglob('*.pdf'):
+        target = Path(bucket_dir) / path.relative_to(dataset)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, target)
+        count += 1
+    return count
+
+
+def run_users(users, worker):
+    """
+    Executa `worker(user_index)` em uma thread por usuário simulado e aguarda todas terminarem.
+    """
+    threads = [threading.Thread(target=worker, args=(i,), name=f"user-{i}") for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def print_comparison(results, previous_path):
+    with open(previous_path, 'r', encoding='utf-8') as file:
+        previous = json.load(file)
+
+    typer.echo(f"\nComparação com {previous_path}:")
+    for section, metric in COMPARED_METRICS:
+        old = previous.get(section, {}).get(metric)
+        new = results.get(section, {}).get(metric)
+        if not old or new is None:
+            continue
+        typer.echo(f"  {section}.{metric}: {old:.4g} -> {new:.4g} ({(new - old) / old * 100:+.1f}%)")
+
+
+@app.command()
+def run(
+    dataset: Path = typer.Option(DEFAULT_DATASET, help="Pasta ou .zip com os PDFs do bucket simulado."),
+    users: int = typer.Option(10, help="Usuários simulados simultâneos."),
+    questions_per_user: int = typer.Option(5, help="Perguntas enviadas por usuário (em sequência)."),
+    voice_ratio: float = typer.Option(0.2, help="Fração das perguntas enviadas como áudio."),
+    embedding_dim: int = typer.Option(1024, help="Dimensão dos embeddings simulados."),
+    embedding_latency: float = typer.Option(0.02, help="Latência simulada por texto embedado (s)."),
+    llm_first_token: float = typer.Option(0.6, help="Latência simulada até o primeiro token do LLM (s)."),
+    llm_tokens_per_second: float = typer.Option(80.0, help="Velocidade simulada do LLM (tokens/s)."),
+    transcribe_latency: float = typer.Option(1.0, help="Duração simulada de um job do Transcribe (s)."),
+    telegram_latency: float = typer.Option(0.03, help="Latência simulada por chamada da API do Telegram (s)."),
+    s3_latency: float = typer.Option(0.01, help="Latência simulada por chamada do S3 (s)."),
+    stream: bool = typer.Option(False, help="Responder em streaming (edições de mensagem)."),
+    bedrock_capacity: int = typer.Option(0, help="Usa o BedrockEmbeddings e o ChatBedrock reais contra um Bedrock "
+                                                 "simulado que responde com throttling acima de N chamadas "
+                                                 "simultâneas (0: dublês de embeddings e LLM, sem o client)."),
+    seed: int = typer.Option(42, help="Semente para a escolha das perguntas."),
+    workdir: Path = typer.Option(None, help="Diretório de trabalho (padrão: temporário, apagado ao final)."),
+    output: Path = typer.Option(None, help="Arquivo JSON com os resultados (padrão: benchmarks/benchmark-<data>.json)."),
+    compare: Path = typer.Option(None, help="Resultado anterior (JSON) para comparar."),
+):
+    """
+    Mede a ingestão (PDFs/s e chunks/s), a latência de busca e de resposta (p50/p95/p99) com usuários
+    simultâneos e a memória por sessão, executando o código real do bot contra dublês locais.
+    """
+    dataset = dataset.resolve()
+    output = (output or Path('benchmarks') / f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json").resolve()
+    compare = compare.resolve() if compare else None
+    original_dir = os.getcwd()
+    workdir = Path(workdir).resolve() if workdir else Path(tempfile.mkdtemp(prefix='themis-benchmark-'))
+    keep_workdir = workdir.exists() and any(workdir.iterdir())
+    workdir.mkdir(parents=True, exist_ok=True)
+    random.seed(seed)
+
+    # O bot usa caminhos relativos (dataset/, vector_store/, cache/, historicos/)
+    os.chdir(workdir)
+    try:
+        results = _run(dataset, users, questions_per_user, voice_ratio, embedding_dim, embedding_latency,
+                       llm_first_token, llm_tokens_per_second, transcribe_latency, telegram_latency,
+                       s3_latency, stream, bedrock_capacity)
+    finally:
+        os.chdir(original_dir)
+        if not keep_workdir and workdir.name.startswith('themis-benchmark-'):
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results['config'] = {
+        'dataset': str(dataset), 'users': users, 'questions_per_user': questions_per_user,
+        'voice_ratio': voice_ratio, 'embedding_dim': embedding_dim, 'embedding_latency': embedding_latency,
+        'llm_first_token': llm_first_token, 'llm_tokens_per_second': llm_tokens_per_second,
+        'transcribe_latency': transcribe_latency, 'telegram_latency': telegram_latency,
+        's3_latency': s3_latency, 'stream': stream, 'bedrock_capacity': bedrock_capacity, 'seed': seed,
+        'vector_backend': os.getenv('VECTOR_BACKEND', 'chroma'),
+        'retrieval_mode': os.getenv('RETRIEVAL_MODE', 'hybrid'),
+    }
+    results['timestamp'] = datetime.now().isoformat(timespec='seconds')
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+
+    typer.echo("\nResultados:")
+    for section in ('ingestion', 'warm_start', 'retrieval', 'answer', 'voice_answer', 'sessions'):
+        values = ', '.join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+                           for key, value in results[section].items())
+        typer.echo(f"  {section}: {values}")
+    stages = ', '.join(f"{stage}={summary['mean'] * 1000:.1f}ms" for stage, summary in sorted(results['stages'].items()))
+    typer.echo(f"  stages (média): {stages}")
+    if 'bedrock' in results:
+        typer.echo(f"  bedrock: limite={results['bedrock']['limiter']}, serviço={results['bedrock']['service']}")
+    typer.echo(f"Resultados salvos em {output}")
+
+    if compare:
+        print_comparison(results, compare)
+
+
+def _run(dataset, users, questions_per_user, voice_ratio, embedding_dim, embedding_latency, llm_first_token,
+         llm_tokens_per_second, transcribe_latency, telegram_latency, s3_latency, stream, bedrock_capacity=0):
+    results = {}
+    pdf_count = prepare_bucket(dataset, os.path.join('fake_s3', BUCKET_NAME))
+
+    s3_resource = FakeS3Resource('fake_s3', latency=s3_latency)
+    transcribe_client = FakeTranscribeClient(s3_resource.meta.client, latency=transcribe_latency)
+    if bedrock_capacity:
+        # O caminho completo do client: controle de admissão, retries e o formato das APIs do Bedrock.
+        # O ChatBedrock exige uma região mesmo com o client informado; nenhuma chamada chega à AWS
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        bedrock_client = ThrottlingBedrockClient(capacity=bedrock_capacity, embedding_size=embedding_dim,
+                                                 embedding_latency=embedding_latency,
+                                                 first_token_latency=llm_first_token,
+                                                 tokens_per_second=llm_tokens_per_second)
+        embeddings = bedrock_client.embeddings
+        bedrock_handler = BedrockUtils(bedrock_client=bedrock_client)
+    else:
+        bedrock_client = None
+        embeddings = HashingEmbeddings(size=embedding_dim, latency=embedding_latency)
+        bedrock_handler = BedrockUtils(
+            bedrock_client=OfflineBedrockClient(),
+            embeddings=embeddings,
+            llm_factory=lambda model_id: CannedLatencyChatModel(model_id=model_id,
+                                                                first_token_latency=llm_first_token,
+                                                                tokens_per_second=llm_tokens_per_second)
+        )
+    s3_handler = S3Utils(BUCKET_NAME, s3_resource=s3_resource)
+    transcribe_handle = Trasncribe(transcribe_client=transcribe_client,
+                                   http_session=FakeTranscriptHttp(transcribe_client))
+
+    # Ingestão a frio: download de todos os PDFs, extração, chunking e embeddings
+    start = time.perf_counter()
+    changes = s3_handler.sync_pdfs()
+    sync_seconds = time.perf_counter() - start
+    vector_store = bedrock_handler.make_embeddings(EMBEDDING_MODEL, changes['pdfs'], changes=changes)
+    ingestion_seconds = time.perf_counter() - start
+    chunks = bedrock_handler.chunk_count(vector_store)
+    results['ingestion'] = {
+        'pdfs': pdf_count, 'chunks': chunks, 'seconds': ingestion_seconds, 's3_sync_seconds': sync_seconds,
+        'pdfs_per_second': pdf_count / ingestion_seconds, 'chunks_per_second': chunks / ingestion_seconds,
+        'embedded_texts': embeddings.texts,
+    }
+
+    # Inicialização a quente: o warm-up do bot com o dataset e o índice já sincronizados
+    langchain_main = LangChainMain(BUCKET_NAME, EMBEDDING_MODEL, MODEL_ID, s3_handler=s3_handler,
+                                   bedrock_handler=bedrock_handler, transcribe_handle=transcribe_handle)
+    start = time.perf_counter()
+    langchain_main.warm_up()
+    results['warm_start'] = {'seconds': time.perf_counter() - start}
+
+    # Busca: usuários simultâneos consultando só o retriever
+    retriever = langchain_main.answer_engine.retriever
+    retrieval_latencies = []
+    lock = threading.Lock()
+
+    def retrieval_worker(user_index):
+        rng = random.Random(user_index)
+        for _ in range(questions_per_user):
+            question = rng.choice(QUESTIONS)
+            start = time.perf_counter()
+            retriever.invoke(question)
+            with lock:
+                retrieval_latencies.append(time.perf_counter() - start)
+
+    run_users(users, retrieval_worker)
+    results['retrieval'] = latency_summary(retrieval_latencies)
+
+    # Resposta de ponta a ponta pelos handlers do bot (texto e áudio)
+    # No streaming, a resposta só termina na edição final: a mensagem provisória e as parciais não contam
+    bot = FakeTelegramBot(latency=telegram_latency,
+                          is_provisional=lambda text: text == TelegramStreamer.PLACEHOLDER
+                          or text.endswith(TelegramStreamer.CURSOR))
+    session_cache = SessionCache('historicos', flush_interval=0.5).start()
+    dispatcher = UserDispatcher(max_workers=int(os.getenv('DISPATCHER_WORKERS', '8')),
+                                max_queue_per_user=questions_per_user, max_pending=users * questions_per_user)
+    transcription_scheduler = TranscriptionScheduler(s3_handler, transcribe_handle, BUCKET_NAME,
+                                                     initial_poll_interval=0.1, max_poll_interval=0.5,
+                                                     transcript_cache=TranscriptCache('cache/transcripts.sqlite3'))
+    register_handlers(bot, langchain_main, session_cache, dispatcher, transcription_scheduler,
+                      stream_responses=stream, stream_edit_interval=0.2)
+
+    answer_latencies = []
+    voice_latencies = []
+    timeouts = 0
+
+    def answer_worker(user_index):
+        nonlocal timeouts
+        rng = random.Random(1000 + user_index)
+        user_id = 10_000 + user_index
+        for sent in range(1, questions_per_user + 1):
+            question = rng.choice(QUESTIONS)
+            is_voice = rng.random() < voice_ratio
+            if is_voice:
+                message = bot.voice_message(user_id, f"Usuário {user_index}", question.encode('utf-8'))
+            else:
+                message = bot.text_message(user_id, f"Usuário {user_index}", question)
+
+            start = time.perf_counter()
+            bot.process_message(message)
+            if not bot.wait_for_messages(user_id, sent):
+                with lock:
+                    timeouts += 1
+                return
+            with lock:
+                (voice_latencies if is_voice else answer_latencies).append(time.perf_counter() - start)
+
+    try:
+        run_users(users, answer_worker)
+    finally:
+        transcription_scheduler.shutdown()
+        dispatcher.shutdown()
+        session_metrics = session_cache.metrics()
+        session_cache.close()
+
+    results['answer'] = latency_summary(answer_latencies)
+    results['answer']['timeouts'] = timeouts
+    results['voice_answer'] = latency_summary(voice_latencies)
+    resident = session_metrics['resident_sessions']
+    results['sessions'] = {
+        'resident_sessions': resident,
+        'resident_messages': session_metrics['resident_messages'],
+        'bytes_per_session': session_metrics['approx_bytes'] / resident if resident else 0.0,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    results['caches'] = {
+        'answer_cache': bedrock_handler.answer_cache.stats() if bedrock_handler.answer_cache else None,
+        'single_flight': bedrock_handler.single_flight.metrics() if bedrock_handler.single_flight else None,
+        'transcripts': transcription_scheduler.transcript_cache.stats(),
+        'dispatcher': dispatcher.metrics(),
+        'telegram_edits': bot.edits,
+    }
+    if bedrock_client is not None:
+        results['bedrock'] = {
+            'limiter': bedrock_handler.limiter.metrics() if bedrock_handler.limiter else None,
+            'service': bedrock_client.stats(),
+            'queue_wait': metrics.summary('bedrock_queue_wait_seconds', 'operation'),
+        }
+    results['stages'] = metrics.summary('stage_duration_seconds', 'stage')
+    return results
+
+
+if __name__ == "__main__":
+    app()
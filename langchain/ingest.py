@@ -0,0 +1,138 @@
+import os
+import shutil
+import time
+from datetime import datetime
+
+import dotenv
+import typer
+
+from utils.bedrockUtils import BedrockUtils
+from utils.indexManifest import IndexManifest
+from utils.s3Utils import S3Utils
+from utils.snapshotStore import SNAPSHOTS_PATH, SnapshotStore
+
+EMBEDDING_MODEL = 'amazon.titan-embed-text-v2:0'
+
+app = typer.Typer(help="Ingestão offline: gera versões (snapshots) do índice que o bot carrega sem reiniciar.")
+
+
+def build_snapshot(store, s3_handler, bedrock_handler, embedding_model, full=False, keep=3):
+    """
+    Sincroniza os PDFs do S3, gera um novo snapshot (a partir de uma cópia do atual, salvo com `full`),
+    publica-o e apaga os snapshots antigos. Retorna os dados do snapshot publicado.
+    """
+    backend = os.getenv('VECTOR_BACKEND', 'chroma').lower()
+    with store.ingest_lock():
+        start = time.perf_counter()
+        changes = s3_handler.sync_pdfs()
+        if not changes['pdfs']:
+            raise ValueError("Nenhum documento disponível no bucket.")
+
+        base = None if full else store.current()
+        if base is not None and store.info(base).get('backend', backend) != backend:
+            print(f"O snapshot atual usa o backend '{store.info(base).get('backend')}'. Gerando do zero.")
+            base = None
+
+        name = store.new_name()
+        staging_path = store.stage(name, base)
+        print(f"Gerando o snapshot {name}" + (f" a partir de {base}..." if base else " do zero..."))
+        try:
+            vector_store_path = os.path.join(staging_path, 'store') + os.sep
+            # Sem `changes`: os hashes são comparados com o manifesto do snapshot copiado, não com a última sincronização
+            vector_store = bedrock_handler.sync_vector_store(embedding_model, changes['pdfs'], vector_store_path)
+            if not vector_store.similarity_search("teste", k=1):
+                raise RuntimeError("a busca de teste no novo snapshot não retornou resultados")
+
+            manifest = IndexManifest.for_vector_store(vector_store_path)
+            info = {
+                'name': name,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'base': base,
+                'backend': backend,
+                'embedding_model': embedding_model,
+                'documents': len(manifest.documents),
+                'chunks': BedrockUtils.chunk_count(vector_store),
+                'corpus_version': manifest.fingerprint(),
+                'seconds': round(time.perf_counter() - start, 2),
+            }
+            store.publish(name, info)
+        except BaseException:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+
+        print(f"Snapshot {name} publicado: {info['documents']} documento(s), {info['chunks']} chunks, "
+              f"{time.perf_counter() - start:.2f}s.")
+        removed = store.cleanup(keep)
+        if removed:
+            print(f"Snapshots antigos removidos: {', '.join(removed)}")
+        return info
+
+
+@app.command()
+def build(
+    bucket: str = typer.Option(None, help="Bucket com os PDFs (padrão: variável BUCKET_NAME)."),
+    embedding_model: str = typer.Option(EMBEDDING_MODEL, help="Modelo de embeddings do Bedrock."),
+    snapshots_dir: str = typer.Option(None, help=f"Diretório dos snapshots (padrão: SNAPSHOTS_PATH ou {SNAPSHOTS_PATH})."),
+    full: bool = typer.Option(False, help="Gera o índice do zero em vez de partir do snapshot atual."),
+    keep: int = typer.Option(3, help="Quantidade de snapshots antigos mantidos após a publicação."),
+):
+    """
+    Sincroniza os PDFs do S3, extrai, divide e embeda os documentos em um novo snapshot e o publica.
+    O snapshot parte de uma cópia do atual, então apenas os PDFs novos ou alterados são embedados.
+    Os bots em execução passam a usar a nova versão na próxima verificação do CURRENT.
+    """
+    dotenv.load_dotenv()
+    store = SnapshotStore(snapshots_dir or os.getenv('SNAPSHOTS_PATH', SNAPSHOTS_PATH))
+    try:
+        build_snapshot(store, S3Utils(bucket or os.getenv('BUCKET_NAME')), BedrockUtils(), embedding_model,
+                       full=full, keep=keep)
+    except ValueError as e:
+        typer.echo(f"{e} Nenhum snapshot gerado.")
+        raise typer.Exit(1)
+
+
+@app.command('list')
+def list_snapshots(snapshots_dir: str = typer.Option(None, help="Diretório dos snapshots.")):
+    """
+    Lista os snapshots, indicando o atual e os que estão em uso por algum bot.
+    """
+    dotenv.load_dotenv()
+    store = SnapshotStore(snapshots_dir or os.getenv('SNAPSHOTS_PATH', SNAPSHOTS_PATH))
+    current = store.current()
+    for name in store.list():
+        info = store.info(name)
+        flags = ' '.join(flag for flag, active in (('[atual]', name == current), ('[em uso]', store.in_use(name)))
+                         if active)
+        typer.echo(f"{name}  {info.get('documents', '?')} docs  {info.get('chunks', '?')} chunks  "
+                   f"{info.get('backend', '?')}  {flags}".rstrip())
+
+
+@app.command()
+def activate(name: str, snapshots_dir: str = typer.Option(None, help="Diretório dos snapshots.")):
+    """
+    Aponta o CURRENT para outro snapshot existente (ex.: voltar para a versão anterior).
+    """
+    dotenv.load_dotenv()
+    store = SnapshotStore(snapshots_dir or os.getenv('SNAPSHOTS_PATH', SNAPSHOTS_PATH))
+    with store.ingest_lock():
+        store.activate(name)
+    typer.echo(f"Snapshot atual: {name}")
+
+
+@app.command()
+def cleanup(
+    keep: int = typer.Option(3, help="Quantidade de snapshots mantidos."),
+    snapshots_dir: str = typer.Option(None, help="Diretório dos snapshots."),
+):
+    """
+    Apaga os snapshots antigos que não são o atual e não estão em uso por nenhum bot.
+    """
+    dotenv.load_dotenv()
+    store = SnapshotStore(snapshots_dir or os.getenv('SNAPSHOTS_PATH', SNAPSHOTS_PATH))
+    with store.ingest_lock():
+        removed = store.cleanup(keep)
+    typer.echo(f"Snapshots removidos: {', '.join(removed)}" if removed else "Nenhum snapshot removido.")
+
+
+if __name__ == "__main__":
+    app()
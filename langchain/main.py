@@ -1,8 +1,19 @@
 from utils.s3Utils import S3Utils
 from utils.dataUtils import DataHandler
+from utils.sessionCache import SessionCache
+from utils.dispatcher import UserDispatcher
+from utils.telegramStreamer import TelegramStreamer
+from utils.transcriptionScheduler import TranscriptionScheduler
+from utils.transcriptCache import TranscriptCache
 from utils.bedrockUtils import BedrockUtils
+from utils.bedrockLimiter import bedrock_user, is_throttling_error
 from utils.transcribeUtils import Trasncribe
+from utils.metrics import metrics
+from utils.snapshotStore import SNAPSHOTS_PATH, SnapshotStore
+from contextlib import contextmanager
 import os
+import threading
+import time
 import dotenv
 import telebot
  
@@ -10,159 +21,410 @@ class LangChainMain:
     """
     Classe principal para executar operações com o LangChain e S3.
     """
-    def __init__(self, bucket_name):
-        self.s3_handler = S3Utils(bucket_name)
-        self.bedrock_handler = BedrockUtils()
-        self.transcribe_handle = Trasncribe()
+    WARMING_UP_MESSAGE = "A Themis está iniciando e carregando os documentos. Tente novamente em alguns instantes."
+    NO_DOCUMENTS_MESSAGE = "Não existe nenhum documento para basear minha resposta."
+    BUSY_MESSAGE = "Você já tem mensagens em processamento. Aguarde as respostas antes de enviar novas perguntas."
+    OVERLOADED_MESSAGE = "A Themis está recebendo muitas perguntas no momento. Tente novamente em alguns instantes."
+ 
+    def __init__(self, bucket_name, embedding_model, model_id, s3_handler=None, bedrock_handler=None,
+                 transcribe_handle=None, snapshot_store=None):
+        """
+        Os utilitários de S3, Bedrock e Transcribe podem ser passados já criados (ex.: com dublês locais no benchmark).
+        Com `snapshot_store` (SnapshotStore), o índice é carregado dos snapshots gerados pelo `ingest.py`
+        em vez de ser sincronizado e embedado pelo próprio bot.
+        """
+        self.s3_handler = s3_handler or S3Utils(bucket_name)
+        self.bedrock_handler = bedrock_handler or BedrockUtils()
+        self.transcribe_handle = transcribe_handle or Trasncribe()
+        self.embedding_model = embedding_model
+        self.model_id = model_id
         self.vector_store = None
+        self.answer_engine = None
+        self.snapshot_store = snapshot_store
+        self.snapshot_name = None
+        self.ready = threading.Event()
+        self._setup_lock = threading.Lock()
+        # Requisições em andamento por snapshot: o snapshot substituído só é liberado quando elas terminam
+        self._engine_lock = threading.Lock()
+        self._in_flight = {}
+        self._snapshot_vector_stores = {}  # snapshot -> vector store aberto sobre ele
  
-    def run(self, question, userName, history):
+    def warm_up(self):
         """
-        Executa o processo principal.
+        Fase de inicialização: sincroniza os PDFs do S3, carrega/atualiza o vector store,
+        monta o motor de respostas e faz uma busca de teste. Ao final marca o bot como pronto.
+        Sem documentos, o bot fica pronto (respondendo que não há documentos) e uma nova chamada
+        tenta montar o motor outra vez.
         """
+        with self._setup_lock:
+            if self.answer_engine is not None:
+                return
+ 
+            snapshot = self.snapshot_store.current() if self.snapshot_store is not None else None
+            if snapshot is not None:
+                print(f"Inicialização: carregando o snapshot do índice {snapshot}...")
+                setup_start = time.perf_counter()
+                self.activate_snapshot(snapshot)
+                self.ready.set()
+                print(f"Setup concluído em {time.perf_counter() - setup_start:.2f}s.")
+                return
+ 
+            print("Inicialização: realizando setup (download e embeddings)...")
+            setup_start = time.perf_counter()
+ 
+            step_start = time.perf_counter()
+            with metrics.span('s3_sync'):
+                dataset_changes = self.s3_handler.sync_pdfs()
+            pdf_dataset = dataset_changes['pdfs']
+            print(f"[setup] Sincronização do dataset: {time.perf_counter() - step_start:.2f}s")
  
-        if self.vector_store is None:
-            print("Primeira execução: Realizando setup inicial (download e embeddings)...")
-            pdf_dataset = self.s3_handler.download_pdfs(self.s3_handler.list_all_pdfs())
-           
             if not pdf_dataset:
-                return "Não existe nenhum documento para basear minha resposta."
-           
-            self.vector_store = self.bedrock_handler.make_embeddings(EMBEDDING_MODEL, pdf_dataset)
-            print("Setup inicial concluído.")
-       
-        print(self.vector_store._collection.count())
+                print("Nenhum documento disponível no bucket. O bucket será verificado novamente.")
+                self.ready.set()
+                return
  
-        response = self.bedrock_handler.ask_llm(MODEL_ID, self.vector_store, question, userName, history)
-       
-        return response
+            step_start = time.perf_counter()
+            self.vector_store = self.bedrock_handler.make_embeddings(self.embedding_model, pdf_dataset, changes=dataset_changes)
+            print(f"[setup] Vector store: {time.perf_counter() - step_start:.2f}s "
+                  f"({self.bedrock_handler.chunk_count(self.vector_store)} chunks)")
  
-if __name__ == "__main__":
-    dotenv.load_dotenv()
+            step_start = time.perf_counter()
+            answer_engine = self.bedrock_handler.make_answer_engine(self.model_id, self.vector_store)
+            print(f"[setup] Motor de respostas: {time.perf_counter() - step_start:.2f}s")
  
-    BOT_TOKEN = os.getenv('BOT_API_TOKEN')
-    BUCKET_NAME = os.getenv('BUCKET_NAME')
+            step_start = time.perf_counter()
+            test_docs = answer_engine.retriever.invoke("teste")
+            print(f"[setup] Busca de teste: {time.perf_counter() - step_start:.2f}s ({len(test_docs)} documentos)")
  
-    bot = telebot.TeleBot(BOT_TOKEN)
+            self.answer_engine = answer_engine
+            self.ready.set()
+            print(f"Setup concluído em {time.perf_counter() - setup_start:.2f}s.")
  
-    EMBEDDING_MODEL = 'amazon.titan-embed-text-v2:0'
-    MODEL_ID = 'amazon.nova-pro-v1:0'
+    def start_warm_up(self, retry_interval=30):
+        """
+        Executa o warm-up em uma thread em segundo plano, tentando novamente a cada `retry_interval`
+        segundos enquanto não houver motor de respostas (erro ou bucket ainda sem documentos).
+        """
+        def worker():
+            while self.answer_engine is None:
+                try:
+                    self.warm_up()
+                except Exception as e:
+                    print(f"Erro na inicialização: {e}. Nova tentativa em {retry_interval}s...")
+                if self.answer_engine is None:
+                    time.sleep(retry_interval)
  
-    # O cache em memória para as conversas ativas
-    message_history = {}
+        thread = threading.Thread(target=worker, name="warm-up", daemon=True)
+        thread.start()
+        return thread
  
-    print("Inicializando instâncias...")
-    langchain_main = LangChainMain(BUCKET_NAME)
-    data_handler = DataHandler()
-   
-    @bot.message_handler(func=lambda message: True)
-    def handle_message(msg: telebot.types.Message):
-        global message_history # Use global para modificar
+    def activate_snapshot(self, name):
+        """
+        Carrega o snapshot, monta um novo motor de respostas e o coloca em uso de uma só vez.
+        As requisições em andamento terminam no motor anterior.
+        """
+        info = self.snapshot_store.info(name)
+        vector_store_path = self.snapshot_store.vector_store_path(name)
+        self.snapshot_store.acquire(name)
+        vector_store = None
+        try:
+            step_start = time.perf_counter()
+            vector_store = self.bedrock_handler.make_vector_store(info.get('embedding_model', self.embedding_model),
+                                                                  vector_store_path, backend=info.get('backend'))
+            answer_engine = self.bedrock_handler.make_answer_engine(self.model_id, vector_store, vector_store_path)
+            answer_engine.retriever.invoke("teste")
+        except Exception:
+            if vector_store is not None:
+                self.bedrock_handler.close_vector_store(vector_store)
+            self.snapshot_store.release(name)
+            raise
+ 
+        with self._engine_lock:
+            previous = self.snapshot_name
+            self.vector_store, self.answer_engine, self.snapshot_name = vector_store, answer_engine, name
+            self._snapshot_vector_stores[name] = vector_store
+            release_previous = previous is not None and previous != name and not self._in_flight.get(previous)
+        if release_previous:
+            self._release_snapshot(previous)
+        print(f"Snapshot {name} em uso ({self.bedrock_handler.chunk_count(vector_store)} chunks, "
+              f"carregado em {time.perf_counter() - step_start:.2f}s).")
+ 
+    def _release_snapshot(self, name):
+        """
+        Fecha o vector store aberto sobre o snapshot e o devolve ao SnapshotStore, que pode então removê-lo.
+        """
+        with self._engine_lock:
+            vector_store = self._snapshot_vector_stores.pop(name, None)
+        if vector_store is not None:
+            self.bedrock_handler.close_vector_store(vector_store)
+        self.snapshot_store.release(name)
+ 
+    def check_snapshot(self):
+        """
+        Troca para o snapshot apontado pelo CURRENT, se ele mudou.
+        """
+        # Exclusivo com o warm-up, que também pode ativar um snapshot enquanto não há motor de respostas
+        with self._setup_lock:
+            current = self.snapshot_store.current()
+            if current is not None and current != self.snapshot_name:
+                print(f"Novo snapshot do índice publicado: {current}.")
+                self.activate_snapshot(current)
+ 
+    def start_snapshot_watcher(self, interval=30):
+        """
+        Verifica o CURRENT a cada `interval` segundos em uma thread em segundo plano.
+        """
+        def worker():
+            while True:
+                time.sleep(interval)
+                if not self.ready.is_set():
+                    continue
+                try:
+                    self.check_snapshot()
+                except Exception as e:
+                    print(f"Erro ao carregar o novo snapshot: {e}. O índice atual continua em uso.")
+ 
+        thread = threading.Thread(target=worker, name="snapshot-watcher", daemon=True)
+        thread.start()
+        return thread
+ 
+    @contextmanager
+    def _use_engine(self):
+        """
+        Fornece o motor de respostas atual e o mantém registrado como em uso até o fim da requisição.
+        """
+        with self._engine_lock:
+            answer_engine, snapshot = self.answer_engine, self.snapshot_name
+            self._in_flight[snapshot] = self._in_flight.get(snapshot, 0) + 1
+        try:
+            yield answer_engine
+        finally:
+            with self._engine_lock:
+                self._in_flight[snapshot] -= 1
+                release = snapshot is not None and snapshot != self.snapshot_name and not self._in_flight[snapshot]
+                if not self._in_flight[snapshot]:
+                    del self._in_flight[snapshot]
+            if release:
+                self._release_snapshot(snapshot)
+ 
+    def close(self):
+        """
+        Libera o snapshot em uso por este processo.
+        """
+        if self.snapshot_store is not None and self.snapshot_name is not None:
+            self._release_snapshot(self.snapshot_name)
+ 
+    def run(self, question, userName, history, user_id=None):
+        """
+        Executa o processo principal.
+        """
+        if not self.ready.is_set():
+            return self.WARMING_UP_MESSAGE
+ 
+        if self.answer_engine is None:
+            return self.NO_DOCUMENTS_MESSAGE
+ 
+        with self._use_engine() as answer_engine, metrics.span('answer'):
+            response = answer_engine.answer(question, userName, history, session_id=user_id)
        
-        QUESTION = msg.text
+        return response
+ 
+    def run_stream(self, question, userName, history, user_id=None):
+        """
+        Executa o processo principal entregando a resposta em partes, à medida que o modelo as gera.
+        """
+        if not self.ready.is_set():
+            yield self.WARMING_UP_MESSAGE
+            return
+ 
+        if self.answer_engine is None:
+            yield self.NO_DOCUMENTS_MESSAGE
+            return
+ 
+        with self._use_engine() as answer_engine, metrics.span('answer'):
+            yield from answer_engine.stream(question, userName, history, session_id=user_id)
+ 
+def register_handlers(bot, langchain_main, session_cache, dispatcher, transcription_scheduler,
+                      stream_responses=True, stream_edit_interval=1.5):
+    """
+    Registra no bot os handlers de texto e de áudio.
+    """
+    def answer_question(msg, question, kind='text'):
+        """
+        Responde a pergunta do usuário e registra a troca no histórico.
+        `kind` identifica a origem da pergunta ('text' ou 'voice') nas métricas; as chamadas ao Bedrock
+        ficam associadas ao usuário para o rodízio da fila de admissão.
+        """
+        with metrics.request(kind), bedrock_user(msg.from_user.id):
+            _answer_question(msg, question)
+ 
+    def _answer_question(msg, question):
         user_name = msg.from_user.first_name
         user_id = msg.from_user.id
  
-        if user_id not in message_history:
-            print(f"Usuário {user_id} não está em cache. Carregando histórico do disco...")
-            data_handler.user_id = user_id
-            loaded_history = data_handler.load_data()
-            message_history[user_id] = loaded_history if loaded_history is not None else []
-       
-       
- 
-        print(f"Recebida pergunta de {user_name} (ID: {user_id})")
+        print(f"Recebida pergunta de {user_name} (ID: {user_id}, requisição {metrics.request_id()})")
        
         try:
-            response = langchain_main.run(
-                question=QUESTION,
-                userName=user_name,
-                history=message_history[user_id]
-            )
- 
-            message_history[user_id].append({"role": "user", "content": QUESTION})
-            message_history[user_id].append({"role": "Themis", "content": response})
+            if stream_responses:
+                streamer = TelegramStreamer(bot, msg.chat.id, min_interval=stream_edit_interval)
+                response = streamer.stream(langchain_main.run_stream(
+                    question=question,
+                    userName=user_name,
+                    history=session_cache.get_history(user_id),
+                    user_id=user_id
+                ))
+            else:
+                response = langchain_main.run(
+                    question=question,
+                    userName=user_name,
+                    history=session_cache.get_history(user_id),
+                    user_id=user_id
+                )
+                with metrics.span('telegram_send'):
+                    bot.send_message(msg.chat.id, response)
  
-            data_handler.user_id = user_id
-            data_handler.save_data(message_history[user_id])
-           
-            bot.send_message(msg.chat.id, response)
+            new_messages = [{"role": "user", "content": question}, {"role": "Themis", "content": response}]
+            session_cache.append(user_id, new_messages)
            
         except Exception as e:
             print(f"Ocorreu um erro: {e}")
-            bot.send_message(msg.chat.id, "Ocorreu um erro ao processar sua solicitação. Tente novamente.")
+            if is_throttling_error(e):
+                bot.send_message(msg.chat.id, LangChainMain.OVERLOADED_MESSAGE)
+            else:
+                bot.send_message(msg.chat.id, "Ocorreu um erro ao processar sua solicitação. Tente novamente.")
+ 
+    def dispatch(msg, task, *args):
+        """
+        Enfileira o processamento da mensagem no dispatcher, avisando o usuário se a fila estiver cheia.
+        """
+        if not langchain_main.ready.is_set():
+            bot.send_message(msg.chat.id, LangChainMain.WARMING_UP_MESSAGE)
+            return
  
+        if not dispatcher.submit(msg.from_user.id, task, *args):
+            bot.send_message(msg.chat.id, LangChainMain.BUSY_MESSAGE)
+ 
+    @bot.message_handler(func=lambda message: True)
+    def handle_message(msg: telebot.types.Message):
+        dispatch(msg, answer_question, msg, msg.text)
  
     @bot.message_handler(content_types=['audio', 'voice'])
     def message_audio(msg:telebot.types.Message):
-        global message_history # Use global para modificar
+        if not langchain_main.ready.is_set():
+            bot.send_message(msg.chat.id, LangChainMain.WARMING_UP_MESSAGE)
+            return
  
-        user_name = msg.from_user.first_name
-        user_id = msg.from_user.id
-       
-        try:
-            file_id = msg.voice.file_id if msg.voice else msg.audio.file_id
-            file_info = bot.get_file(file_id)
-            file_dowload = bot.download_file(file_info.file_path)
- 
-            local_filename = 'audio.ogg'
-            with open (local_filename, 'wb') as file:
-                file.write(file_dowload)
+        # A vaga na fila do usuário é reservada na chegada do áudio: mensagens enviadas durante a
+        # transcrição são respondidas depois dele
+        reservation = dispatcher.reserve(msg.from_user.id)
+        if reservation is None:
+            bot.send_message(msg.chat.id, LangChainMain.BUSY_MESSAGE)
+            return
  
-        except Exception as e:
-            print(f'erro ao receber audio {e}')
+        audio = msg.voice or msg.audio
  
-        try:            
-            s3_path = langchain_main.s3_handler.upload_file(local_filename)
-            os.remove(local_filename)
+        def fetch_audio():
+            file_info = bot.get_file(audio.file_id)
+            return bot.download_file(file_info.file_path)
  
-            s3_audio_url = f's3://{BUCKET_NAME}/{s3_path}'
-        except Exception as e:
-            print(f'erro ao salvar s3 {e}')
+        def on_transcript(question):
+            print(question)
+            reservation.fill(answer_question, msg, question, 'voice')
  
+        def on_error(error):
+            reservation.fill(bot.send_message, msg.chat.id, "Não foi possível transcrever o seu áudio. Tente novamente.")
  
         try:
-            job_name = langchain_main.transcribe_handle.audio_transcripition(s3_audio_url)
-           
-            trancription_url = langchain_main.transcribe_handle.wait_trancripition(job_name)
-               
-            QUESTION = langchain_main.transcribe_handle.download_transcription(trancription_url)
-        except Exception as e:
-            print(f'erro na trancrição do audio {e}')
-       
-        print(QUESTION)
+            transcription_scheduler.submit(fetch_audio, on_transcript, on_error, file_unique_id=audio.file_unique_id)
+        except RuntimeError:
+            # Agendador em encerramento
+            reservation.cancel()
+            raise
  
-        if user_id not in message_history:
-            print(f"Usuário {user_id} não está em cache. Carregando histórico do disco...")
-            data_handler.user_id = user_id
-            loaded_history = data_handler.load_data()
-            message_history[user_id] = loaded_history if loaded_history is not None else []
-       
-       
+if __name__ == "__main__":
+    dotenv.load_dotenv()
  
-        print(f"Recebida pergunta de {user_name} (ID: {user_id})")
-       
-        try:
-            response = langchain_main.run(
-                question=QUESTION,
-                userName=user_name,
-                history=message_history[user_id]
-            )
+    BOT_TOKEN = os.getenv('BOT_API_TOKEN')
+    BUCKET_NAME = os.getenv('BUCKET_NAME')
  
-            message_history[user_id].append({"role": "user", "content": QUESTION})
-            message_history[user_id].append({"role": "Themis", "content": response})
+    bot = telebot.TeleBot(BOT_TOKEN)
  
-            data_handler.user_id = user_id
-            data_handler.save_data(message_history[user_id])
-           
-            bot.send_message(msg.chat.id, response)
-           
-        except Exception as e:
-            print(f"Ocorreu um erro: {e}")
-            bot.send_message(msg.chat.id, "Ocorreu um erro ao processar sua solicitação. Tente novamente.")
+    EMBEDDING_MODEL = 'amazon.titan-embed-text-v2:0'
+    MODEL_ID = 'amazon.nova-pro-v1:0'
+ 
+    # Respostas em streaming: a mensagem é atualizada aos poucos, no máximo uma edição a cada STREAM_EDIT_INTERVAL segundos
+    STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'
+    STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.5'))
+ 
+    # Quantas mensagens do histórico salvo são carregadas para a memória
+    HISTORY_LOAD_MESSAGES = int(os.getenv('HISTORY_LOAD_MESSAGES', '100'))
  
+    # Endpoint local das métricas (formato Prometheus); METRICS_PORT=0 desativa.
+    # Requisições acima de SLOW_REQUEST_SECONDS são amostradas (SLOW_REQUEST_SAMPLE_RATE) em logs/slow_requests.jsonl
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+    metrics.configure(
+        slow_request_seconds=float(os.getenv('SLOW_REQUEST_SECONDS', '10')),
+        slow_sample_rate=float(os.getenv('SLOW_REQUEST_SAMPLE_RATE', '1.0')),
+        slow_log_path=os.getenv('SLOW_REQUEST_LOG', 'logs/slow_requests.jsonl')
+    )
  
+    print("Inicializando instâncias...")
+    # Snapshots do índice gerados pelo ingest.py; sem nenhum publicado, o bot indexa os PDFs na inicialização
+    snapshot_store = SnapshotStore(os.getenv('SNAPSHOTS_PATH', SNAPSHOTS_PATH))
+    langchain_main = LangChainMain(BUCKET_NAME, EMBEDDING_MODEL, MODEL_ID, snapshot_store=snapshot_store)
+    DataHandler.migrate_legacy_files('historicos')
+ 
+    # O cache em memória para as conversas ativas, com expulsão das inativas e gravação em segundo plano
+    session_cache = SessionCache(
+        'historicos',
+        max_sessions=int(os.getenv('SESSION_CACHE_MAX_SESSIONS', '500')),
+        idle_ttl=int(os.getenv('SESSION_CACHE_IDLE_TTL', '1800')),
+        flush_interval=float(os.getenv('SESSION_CACHE_FLUSH_INTERVAL', '2')),
+        load_messages=HISTORY_LOAD_MESSAGES
+    ).start()
    
+    # Transcrições rodam fora das threads de atendimento; a resposta segue pelo dispatcher quando o texto fica pronto
+    transcription_scheduler = TranscriptionScheduler(
+        langchain_main.s3_handler,
+        langchain_main.transcribe_handle,
+        BUCKET_NAME,
+        max_concurrent_jobs=int(os.getenv('TRANSCRIBE_MAX_CONCURRENT_JOBS', '4')),
+        transcript_cache=TranscriptCache(max_bytes=int(os.getenv('TRANSCRIPT_CACHE_MAX_BYTES', str(20 * 1024 * 1024))))
+    )
+ 
+    # Mensagens de usuários diferentes são processadas em paralelo; as de um mesmo usuário, em ordem
+    dispatcher = UserDispatcher(
+        max_workers=int(os.getenv('DISPATCHER_WORKERS', '8')),
+        max_queue_per_user=int(os.getenv('DISPATCHER_MAX_QUEUE_PER_USER', '5')),
+        max_pending=int(os.getenv('DISPATCHER_MAX_PENDING', '200'))
+    )
+ 
+    register_handlers(bot, langchain_main, session_cache, dispatcher, transcription_scheduler,
+                      stream_responses=STREAM_RESPONSES, stream_edit_interval=STREAM_EDIT_INTERVAL)
+ 
+    metrics.register_gauges('session_cache', session_cache.metrics)
+    metrics.register_gauges('dispatcher', dispatcher.metrics)
+    metrics.register_gauges('transcription', transcription_scheduler.metrics)
+    metrics.register_gauges('transcript_cache', transcription_scheduler.transcript_cache.stats)
+    metrics.register_gauges('answer_cache', lambda: langchain_main.bedrock_handler.answer_cache.stats()
+                            if langchain_main.bedrock_handler.answer_cache is not None else {})
+    metrics.register_gauges('single_flight', lambda: langchain_main.bedrock_handler.single_flight.metrics()
+                            if langchain_main.bedrock_handler.single_flight is not None else {})
+    metrics.register_gauges('bedrock', lambda: langchain_main.bedrock_handler.limiter.metrics()
+                            if langchain_main.bedrock_handler.limiter is not None else {})
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT, host=os.getenv('METRICS_HOST', '127.0.0.1'))
+ 
+    # O setup roda antes do polling; até terminar, os usuários recebem o aviso de inicialização
+    SNAPSHOT_POLL_INTERVAL = float(os.getenv('SNAPSHOT_POLL_INTERVAL', '30'))
+    langchain_main.start_warm_up(retry_interval=SNAPSHOT_POLL_INTERVAL)
+    langchain_main.start_snapshot_watcher(interval=SNAPSHOT_POLL_INTERVAL)
  
     print("Bot iniciado e aguardando mensagens...")
-    bot.infinity_polling()
\ No newline at end of file
+    try:
+        bot.infinity_polling()
+    finally:
+        transcription_scheduler.shutdown()
+        dispatcher.shutdown()
+        session_cache.close()
+        langchain_main.close()
\ No newline at end of file
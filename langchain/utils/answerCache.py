@@ -0,0 +1,128 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Palavras que indicam que a pergunta depende do que foi dito antes na conversa
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(isso|isto|aquilo|disso|disto|daquilo|nisso|nisto|esse|essa|esses|essas|desse|dessa|nesse|nessa|"
+    r"este|esta|estes|estas|deste|desta|ele|ela|eles|elas|dele|dela|deles|delas|nele|nela|"
+    r"mencionad[oa]s?|citad[oa]s?|anterior|anteriormente|acima|continue|continuar|"
+    r"explique melhor|mais detalhes)\b|^e (se|quanto|sobre|o|a|os|as)\b"
+)
+
+
+def is_follow_up(question):
+    """
+    Indica se a pergunta parece ser uma continuação da conversa (referências como "isso", "o artigo mencionado")
+    ou é curta demais para fazer sentido sozinha.
+    """
+    # Os acentos são mantidos: sem eles "está" viraria o pronome "esta"
+    text = ' '.join(question.lower().split())
+    return len(text.split()) < 3 or FOLLOW_UP_PATTERN.search(text) is not None
+
+
+class SemanticAnswerCache:
+    """
+    Cache de respostas indexado pelo embedding da pergunta: perguntas com similaridade de cosseno acima
+    do limiar reaproveitam a resposta já gerada. Possui limite de tamanho, expulsão LRU, expiração por TTL
+    e é esvaziado automaticamente quando a versão do acervo indexado muda.
+    Como as respostas são entregues a qualquer usuário, só devem ser guardadas as geradas sem o histórico,
+    o resumo ou o nome de quem perguntou (ver AnswerEngine).
+    """
+    def __init__(self, embeddings, threshold=0.95, max_entries=500, ttl=3600):
+        """
+        Inicializa o cache com a função de embeddings usada para as perguntas.
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # id -> (vetor normalizado, pergunta, resposta, criado_em)
+        self.corpus_version = None
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.skips = 0
+        self.lock = threading.Lock()
+
+    def _check_version(self, corpus_version):
+        if corpus_version != self.corpus_version:
+            if self.entries:
+                print(f"Acervo alterado ({self.corpus_version} -> {corpus_version}). Limpando cache de respostas.")
+            self.entries.clear()
+            self.corpus_version = corpus_version
+
+    def _expire(self, now):
+        expired = [entry_id for entry_id, entry in self.entries.items() if now - entry[3] > self.ttl]
+        for entry_id in expired:
+            del self.entries[entry_id]
+
+    def embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, question, corpus_version):
+        """
+        Procura uma resposta para uma pergunta semelhante.
+        Retorna (resposta ou None, vetor da pergunta) — o vetor é reaproveitado em `store`.
+        """
+        vector = self.embed(question)
+        with self.lock:
+            self._check_version(corpus_version)
+            self._expire(time.time())
+
+            best_id, best_score = None, -1.0
+            if self.entries:
+                ids = list(self.entries)
+                scores = np.stack([self.entries[entry_id][0] for entry_id in ids]) @ vector
+                best = int(np.argmax(scores))
+                best_id, best_score = ids[best], float(scores[best])
+
+            if best_id is not None and best_score >= self.threshold:
+                self.entries.move_to_end(best_id)
+                self.hits += 1
+                answer = self.entries[best_id][2]
+                print(f"Cache de respostas: acerto (similaridade {best_score:.3f}). {self._stats_line()}")
+                return answer, vector
+
+            self.misses += 1
+            print(f"Cache de respostas: falha (melhor similaridade {best_score:.3f}). {self._stats_line()}")
+            return None, vector
+
+    def store(self, question, vector, answer, corpus_version):
+        """
+        Guarda a resposta gerada para a pergunta.
+        """
+        with self.lock:
+            self._check_version(corpus_version)
+            self.entries[self.next_id] = (vector, question, answer, time.time())
+            self.next_id += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def record_skip(self):
+        with self.lock:
+            self.skips += 1
+
+    def stats(self):
+        """
+        Contadores do cache para ajuste do limiar.
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'skips': self.skips,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def _stats_line(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return f"hits={self.hits} misses={self.misses} skips={self.skips} taxa={hit_rate:.1%}"
@@ -0,0 +1,312 @@
+import time
+
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.output_parsers import StrOutputParser
+
+from langchain.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    SystemMessagePromptTemplate,
+    MessagesPlaceholder,
+)
+
+from utils.answerCache import is_follow_up
+from utils.contextPacker import ContextPacker
+from utils.historyManager import estimate_tokens
+from utils.metrics import metrics
+
+PERSONA_PROMPT = """\
+        # Persona e Objetivo Principal
+ 
+        Você é Themis, uma assistente jurídica virtual. Sua atuação consiste na análise de documentos jurídicos e no esclarecimento de dúvidas legais, **exclusivamente com base no material de contexto fornecido**. Seu objetivo é oferecer apoio técnico, preciso, confiável e isento de opiniões pessoais ou interpretações externas ao contexto.
+ 
+        ---
+ 
+        # Instruções Adicionais de Resposta
+ 
+        - Sempre cite, entre aspas, trechos relevantes do contexto (documentos jurídicos) para justificar sua análise, quando possível, cite apenas o necessário e de maneira formatada em utf-8 legível para seres humanos, indicando o documento e a página do trecho.
+        - Estruture suas respostas de forma clara, utilizando parágrafos curtos e listas numeradas se necessário.
+        - Se a dúvida for muito ampla, peça um recorte mais específico ao usuário.
+        - Em caso de contradição entre o contexto e o histórico da conversa, priorize sempre o conteúdo do contexto.
+ 
+        ---
+ 
+        """
+
+SYSTEM_PROMPT_TEMPLATE = PERSONA_PROMPT + """\
+        # Análise do Histórico da Conversa (Instrução Crítica)
+ 
+        Antes de responder, você **deve** analisar o histórico da conversa para contextualizar a pergunta atual.
+ 
+        * **Formato do Histórico:** O histórico são as mensagens anteriores desta conversa: as mensagens do usuário foram enviadas por `{userName}` e as demais são respostas suas. Trocas mais antigas aparecem condensadas no resumo da conversa anterior.
+ 
+        * **Se o Histórico estiver Vazio (sem mensagens anteriores nem resumo):** Significa que esta é a **primeira interação**. Nesse caso, inicie sua resposta com uma breve apresentação antes de abordar a pergunta. Por exemplo: "Olá, {userName}. Eu sou Themis, sua assistente jurídica virtual. Sobre sua dúvida,..."
+ 
+        * **Se o Histórico NÃO estiver Vazio:** Analise as trocas anteriores para entender o fluxo da conversa. Preste atenção especial a:
+            * **Perguntas de Acompanhamento:** A `{question}` atual pode ser uma continuação de um tópico anterior. Use o histórico para entender a ligação.
+            * **Referências e Pronomens:** O usuário pode usar termos como "isso", "aquilo", "ele" ou "o artigo mencionado" que se referem a algo dito anteriormente por você ou por ele. O histórico é a chave para resolver essas referências.
+            * **Manutenção do Contexto:** Garanta que sua resposta seja consistente com as informações que você já forneceu nas interações passadas.
+ 
+        """
+
+# Respostas que podem ser entregues a vários usuários (cache e perguntas simultâneas iguais): o prompt
+# não leva histórico, resumo nem nome, e a apresentação da primeira interação é acrescentada depois
+SHARED_SYSTEM_PROMPT_TEMPLATE = PERSONA_PROMPT + """\
+        # Resposta Compartilhada (Instrução Crítica)
+ 
+        Esta resposta pode ser entregue a vários usuários que fizerem a mesma pergunta. Não se apresente, não cumprimente e não se dirija ao usuário pelo nome: responda diretamente à pergunta, de forma autocontida.
+ 
+        """
+
+GREETING_TEMPLATE = "Olá, {userName}. Eu sou Themis, sua assistente jurídica virtual.\n\n"
+
+HUMAN_PROMPT_TEMPLATE = """\
+        # Entradas para Análise
+ 
+        * **Nome do Usuário:**
+            {userName}
+ 
+        * **Resumo da Conversa Anterior:**
+            {summary}
+ 
+        * **Contexto (Documentos Jurídicos):**
+            {context}
+ 
+        * **Pergunta Atual:**
+            {question}
+ 
+        ---
+ 
+        # Resposta:
+ 
+        """
+
+
+SHARED_HUMAN_PROMPT_TEMPLATE = """\
+        # Entradas para Análise
+ 
+        * **Contexto (Documentos Jurídicos):**
+            {context}
+ 
+        * **Pergunta Atual:**
+            {question}
+ 
+        ---
+ 
+        # Resposta:
+ 
+        """
+
+
+def format_history(chat_history):
+    """
+    Converte o histórico salvo (lista de dicts role/content) em mensagens do LangChain.
+    """
+    formatted_messages = []
+    for message in chat_history:
+        if message.get('role') == 'user':
+            formatted_messages.append(HumanMessage(content=message.get('content')))
+        elif message.get('role') == 'Themis' or message.get('role') == 'assistant': # Ajuste 'Themis' se necessário
+            formatted_messages.append(AIMessage(content=message.get('content')))
+    return formatted_messages
+
+
+class AnswerEngine:
+    """
+    Motor de respostas RAG: monta uma única vez os prompts, o LLM e o retriever, e expõe `answer`
+    para ser chamado a cada mensagem. As etapas (cache, recuperação, contexto, modelo) são executadas
+    em sequência para que a latência de cada uma seja medida.
+    Depois de construído não guarda estado por requisição, então pode ser usado por várias threads ao mesmo tempo.
+    """
+    def __init__(self, llm, vector_store, search_kwargs=None, answer_cache=None, corpus_version=None,
+                 history_manager=None, retriever=None, context_packer=None, single_flight=None):
+        """
+        Inicializa o motor a partir do modelo de chat e do vector store já carregado.
+        `answer_cache` é um SemanticAnswerCache opcional; `corpus_version` identifica o acervo indexado;
+        `history_manager` ajusta o histórico ao orçamento de tokens; `retriever` substitui o retriever
+        MMR padrão do vector store (ex.: HybridRetriever); `context_packer` monta o contexto a partir
+        dos chunks recuperados; `single_flight` (SingleFlight) agrupa perguntas iguais em andamento.
+        """
+        self.llm = llm
+        self.vector_store = vector_store
+        self.answer_cache = answer_cache
+        self.corpus_version = corpus_version
+        self.history_manager = history_manager
+        self.context_packer = context_packer or ContextPacker()
+        self.single_flight = single_flight
+
+        self.chat_prompt = ChatPromptTemplate.from_messages(
+            [
+                SystemMessagePromptTemplate.from_template(SYSTEM_PROMPT_TEMPLATE),
+                MessagesPlaceholder(variable_name="history"),
+                HumanMessagePromptTemplate.from_template(HUMAN_PROMPT_TEMPLATE),
+            ]
+        )
+        self.shared_prompt = ChatPromptTemplate.from_messages(
+            [
+                SystemMessagePromptTemplate.from_template(SHARED_SYSTEM_PROMPT_TEMPLATE),
+                HumanMessagePromptTemplate.from_template(SHARED_HUMAN_PROMPT_TEMPLATE),
+            ]
+        )
+
+        self.retriever = retriever or vector_store.as_retriever(
+            search_type="mmr",
+            search_kwargs=search_kwargs or {'k': 4, 'fetch_k': 20}
+        )
+
+        self.output_parser = StrOutputParser()
+
+    def _is_shared(self, question):
+        """
+        Indica se a resposta é gerada sem dados do usuário (histórico, resumo e nome) e pode ser entregue
+        a outros usuários, pelo cache ou pelo agrupamento de perguntas simultâneas iguais.
+        Vale para as perguntas que não dependem da conversa.
+        """
+        return (self.answer_cache is not None or self.single_flight is not None) and not is_follow_up(question)
+
+    @staticmethod
+    def _greeting(user, history, shared):
+        """
+        Apresentação da primeira interação, acrescentada fora do modelo às respostas compartilhadas.
+        """
+        return GREETING_TEMPLATE.format(userName=user) if shared and not history else ''
+
+    def _lookup_cache(self, question, shared):
+        """
+        Consulta o cache de respostas. Retorna (resposta em cache ou None, vetor da pergunta ou None).
+        """
+        if self.answer_cache is None:
+            return None, None
+        if not shared:
+            self.answer_cache.record_skip()
+            metrics.increment('answer_cache_lookups_total', result='skip')
+            return None, None
+        with metrics.span('answer_cache'):
+            cached_response, question_vector = self.answer_cache.lookup(question, self.corpus_version)
+        metrics.increment('answer_cache_lookups_total', result='hit' if cached_response is not None else 'miss')
+        return cached_response, question_vector
+
+    def _prompt_messages(self, question, user, history, session_id, shared=False):
+        """
+        Executa as etapas anteriores ao modelo, cada uma medida separadamente: ajuste do histórico,
+        recuperação dos chunks e montagem do contexto. Retorna as mensagens do prompt.
+        Uma resposta compartilhada usa o prompt sem histórico, resumo e nome do usuário.
+        """
+        summary = ''
+        if self.history_manager is not None and not shared:
+            with metrics.span('history_fit'):
+                history, summary = self.history_manager.fit(session_id, history)
+
+        with metrics.span('retrieval'):
+            documents = self.retriever.invoke(question)
+        metrics.increment('retrieved_chunks_total', len(documents))
+
+        with metrics.span('context_pack'):
+            context = self.context_packer.pack(documents)
+
+        if shared:
+            return self.shared_prompt.invoke({"context": context, "question": question}).to_messages()
+        return self.chat_prompt.invoke({
+            "context": context,
+            "question": question,
+            "userName": user,
+            "summary": summary or "Nenhum.",
+            "history": format_history(history)
+        }).to_messages()
+
+    @staticmethod
+    def _record_tokens(messages, response, usage):
+        """
+        Contabiliza os tokens de entrada e saída informados pelo modelo ou, na falta deles, estimados.
+        """
+        if usage:
+            input_tokens, output_tokens = usage.get('input_tokens', 0), usage.get('output_tokens', 0)
+        else:
+            input_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+            output_tokens = estimate_tokens(response)
+        metrics.increment('llm_tokens_total', input_tokens, direction='input')
+        metrics.increment('llm_tokens_total', output_tokens, direction='output')
+
+    def _finish(self, question, question_vector, response):
+        if question_vector is not None:
+            self.answer_cache.store(question, question_vector, response, self.corpus_version)
+
+        print(f"Resposta gerada: {response}")
+
+    def _coalescing_key(self, question, shared):
+        """
+        Chave para agrupar perguntas simultâneas iguais, ou None se a pergunta não pode ser compartilhada.
+        Só as respostas compartilhadas, geradas sem dados do usuário, são agrupadas.
+        """
+        if self.single_flight is None or not shared:
+            return None
+        return f"{self.corpus_version}|{' '.join(question.lower().split()).rstrip('?!. ')}"
+
+    def answer(self, question, user, history, session_id=None):
+        """
+        Gera a resposta para a pergunta do usuário considerando o histórico da conversa.
+        `session_id` identifica a conversa para reaproveitar o resumo do histórico antigo.
+        Perguntas iguais recebidas ao mesmo tempo compartilham uma única busca e geração.
+        """
+        shared = self._is_shared(question)
+        key = self._coalescing_key(question, shared)
+        if key is None:
+            response = self._answer(question, user, history, session_id, shared)
+        else:
+            response = self.single_flight.run(key, lambda: self._answer(question, user, history, session_id, shared))
+        return self._greeting(user, history, shared) + response
+
+    def _answer(self, question, user, history, session_id, shared):
+        cached_response, question_vector = self._lookup_cache(question, shared)
+        if cached_response is not None:
+            return cached_response
+
+        messages = self._prompt_messages(question, user, history, session_id, shared)
+        with metrics.span('llm'):
+            message = self.llm.invoke(messages)
+        response = self.output_parser.invoke(message)
+        self._record_tokens(messages, response, getattr(message, 'usage_metadata', None))
+
+        self._finish(question, question_vector, response)
+
+        return response
+
+    def stream(self, question, user, history, session_id=None):
+        """
+        Gera a resposta em partes, à medida que o modelo as produz.
+        Uma resposta vinda do cache é entregue de uma vez.
+        """
+        shared = self._is_shared(question)
+        greeting = self._greeting(user, history, shared)
+        if greeting:
+            yield greeting
+        key = self._coalescing_key(question, shared)
+        if key is None:
+            yield from self._stream(question, user, history, session_id, shared)
+        else:
+            yield from self.single_flight.stream(key, lambda: self._stream(question, user, history, session_id, shared))
+
+    def _stream(self, question, user, history, session_id, shared):
+        cached_response, question_vector = self._lookup_cache(question, shared)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        messages = self._prompt_messages(question, user, history, session_id, shared)
+        parts = []
+        usage = {}
+        start = time.perf_counter()
+        for chunk in self.llm.stream(messages):
+            if not parts:
+                metrics.record('llm_first_token', time.perf_counter() - start)
+            for key, value in (getattr(chunk, 'usage_metadata', None) or {}).items():
+                if isinstance(value, int):
+                    usage[key] = usage.get(key, 0) + value
+            text = self.output_parser.invoke(chunk)
+            parts.append(text)
+            yield text
+        metrics.record('llm', time.perf_counter() - start)
+
+        response = ''.join(parts)
+        self._record_tokens(messages, response, usage)
+        self._finish(question, question_vector, response)
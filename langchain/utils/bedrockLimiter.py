@@ -0,0 +1,302 @@
+import contextvars
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+
+from utils.embeddingPipeline import is_retryable_error
+from utils.metrics import metrics
+
+# Erros do Bedrock que indicam sobrecarga: além de repetidos, reduzem o limite de concorrência
+THROTTLE_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException')
+# Chamadas do Bedrock Runtime que passam pelo controle de admissão
+LIMITED_OPERATIONS = ('invoke_model', 'invoke_model_with_response_stream', 'converse', 'converse_stream')
+# Falhas de rede (conexão recusada ou encerrada, timeouts de conexão e de leitura), repetidas como as do Bedrock
+NETWORK_ERRORS = (BotocoreConnectionError, HTTPClientError)
+
+_current_user = contextvars.ContextVar('bedrock_user', default=None)
+
+
+@contextmanager
+def bedrock_user(user_id):
+    """
+    Associa ao usuário as chamadas ao Bedrock feitas neste contexto (inclusive em threads que o copiem),
+    para o rodízio da fila. Chamadas sem usuário (ex.: a ingestão) formam uma fila própria.
+    """
+    token = _current_user.set(user_id)
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+class BedrockOverloadedError(RuntimeError):
+    """
+    A chamada esperou mais que o limite na fila do controle de admissão.
+    """
+
+
+def is_throttling_error(error):
+    """
+    Indica se o erro (ou a causa dele) é de sobrecarga do Bedrock ou da fila de admissão.
+    O langchain_aws pode encapsular o ClientError em outra exceção, por isso a cadeia é percorrida.
+    """
+    while error is not None:
+        if isinstance(error, BedrockOverloadedError):
+            return True
+        if isinstance(error, ClientError):
+            return error.response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+        if any(code in str(error) for code in THROTTLE_ERROR_CODES):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def is_network_error(error):
+    """
+    Indica se o erro (ou a causa dele) é uma falha de rede transitória ao chamar o Bedrock.
+    """
+    while error is not None:
+        if isinstance(error, NETWORK_ERRORS):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    Controle de admissão das chamadas ao Bedrock com limite de concorrência adaptativo (AIMD):
+    cada chamada bem-sucedida com o limite ocupado soma 1/limite (+1 a cada "rodada" de chamadas);
+    um throttling multiplica o limite por `backoff_ratio` e uma latência acima de `latency_tolerance`
+    vezes a média recente da operação, por `latency_ratio` (a latência informada deve ser comparável
+    entre chamadas da mesma operação, ver LimitedBedrockClient). As reduções são aplicadas no máximo
+    uma vez a cada `decrease_interval` segundos, já que uma rajada de erros reflete a mesma sobrecarga.
+    Quem excede o limite espera em uma fila por usuário, e as filas são atendidas em rodízio: um usuário
+    com muitas chamadas pendentes não atrasa os demais mais do que uma chamada por vez.
+    """
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=16, backoff_ratio=0.5, latency_ratio=0.9,
+                 latency_tolerance=2.0, decrease_interval=1.0, queue_timeout=60.0):
+        """
+        Inicializa o limitador. `queue_timeout` é a espera máxima na fila (None espera indefinidamente).
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.backoff_ratio = backoff_ratio
+        self.latency_ratio = latency_ratio
+        self.latency_tolerance = latency_tolerance
+        self.decrease_interval = decrease_interval
+        self.queue_timeout = queue_timeout
+        self.in_use = 0
+        self.waiting = 0
+        self.queues = OrderedDict()  # usuário -> deque de eventos; a ordem das chaves é a do rodízio
+        self.latencies = {}  # operação -> média móvel da latência
+        self.last_decrease = 0.0
+        self.admitted = 0
+        self.throttled = 0
+        self.slow = 0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, user=None, operation='bedrock'):
+        """
+        Aguarda uma vaga para a chamada. Retorna o tempo de espera na fila, em segundos.
+        Lança BedrockOverloadedError se a espera passar de `queue_timeout`.
+        """
+        start = time.perf_counter()
+        with self.lock:
+            if not self.waiting and self.in_use < int(self.limit):
+                self.in_use += 1
+                self.admitted += 1
+                event = None
+            else:
+                event = threading.Event()
+                self.queues.setdefault(user, deque()).append(event)
+                self.waiting += 1
+
+        if event is not None and not event.wait(self.queue_timeout):
+            with self.lock:
+                # A vaga pode ter sido concedida entre o fim da espera e o lock
+                if not event.is_set():
+                    self._dequeue(user, event)
+                    self.timeouts += 1
+                    metrics.increment('bedrock_queue_timeouts_total', operation=operation)
+                    raise BedrockOverloadedError(
+                        f"Nenhuma vaga para chamar o Bedrock em {self.queue_timeout:.0f}s "
+                        f"(limite atual: {int(self.limit)} chamadas simultâneas)."
+                    )
+
+        wait = time.perf_counter() - start
+        metrics.observe('bedrock_queue_wait_seconds', wait, operation=operation)
+        return wait
+
+    def _dequeue(self, user, event):
+        queue = self.queues[user]
+        queue.remove(event)
+        if not queue:
+            del self.queues[user]
+        self.waiting -= 1
+
+    def release(self, operation='bedrock', latency=None, throttled=False):
+        """
+        Libera a vaga e ajusta o limite pelo resultado da chamada: throttling, latência (em segundos,
+        None quando a chamada falhou por outro motivo) ou sucesso.
+        """
+        with self.lock:
+            saturated = self.waiting > 0 or self.in_use >= int(self.limit)
+            self.in_use -= 1
+            if throttled:
+                self.throttled += 1
+                self._decrease(self.backoff_ratio)
+            elif latency is not None:
+                average = self.latencies.get(operation)
+                if average is not None and latency > average * self.latency_tolerance:
+                    self.slow += 1
+                    self._decrease(self.latency_ratio)
+                elif saturated:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.latencies[operation] = latency if average is None else average * 0.9 + latency * 0.1
+            self._grant()
+
+    def _decrease(self, ratio):
+        now = time.monotonic()
+        if now - self.last_decrease < self.decrease_interval:
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * ratio)
+
+    def _grant(self):
+        """
+        Concede as vagas livres aos próximos da fila, um por usuário em rodízio.
+        """
+        while self.waiting and self.in_use < int(self.limit):
+            user, queue = next(iter(self.queues.items()))
+            event = queue.popleft()
+            if queue:
+                self.queues.move_to_end(user)
+            else:
+                del self.queues[user]
+            self.waiting -= 1
+            self.in_use += 1
+            self.admitted += 1
+            event.set()
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'limit': round(self.limit, 2),
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'waiting_users': len(self.queues),
+                'admitted': self.admitted,
+                'throttled': self.throttled,
+                'slow': self.slow,
+                'queue_timeouts': self.timeouts,
+            }
+
+
+class LimitedBedrockClient:
+    """
+    Envolve o client do Bedrock Runtime: as chamadas de modelo (embeddings e LLM) passam pelo
+    AdaptiveLimiter e os erros transitórios (do Bedrock e de rede) são repetidos com backoff exponencial e jitter.
+    Nas respostas em streaming, a vaga só é liberada quando os eventos terminam de ser consumidos.
+    O sinal de latência é o tempo até a resposta nos embeddings e no início do streaming, e o tempo por
+    token gerado no `converse`, cuja duração cresce com o tamanho da resposta.
+    Os demais atributos são os do client original.
+    """
+    def __init__(self, client, limiter, max_retries=4, backoff_base=0.5, backoff_max=8.0):
+        self.client = client
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def __getattr__(self, name):
+        if name == 'client':
+            # Ainda não inicializado (ex.: durante uma cópia); evita a recursão infinita
+            raise AttributeError(name)
+        attribute = getattr(self.client, name)
+        if name not in LIMITED_OPERATIONS:
+            return attribute
+
+        def limited(**kwargs):
+            return self._call(name, attribute, kwargs)
+        return limited
+
+    def _call(self, operation, method, kwargs):
+        # A média de latência é acompanhada por operação e modelo: embeddings e LLM têm tempos diferentes
+        key = f"{operation}:{kwargs.get('modelId', '')}"
+        user = _current_user.get()
+        attempt = 0
+        while True:
+            self.limiter.acquire(user, operation)
+            start = time.perf_counter()
+            try:
+                response = method(**kwargs)
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                self.limiter.release(key, throttled=throttled)
+                if throttled:
+                    metrics.increment('bedrock_throttled_total', operation=operation)
+                if attempt >= self.max_retries or not (is_retryable_error(e) or is_network_error(e)):
+                    raise
+                # Full jitter: as chamadas que sofreram throttling juntas não voltam juntas
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                attempt += 1
+                metrics.increment('bedrock_retries_total', operation=operation)
+                print(f"Erro transitório no Bedrock ({operation}). Tentativa {attempt}/{self.max_retries} "
+                      f"em {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+
+            latency = time.perf_counter() - start
+            if operation == 'converse':
+                latency /= max(1, response.get('usage', {}).get('outputTokens', 0))
+            if operation.endswith('_stream'):
+                # converse_stream devolve os eventos em 'stream'; invoke_model_with_response_stream, em 'body'
+                field = 'stream' if 'stream' in response else 'body'
+                response[field] = StreamSlot(response[field], lambda throttled: self.limiter.release(
+                    key, None if throttled else latency, throttled=throttled))
+                return response
+            self.limiter.release(key, latency)
+            return response
+
+
+class StreamSlot:
+    """
+    Eventos de uma resposta em streaming que mantêm a vaga do limitador até o fim do consumo
+    (ou até o fechamento/descarte da resposta).
+    """
+    def __init__(self, events, release):
+        self.events = events
+        self._release = release
+        self.released = False
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        throttled = False
+        try:
+            yield from self.events
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            raise
+        finally:
+            self.release(throttled)
+
+    def release(self, throttled=False):
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        self._release(throttled)
+
+    def close(self):
+        if hasattr(self.events, 'close'):
+            self.events.close()
+        self.release()
+
+    def __del__(self):
+        self.release()
@@ -1,233 +1,448 @@
 import boto3
 import os
+from botocore.config import Config
+from chromadb.api.shared_system_client import SharedSystemClient
 from langchain_aws import BedrockEmbeddings
-from langchain.document_loaders import PyPDFLoader
 from langchain_aws import ChatBedrock
 from langchain_chroma import Chroma
-from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from operator import itemgetter
- 
-from langchain_core.messages import HumanMessage, AIMessage
- 
-from langchain.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    SystemMessagePromptTemplate,
-    MessagesPlaceholder,
-)
+from utils.answerEngine import AnswerEngine
+from utils.answerCache import SemanticAnswerCache
+from utils.bedrockLimiter import AdaptiveLimiter, LimitedBedrockClient
+from utils.bm25Index import BM25Index
+from utils.citationIndex import CitationIndex, CitationRetriever
+from utils.contextPacker import ContextPacker
+from utils.historyManager import HistoryManager
+from utils.hybridRetriever import HybridRetriever
+from utils.indexManifest import IndexManifest
+from utils.metrics import metrics
+from utils.embeddingPipeline import EmbeddingCache, EmbeddingPipeline
+from utils.numpyVectorStore import NumpyVectorStore
+from utils.pdfPipeline import PARSER_VERSION, PdfPipeline
+from utils.singleFlight import SingleFlight
+from utils.textCache import PageTextCache
+ 
+VECTOR_STORE_PATH = 'vector_store/chroma/'
+# O backend NumPy fica em um subdiretório próprio, com manifesto e índices auxiliares separados dos do Chroma
+NUMPY_VECTOR_STORE_PATH = 'vector_store/numpy/index/'
+# Limite de registros por chamada de add/delete no Chroma
+CHROMA_BATCH_SIZE = 1000
  
  
 class BedrockUtils:
     """
     Classe utilitária para interações com o Amazon Bedrock.
     """
-    def __init__(self):
+    def __init__(self, bedrock_client=None, embeddings=None, llm_factory=None):
         """
-        Inicializa a classe com o ID do modelo Bedrock.
+        Inicializa a classe com o client do Bedrock Runtime.
+        `embeddings` substitui o BedrockEmbeddings e `llm_factory(model_id)` substitui o ChatBedrock
+        (usados pelo benchmark com dublês locais); por padrão ambos usam `bedrock_client`.
         """
-        self.bedrock = boto3.client('bedrock-runtime')
+        self.limiter = None
+        self.bedrock = self.make_bedrock_client(bedrock_client)
+        self.embeddings = embeddings
+        self.llm_factory = llm_factory
+        self._answer_engine = None
+        self.answer_cache = None
+        self.history_manager = None
+        # Compartilhado pelos motores de resposta: perguntas iguais em andamento são respondidas uma única vez
+        self.single_flight = SingleFlight() if os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true' else None
    
-    @staticmethod
-    def make_embeddings(embedding_model_id, downloaded_pdfs):
-        """
-        Obtém embeddings para um texto usando o modelo Bedrock.
-        Verifica se o vector store já existe antes de criar os embeddings.
-        """
-        vector_store_path = 'vector_store/chroma/'
-       
-        # Verifica se o vector store já existe
-        if os.path.exists(vector_store_path) and os.listdir(vector_store_path):
-            print("Vector store já existe. Carregando vector store existente...")
-            try:
-                # Carrega o vector store existente
-                vector_store = Chroma(
-                    persist_directory=vector_store_path,
-                    embedding_function=BedrockEmbeddings(model_id=embedding_model_id)
-                )
-                print("Vector store carregado com sucesso!")
- 
-                return vector_store
-           
-            except Exception as e:
-                print(f"Erro ao carregar vector store existente: {e}")
-                print("Criando novo vector store...")
-       
-        # Se não existe vector store ou houve erro, cria um novo
-        print("Criando novo vector store com embeddings...")
-       
-        loaders = []
-        for downloaded_pdf in downloaded_pdfs:
-            pdf_path = f"dataset/{downloaded_pdf}"
-            if os.path.exists(pdf_path):
-                loaders.append(PyPDFLoader(pdf_path))
-            else:
-                print(f"Aviso: Arquivo '{pdf_path}' não encontrado. Pulando...")
- 
-        if not loaders:
-            raise ValueError("Nenhum arquivo PDF válido encontrado para processar.")
- 
-        docs = []
-        for loader in loaders:
-            try:
-                docs.extend(loader.load())
-            except Exception as e:
-                print(f"Erro ao carregar PDF: {e}")
- 
-        if not docs:
-            raise ValueError("Nenhum documento foi carregado com sucesso.")
- 
-        r_splitter = RecursiveCharacterTextSplitter(chunk_size=1000,
-                                                    chunk_overlap=180,
-                                                    separators=["\n\n", "\n"],
-                                                    add_start_index=True)
- 
-        docs_splitted = r_splitter.split_documents(docs)
-       
-        if os.path.exists(vector_store_path):
-            vector_store = Chroma(
-                persist_directory=vector_store_path,
-                embedding_function=BedrockEmbeddings(model_id=embedding_model_id)
-            )
-            print("Vector store carregado com sucesso, mas não estava vazio. Verifique se os documentos estão atualizados.")
-        else:
-            vector_store = Chroma.from_documents(
-                documents=docs_splitted,
-                embedding=BedrockEmbeddings(model_id=embedding_model_id),
-                persist_directory=vector_store_path
-            )
-            print("Vector store criado do zero.")
+    def make_bedrock_client(self, bedrock_client=None):
+        """
+        Cria o client do Bedrock Runtime compartilhado pelos embeddings e pelo LLM. Com o controle de
+        admissão ativo (BEDROCK_LIMITER_ENABLED), as chamadas de modelo passam pelo limite de concorrência
+        adaptativo e as novas tentativas (throttling, erros transitórios e falhas de rede) ficam a cargo dele,
+        e não do botocore, para que o throttling chegue ao limitador.
+        """
+        enabled = os.getenv('BEDROCK_LIMITER_ENABLED', 'true').lower() == 'true'
+        max_limit = int(os.getenv('BEDROCK_MAX_CONCURRENCY', '16'))
+        if bedrock_client is None:
+            config = Config(retries={'mode': 'standard', 'max_attempts': 1},
+                            max_pool_connections=max(10, max_limit)) if enabled else None
+            bedrock_client = boto3.client('bedrock-runtime', config=config)
+        if not enabled:
+            return bedrock_client
+ 
+        self.limiter = AdaptiveLimiter(
+            initial_limit=int(os.getenv('BEDROCK_INITIAL_CONCURRENCY', '4')),
+            min_limit=int(os.getenv('BEDROCK_MIN_CONCURRENCY', '1')),
+            max_limit=max_limit,
+            queue_timeout=float(os.getenv('BEDROCK_QUEUE_TIMEOUT', '60'))
+        )
+        return LimitedBedrockClient(bedrock_client, self.limiter,
+                                    max_retries=int(os.getenv('BEDROCK_MAX_RETRIES', '4')))
  
-        return vector_store
+    def make_embeddings(self, embedding_model_id, downloaded_pdfs, vector_store_path=None, changes=None):
+        """
+        Obtém o vector store com os embeddings dos PDFs usando o modelo Bedrock.
+        Carrega o vector store existente e sincroniza apenas os documentos novos, alterados ou removidos.
+        """
+        return self.sync_vector_store(embedding_model_id, downloaded_pdfs, vector_store_path, changes)
  
-    @staticmethod
-    def check_and_update_vector_store(embedding_model_id, downloaded_pdfs):
+    def check_and_update_vector_store(self, embedding_model_id, downloaded_pdfs, vector_store_path=None):
         """
         Verifica se todos os PDFs estão no vector store e atualiza se necessário.
         """
-        vector_store_path = 'vector_store/chroma/'
-       
-        # Se não existe vector store, cria um novo
-        if not os.path.exists(vector_store_path) or not os.listdir(vector_store_path):
-            return BedrockUtils.make_embeddings(embedding_model_id, downloaded_pdfs)
-       
-        try:
-            # Carrega o vector store existente
-            vector_store = Chroma(
-                persist_directory=vector_store_path,
-                embedding_function=BedrockEmbeddings(model_id=embedding_model_id)
-            )
-           
-            # Verifica se todos os PDFs estão representados no vector store
-            # Aqui você pode implementar lógica adicional para verificar
-            # se documentos específicos precisam ser adicionados
-           
-            print("Vector store verificado e carregado com sucesso!")
-            return vector_store
-           
-        except Exception as e:
-            print(f"Erro ao verificar vector store: {e}")
-            print("Recriando vector store...")
-            return BedrockUtils.make_embeddings(embedding_model_id, downloaded_pdfs)
- 
-    def ask_llm(self, model_id, vector_store, question, userName, history):
- 
-        system_prompt_template = """\
-        # Persona e Objetivo Principal
+        return self.sync_vector_store(embedding_model_id, downloaded_pdfs, vector_store_path)
  
-        Você é Themis, uma assistente jurídica virtual. Sua atuação consiste na análise de documentos jurídicos e no esclarecimento de dúvidas legais, **exclusivamente com base no material de contexto fornecido**. Seu objetivo é oferecer apoio técnico, preciso, confiável e isento de opiniões pessoais ou interpretações externas ao contexto.
- 
-        ---
+    def sync_vector_store(self, embedding_model_id, downloaded_pdfs, vector_store_path=None, changes=None):
+        """
+        Sincroniza o vector store com os PDFs locais usando o manifesto de hashes.
+        Apenas PDFs novos ou alterados são embedados; chunks de PDFs removidos são apagados.
+        Os índices auxiliares (BM25 e citações legais) são mantidos em sincronia com os mesmos chunks.
+        `changes` é o resultado de S3Utils.sync_pdfs: quando informado, os PDFs que não mudaram no bucket
+        e já estão no manifesto não têm o hash recalculado.
+        """
+        vector_store_path = vector_store_path or BedrockUtils.default_vector_store_path()
+        vector_store = self.make_vector_store(embedding_model_id, vector_store_path)
+        manifest = IndexManifest.for_vector_store(vector_store_path)
  
-        # Instruções Adicionais de Resposta
+        if manifest.is_empty() and BedrockUtils.chunk_count(vector_store) > 0:
+            BedrockUtils._adopt_existing_chunks(vector_store, manifest, downloaded_pdfs)
+        chunk_indexes = BedrockUtils._load_chunk_indexes(vector_store, manifest, vector_store_path)
  
-        - Sempre cite, entre aspas, trechos relevantes do `{context}` para justificar sua análise, quando possível, cite apenas o necessário e de maneira formatada em utf-8 legível para seres humanos.
-        - Estruture suas respostas de forma clara, utilizando parágrafos curtos e listas numeradas se necessário.
-        - Se a dúvida for muito ampla, peça um recorte mais específico ao usuário.
-        - Em caso de contradição entre o `{context}` e o `{history}`, priorize sempre o conteúdo do `{context}`.
+        modified = set(changes['added'] + changes['changed']) if changes else None
+        current_hashes = {}
+        for downloaded_pdf in downloaded_pdfs:
+            pdf_path = f"dataset/{downloaded_pdf}"
+            indexed_hash = manifest.documents.get(downloaded_pdf, {}).get('hash')
+            if modified is not None and downloaded_pdf not in modified and indexed_hash:
+                current_hashes[downloaded_pdf] = indexed_hash
+            elif os.path.exists(pdf_path):
+                current_hashes[downloaded_pdf] = IndexManifest.file_hash(pdf_path)
+            else:
+                print(f"Aviso: Arquivo '{pdf_path}' não encontrado. Pulando...")
  
-        ---
+        if not current_hashes and manifest.is_empty():
+            raise ValueError("Nenhum arquivo PDF válido encontrado para processar.")
  
-        # Análise do Histórico da Conversa (Instrução Crítica)
+        added, changed, removed = manifest.diff(current_hashes)
+        print(f"Sincronizando vector store: {len(added)} novo(s), {len(changed)} alterado(s), "
+              f"{len(removed)} removido(s), {len(current_hashes) - len(added) - len(changed)} inalterado(s).")
  
-        Antes de responder, você **deve** analisar o `{history}` para contextualizar a pergunta atual.
+        for pdf_name in removed + changed:
+            chunk_ids = manifest.chunk_ids(pdf_name)
+            for i in range(0, len(chunk_ids), CHROMA_BATCH_SIZE):
+                vector_store.delete(ids=chunk_ids[i:i + CHROMA_BATCH_SIZE])
+            for chunk_index in chunk_indexes:
+                chunk_index.delete(chunk_ids)
+            manifest.remove_document(pdf_name)
+            manifest.save()
+            print(f"Chunks de '{pdf_name}' removidos ({len(chunk_ids)}).")
  
-        * **Formato do Histórico:** O histórico é uma lista de diálogos. `role: 'user'` é uma mensagem enviada pelo `{userName}`, e `role: 'Themis'` é uma resposta sua.
+        try:
+            BedrockUtils._index_documents(vector_store, manifest, added + changed, current_hashes, chunk_indexes)
+        finally:
+            if added or changed or removed:
+                for chunk_index in chunk_indexes:
+                    chunk_index.save()
  
-        * **Se o Histórico estiver Vazio (`[]`):** Significa que esta é a **primeira interação**. Nesse caso, inicie sua resposta com uma breve apresentação antes de abordar a pergunta. Por exemplo: "Olá, {userName}. Eu sou Themis, sua assistente jurídica virtual. Sobre sua dúvida,..."
+        if manifest.is_empty():
+            raise ValueError("Nenhum documento foi carregado com sucesso.")
  
-        * **Se o Histórico NÃO estiver Vazio:** Analise as trocas anteriores para entender o fluxo da conversa. Preste atenção especial a:
-            * **Perguntas de Acompanhamento:** A `{question}` atual pode ser uma continuação de um tópico anterior. Use o histórico para entender a ligação.
-            * **Referências e Pronomens:** O usuário pode usar termos como "isso", "aquilo", "ele" ou "o artigo mencionado" que se referem a algo dito anteriormente por você ou por ele. O histórico é a chave para resolver essas referências.
-            * **Manutenção do Contexto:** Garanta que sua resposta seja consistente com as informações que você já forneceu nas interações passadas.
+        print(f"Vector store sincronizado com {BedrockUtils.chunk_count(vector_store)} chunks.")
+        return vector_store
  
+    @staticmethod
+    def _index_documents(vector_store, manifest, pdf_names, content_hashes, chunk_indexes=()):
         """
- 
-        human_prompt_template = """\
-        # Entradas para Análise
- 
-        * **Nome do Usuário:**
-            {userName}
- 
-        * **Histórico da Conversa:**
-            {history}
- 
-        * **Contexto (Documentos Jurídicos):**
-            {context}
- 
-        * **Pergunta Atual:**
-            {question}
- 
-        ---
- 
-        # Resposta:
- 
+        Indexa os PDFs em streaming: páginas extraídas em vários processos, divididas pelo splitter
+        e gravadas em lotes no vector store e nos índices auxiliares (`chunk_indexes`, ex.: BM25 e
+        citações, que extraem o que precisam de cada chunk). Um PDF só entra no manifesto depois
+        que todos os seus chunks foram gravados. O texto extraído fica no cache de páginas
+        (PAGE_TEXT_CACHE_PATH; PAGE_TEXT_CACHE_ENABLED=false desativa), então reindexar com outro
+        splitter não extrai os PDFs de novo.
         """
+        if not pdf_names:
+            return
+ 
+        text_cache = None
+        if os.getenv('PAGE_TEXT_CACHE_ENABLED', 'true').lower() == 'true':
+            text_cache = PageTextCache(os.getenv('PAGE_TEXT_CACHE_PATH', 'cache/page_text'), PARSER_VERSION)
+        pipeline = PdfPipeline(BedrockUtils.make_splitter(),
+                               max_workers=int(os.getenv('PDF_PARSE_WORKERS', '0')) or None,
+                               text_cache=text_cache)
+        names_by_path = {f"dataset/{pdf_name}": pdf_name for pdf_name in pdf_names}
+        hashes_by_path = {pdf_path: content_hashes[pdf_name] for pdf_path, pdf_name in names_by_path.items()}
+        if text_cache is not None:
+            cached = sum(1 for content_hash in hashes_by_path.values() if text_cache.has(content_hash))
+            print(f"{cached} de {len(pdf_names)} PDF(s) com texto já extraído no cache.")
+        chunk_ids = {pdf_name: [] for pdf_name in pdf_names}
+        pending = []   # (pdf, id, chunk) ainda não gravados
+        finished = []  # PDFs concluídos aguardando a gravação dos últimos chunks
+        failed = set()
+ 
+        def flush():
+            if pending:
+                vector_store.add_documents(documents=[chunk for _, _, chunk in pending],
+                                           ids=[chunk_id for _, chunk_id, _ in pending])
+                for chunk_index in chunk_indexes:
+                    chunk_index.add_documents([chunk_id for _, chunk_id, _ in pending],
+                                              [chunk for _, _, chunk in pending])
+                pending.clear()
+            for pdf_name in finished:
+                manifest.set_document(pdf_name, content_hashes[pdf_name], chunk_ids[pdf_name])
+                print(f"'{pdf_name}' indexado com {len(chunk_ids[pdf_name])} chunks.")
+            if finished:
+                # Salva o progresso: uma falha no meio não perde o que já foi embedado
+                manifest.save()
+                finished.clear()
+ 
+        for pdf_path, chunks, is_last, error in pipeline.iter_chunks(list(names_by_path), hashes_by_path):
+            pdf_name = names_by_path[pdf_path]
+            if pdf_name in failed:
+                continue
+ 
+            if error is not None:
+                print(f"Erro ao carregar PDF '{pdf_path}': {error}")
+                failed.add(pdf_name)
+                pending[:] = [item for item in pending if item[0] != pdf_name]
+                if chunk_ids[pdf_name]:
+                    vector_store.delete(ids=chunk_ids[pdf_name])
+                    for chunk_index in chunk_indexes:
+                        chunk_index.delete(chunk_ids[pdf_name])
+                continue
+ 
+            for chunk in chunks:
+                chunk_id = IndexManifest.chunk_id(pdf_name, content_hashes[pdf_name], len(chunk_ids[pdf_name]))
+                chunk_ids[pdf_name].append(chunk_id)
+                pending.append((pdf_name, chunk_id, chunk))
+ 
+            if is_last:
+                finished.append(pdf_name)
+            if len(pending) >= CHROMA_BATCH_SIZE:
+                flush()
+ 
+        flush()
  
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(system_prompt_template),
-                MessagesPlaceholder(variable_name="history"),
-                HumanMessagePromptTemplate.from_template(human_prompt_template),
-            ]
+    @staticmethod
+    def default_vector_store_path():
+        """
+        Diretório do vector store do backend escolhido em VECTOR_BACKEND.
+        """
+        return NUMPY_VECTOR_STORE_PATH if os.getenv('VECTOR_BACKEND', 'chroma').lower() == 'numpy' else VECTOR_STORE_PATH
+
+    def make_vector_store(self, embedding_model_id, vector_store_path=None, backend=None):
+        """
+        Abre o vector store do backend escolhido em VECTOR_BACKEND: `chroma` (padrão) ou `numpy`
+        (matriz de embeddings mapeada em memória, ver NumpyVectorStore). `backend` substitui a variável
+        (ex.: o backend com que um snapshot foi gerado).
+        """
+        vector_store_path = vector_store_path or BedrockUtils.default_vector_store_path()
+        embedding_function = self.make_embedding_function(embedding_model_id)
+        if (backend or os.getenv('VECTOR_BACKEND', 'chroma')).lower() == 'numpy':
+            return NumpyVectorStore(vector_store_path, embedding_function)
+        return Chroma(persist_directory=vector_store_path, embedding_function=embedding_function)
+
+    @staticmethod
+    def close_vector_store(vector_store):
+        """
+        Libera os recursos de um vector store que deixou de ser usado (ex.: um snapshot substituído).
+        O chromadb mantém em cache um System por diretório (SharedSystemClient) e nunca o descarta:
+        sem isso, as conexões SQLite e os segmentos HNSW de cada snapshot substituído ficariam abertos.
+        """
+        if isinstance(vector_store, NumpyVectorStore):
+            return
+        identifier = vector_store._client._identifier
+        system = SharedSystemClient._identifier_to_system.pop(identifier, None)
+        getattr(SharedSystemClient, '_identifier_to_refcount', {}).pop(identifier, None)
+        if system is not None:
+            system.stop()
+
+    @staticmethod
+    def chunk_count(vector_store):
+        """
+        Número de chunks gravados no vector store.
+        """
+        if isinstance(vector_store, NumpyVectorStore):
+            return vector_store.count()
+        return vector_store._collection.count()
+
+    def make_embedding_function(self, embedding_model_id):
+        """
+        Cria a função de embeddings: BedrockEmbeddings com lotes paralelos, retry e cache em disco.
+        Configurável pelas variáveis EMBEDDING_CACHE_PATH, EMBEDDING_BATCH_SIZE,
+        EMBEDDING_MAX_WORKERS e EMBEDDING_MAX_RETRIES. Com o controle de admissão ativo, as novas tentativas
+        ficam só com ele: repetir também no pipeline multiplicaria as tentativas e esconderia a sobrecarga.
+        """
+        return EmbeddingPipeline(
+            self.embeddings or BedrockEmbeddings(model_id=embedding_model_id, client=self.bedrock),
+            embedding_model_id,
+            cache=EmbeddingCache(os.getenv('EMBEDDING_CACHE_PATH', 'cache/embeddings.sqlite3')),
+            batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE', '16')),
+            max_workers=int(os.getenv('EMBEDDING_MAX_WORKERS', '4')),
+            max_retries=0 if self.limiter is not None else int(os.getenv('EMBEDDING_MAX_RETRIES', '5'))
         )
  
+    @staticmethod
+    def make_splitter():
+        """
+        Cria o text splitter usado para dividir os PDFs em chunks (CHUNK_SIZE e CHUNK_OVERLAP).
+        """
+        return RecursiveCharacterTextSplitter(chunk_size=int(os.getenv('CHUNK_SIZE', '1000')),
+                                              chunk_overlap=int(os.getenv('CHUNK_OVERLAP', '180')),
+                                              separators=["\n\n", "\n"],
+                                              add_start_index=True)
  
-        llm = ChatBedrock(model_id=model_id,
-                        client=self.bedrock)
- 
-        retriever = vector_store.as_retriever(
-            search_type="mmr",
-            search_kwargs={'k': 4, 'fetch_k': 20}
-        )
- 
-        def format_history(chat_history):
-            formatted_messages = []
-            for message in chat_history:
-                if message.get('role') == 'user':
-                    formatted_messages.append(HumanMessage(content=message.get('content')))
-                elif message.get('role') == 'Themis' or message.get('role') == 'assistant': # Ajuste 'Themis' se necessário
-                    formatted_messages.append(AIMessage(content=message.get('content')))
-            return formatted_messages
- 
-        rag_chain = (
-            {
-            "context": itemgetter("question") | retriever,
-            "question": itemgetter("question"),
-            "userName": itemgetter("userName"),
-            "history": lambda x: format_history(x["history"])
-            }
-            | chat_prompt
-            | llm
-            | StrOutputParser()
-        )
+    @staticmethod
+    def _adopt_existing_chunks(vector_store, manifest, downloaded_pdfs=()):
+        """
+        Registra no manifesto os chunks de um vector store criado antes da existência do manifesto,
+        agrupando pelo `source` de cada chunk, para que não seja necessário embedar tudo de novo.
+        Os PDFs eram baixados só pelo nome do arquivo (dataset/<nome>); hoje o caminho mantém o prefixo
+        da chave no S3. Cada documento antigo é registrado com a chave de `downloaded_pdfs` de mesmo nome
+        (se houver só uma), o `source` dos seus chunks é atualizado e a cópia antiga do PDF é apagada.
+        """
+        print("Vector store sem manifesto. Registrando chunks existentes...")
+        existing = vector_store.get(include=["metadatas"])
+        chunks_by_pdf = {}
+        for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+            source = (metadata or {}).get("source", "")
+            pdf_name = source[len("dataset/"):] if source.startswith("dataset/") else source
+            chunks_by_pdf.setdefault(pdf_name, []).append((chunk_id, metadata or {}))
+
+        keys_by_name = {}
+        for key in downloaded_pdfs:
+            keys_by_name.setdefault(os.path.basename(key), []).append(key)
+
+        for pdf_name, chunks in chunks_by_pdf.items():
+            chunk_ids = [chunk_id for chunk_id, _ in chunks]
+            keys = keys_by_name.get(os.path.basename(pdf_name), [])
+            if (pdf_name and pdf_name not in downloaded_pdfs and len(keys) == 1
+                    and not isinstance(vector_store, NumpyVectorStore)):
+                key = keys[0]
+                metadatas = [{**metadata, 'source': f"dataset/{key}"} for _, metadata in chunks]
+                for i in range(0, len(chunk_ids), CHROMA_BATCH_SIZE):
+                    vector_store._collection.update(ids=chunk_ids[i:i + CHROMA_BATCH_SIZE],
+                                                    metadatas=metadatas[i:i + CHROMA_BATCH_SIZE])
+                old_path = f"dataset/{pdf_name}"
+                if os.path.isfile(old_path):
+                    os.remove(old_path)
+                print(f"Documento '{pdf_name}' registrado como '{key}'.")
+                pdf_name = key
+
+            pdf_path = f"dataset/{pdf_name}"
+            # PDFs que não existem mais localmente ficam com hash vazio e serão removidos na sincronização
+            content_hash = IndexManifest.file_hash(pdf_path) if pdf_name and os.path.exists(pdf_path) else ""
+            manifest.set_document(pdf_name, content_hash, chunk_ids)
+        manifest.save()
+        print(f"{len(chunks_by_pdf)} documento(s) registrados no manifesto.")
  
-        response = rag_chain.invoke({
-            "question": question,
-            "userName": userName,
-            "history": history
-        })
+    @staticmethod
+    def _load_chunk_indexes(vector_store, manifest, vector_store_path):
+        """
+        Carrega os índices auxiliares do vector store (BM25 e citações). Um índice que não corresponda
+        aos chunks do manifesto (ausente ou sincronização interrompida) é reconstruído a partir do
+        texto já gravado no vector store, sem embedar nada de novo.
+        """
+        chunk_indexes = [BM25Index.for_vector_store(vector_store_path).load(),
+                         CitationIndex.for_vector_store(vector_store_path).load()]
+        indexed_ids = {chunk_id for pdf_name in manifest.documents for chunk_id in manifest.chunk_ids(pdf_name)}
+        stale = [chunk_index for chunk_index in chunk_indexes if chunk_index.indexed_ids() != indexed_ids]
+        if not stale:
+            return chunk_indexes
+
+        print(f"Reconstruindo {len(stale)} índice(s) auxiliar(es) a partir do vector store...")
+        for chunk_index in stale:
+            chunk_index.clear()
+        indexed_ids = list(indexed_ids)
+        for i in range(0, len(indexed_ids), CHROMA_BATCH_SIZE):
+            stored = vector_store.get(ids=indexed_ids[i:i + CHROMA_BATCH_SIZE], include=["documents", "metadatas"])
+            documents = [Document(page_content=text or "", metadata=metadata or {})
+                         for text, metadata in zip(stored["documents"], stored["metadatas"])]
+            for chunk_index in stale:
+                chunk_index.add_documents(stored["ids"], documents)
+        for chunk_index in stale:
+            chunk_index.save()
+        return chunk_indexes
+
+    def make_retriever(self, vector_store, vector_store_path=None):
+        """
+        Cria o retriever das respostas. Com RETRIEVAL_MODE=hybrid (padrão) combina a busca vetorial e o
+        índice BM25 por RRF, trazendo RETRIEVAL_K chunks a partir de RETRIEVAL_FETCH_K candidatos de cada busca;
+        caso contrário usa MMR no vector store. Com CITATION_INDEX_ENABLED=true (padrão), perguntas que
+        citam um dispositivo legal indexado são respondidas direto pelo índice de citações.
+        """
+        vector_store_path = vector_store_path or BedrockUtils.default_vector_store_path()
+        k = int(os.getenv('RETRIEVAL_K', '4'))
+        retriever = None
+        if os.getenv('RETRIEVAL_MODE', 'hybrid').lower() == 'hybrid':
+            bm25_index = BM25Index.for_vector_store(vector_store_path).load()
+            if len(bm25_index):
+                retriever = HybridRetriever(vector_store=vector_store,
+                                            bm25_index=bm25_index,
+                                            k=k,
+                                            fetch_k=int(os.getenv('RETRIEVAL_FETCH_K', '8')))
+            else:
+                print("Índice BM25 vazio. Usando apenas a busca vetorial (MMR).")
+        if retriever is None:
+            retriever = vector_store.as_retriever(search_type="mmr", search_kwargs={'k': k, 'fetch_k': 20})
+
+        if os.getenv('CITATION_INDEX_ENABLED', 'true').lower() == 'true':
+            citation_index = CitationIndex.for_vector_store(vector_store_path).load()
+            if len(citation_index):
+                retriever = CitationRetriever(citation_index=citation_index,
+                                              vector_store=vector_store,
+                                              fallback=retriever,
+                                              k=k)
+        return retriever
+
+    def make_llm(self, model_id):
+        """
+        Cria o modelo de chat (ChatBedrock, ou o criado por `llm_factory`).
+        """
+        if self.llm_factory is not None:
+            return self.llm_factory(model_id)
+        return ChatBedrock(model_id=model_id,
+                           client=self.bedrock)
+
+    def make_answer_engine(self, model_id, vector_store, vector_store_path=None):
+        """
+        Cria o motor de respostas (prompts, LLM, retriever e chain montados uma única vez).
+        O cache semântico de respostas é compartilhado entre os motores criados e invalidado quando
+        a versão do acervo muda. Configurável por ANSWER_CACHE_ENABLED, ANSWER_CACHE_THRESHOLD,
+        ANSWER_CACHE_MAX_ENTRIES e ANSWER_CACHE_TTL. O histórico enviado ao modelo é limitado a
+        HISTORY_TOKEN_BUDGET tokens; as trocas antigas são resumidas por HISTORY_SUMMARY_MODEL_ID
+        (por padrão o mesmo modelo das respostas), e o resumo é gravado em historicos/. O contexto dos documentos é limitado a
+        CONTEXT_TOKEN_BUDGET tokens.
+        """
+        llm = self.make_llm(model_id)
+ 
+        if self.answer_cache is None and os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true':
+            self.answer_cache = SemanticAnswerCache(
+                vector_store.embeddings,
+                threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95')),
+                max_entries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '500')),
+                ttl=int(os.getenv('ANSWER_CACHE_TTL', '3600'))
+            )
  
-        print(f"Resposta gerada: {response}")
+        if self.history_manager is None:
+            summary_model_id = os.getenv('HISTORY_SUMMARY_MODEL_ID', model_id)
+            summary_llm = llm if summary_model_id == model_id else self.make_llm(summary_model_id)
+            self.history_manager = HistoryManager(summary_llm,
+                                                  token_budget=int(os.getenv('HISTORY_TOKEN_BUDGET', '1500')),
+                                                  data_dir='historicos')
+ 
+        vector_store_path = vector_store_path or BedrockUtils.default_vector_store_path()
+        corpus_version = IndexManifest.for_vector_store(vector_store_path).fingerprint()
+        return AnswerEngine(llm, vector_store, answer_cache=self.answer_cache, corpus_version=corpus_version,
+                            history_manager=self.history_manager,
+                            single_flight=self.single_flight,
+                            retriever=self.make_retriever(vector_store, vector_store_path),
+                            context_packer=ContextPacker(token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', '1200'))))
+ 
+    def ask_llm(self, model_id, vector_store, question, userName, history, session_id=None):
+        """
+        Responde a pergunta usando o RAG. Reaproveita o motor de respostas enquanto o modelo
+        e o vector store forem os mesmos.
+        """
+        engine = self._answer_engine
+        if engine is None or engine.vector_store is not vector_store or engine.llm.model_id != model_id:
+            engine = self.make_answer_engine(model_id, vector_store)
+            self._answer_engine = engine
  
-        return response
\ No newline at end of file
+        with metrics.request('ask_llm'):
+            return engine.answer(question, userName, history, session_id)
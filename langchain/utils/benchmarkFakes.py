@@ -0,0 +1,402 @@
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Iterator, List, Optional
+from urllib.parse import urlparse
+
+from botocore.exceptions import ClientError
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+# Dublês locais dos serviços externos (S3, Bedrock, Transcribe e Telegram) usados pelo benchmark.
+# Imitam apenas a parte das APIs que o bot usa, com latências configuráveis.
+
+
+class FakeS3Client:
+    """
+    Client do S3 sobre um diretório local: cada bucket é uma pasta e cada chave um arquivo.
+    """
+    def __init__(self, root_dir, latency=0.0):
+        self.root_dir = root_dir
+        self.latency = latency
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root_dir, bucket, key)
+
+    def head_bucket(self, Bucket):
+        time.sleep(self.latency)
+        if not os.path.isdir(os.path.join(self.root_dir, Bucket)):
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadBucket')
+        return {}
+
+    def download_file(self, Bucket, Key, Filename):
+        time.sleep(self.latency)
+        if not os.path.exists(self._path(Bucket, Key)):
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'GetObject')
+        shutil.copyfile(self._path(Bucket, Key), Filename)
+
+    def upload_file(self, Filename, Bucket, Key):
+        time.sleep(self.latency)
+        os.makedirs(os.path.dirname(self._path(Bucket, Key)), exist_ok=True)
+        shutil.copyfile(Filename, self._path(Bucket, Key))
+
+    def delete_object(self, Bucket, Key):
+        time.sleep(self.latency)
+        if os.path.exists(self._path(Bucket, Key)):
+            os.remove(self._path(Bucket, Key))
+        return {}
+
+    def read_object(self, Bucket, Key):
+        with open(self._path(Bucket, Key), 'rb') as file:
+            return file.read()
+
+
+class FakeS3Bucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.objects = SimpleNamespace(all=self._all_objects)
+
+    def _all_objects(self):
+        bucket_dir = os.path.join(self.client.root_dir, self.name)
+        for dirpath, _, filenames in os.walk(bucket_dir):
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as file:
+                    etag = hashlib.md5(file.read()).hexdigest()
+                stat = os.stat(path)
+                yield SimpleNamespace(key=os.path.relpath(path, bucket_dir).replace(os.sep, '/'),
+                                      e_tag=f'"{etag}"',
+                                      size=stat.st_size,
+                                      last_modified=datetime.fromtimestamp(stat.st_mtime, timezone.utc))
+
+    def upload_file(self, Filename, Key):
+        self.client.upload_file(Filename, self.name, Key)
+
+
+class FakeS3Resource:
+    """
+    Substituto do `boto3.resource('s3')` para o S3Utils.
+    """
+    def __init__(self, root_dir, latency=0.0):
+        self.meta = SimpleNamespace(client=FakeS3Client(root_dir, latency))
+
+    def Bucket(self, name):
+        return FakeS3Bucket(self.meta.client, name)
+
+
+class OfflineBedrockClient:
+    """
+    Client do Bedrock Runtime que falha em qualquer chamada: garante que o benchmark não acesse a AWS.
+    """
+    def __getattr__(self, name):
+        def offline(*args, **kwargs):
+            raise RuntimeError(f"Chamada ao Bedrock ({name}) no modo offline.")
+        return offline
+
+
+class ThrottlingBedrockClient:
+    """
+    Client do Bedrock Runtime simulado para o BedrockEmbeddings (Titan, `invoke_model`) e o ChatBedrock
+    (Nova, `converse`/`converse_stream`) reais. Responde com ThrottlingException quando há `capacity`
+    chamadas em andamento (0 = sem limite) ou, sob demanda, nas próximas chamadas (`throttle_next`).
+    """
+    def __init__(self, capacity=0, embedding_size=1024, embedding_latency=0.0, first_token_latency=0.5,
+                 tokens_per_second=60.0, response_words=120):
+        self.capacity = capacity
+        self.embeddings = HashingEmbeddings(size=embedding_size, latency=embedding_latency)
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.response_words = response_words
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self.forced_throttles = 0
+        self.lock = threading.Lock()
+
+    def throttle_next(self, count=1):
+        """
+        Faz as próximas `count` chamadas falharem com ThrottlingException.
+        """
+        with self.lock:
+            self.forced_throttles += count
+
+    def _enter(self, operation):
+        with self.lock:
+            self.calls += 1
+            if self.forced_throttles or (self.capacity and self.in_flight >= self.capacity):
+                self.forced_throttles = max(0, self.forced_throttles - 1)
+                self.throttled += 1
+                raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'}},
+                                  operation)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _words(self, messages):
+        question = ' '.join(block.get('text', '') for block in messages[-1]['content'])[-200:] if messages else ''
+        words = f"Resposta simulada com base nos documentos. {question}".split()
+        return (words * (self.response_words // max(len(words), 1) + 1))[:self.response_words]
+
+    @staticmethod
+    def _usage(messages, words):
+        input_tokens = sum(len(block.get('text', '').split()) for message in messages for block in message['content'])
+        return {'inputTokens': input_tokens, 'outputTokens': len(words), 'totalTokens': input_tokens + len(words)}
+
+    def invoke_model(self, modelId, body, accept=None, contentType=None):
+        self._enter('InvokeModel')
+        try:
+            text = json.loads(body)['inputText']
+            embedding = self.embeddings.embed_documents([text])[0]
+        finally:
+            self._exit()
+        payload = json.dumps({'embedding': embedding, 'inputTextTokenCount': len(text.split())})
+        return {'body': io.BytesIO(payload.encode('utf-8'))}
+
+    def converse(self, modelId, messages, system=None, inferenceConfig=None, **kwargs):
+        self._enter('Converse')
+        try:
+            words = self._words(messages)
+            time.sleep(self.first_token_latency + len(words) / self.tokens_per_second)
+        finally:
+            self._exit()
+        return {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': ' '.join(words)}]}},
+            'stopReason': 'end_turn',
+            'usage': self._usage(messages, words),
+            'metrics': {'latencyMs': 0},
+        }
+
+    def converse_stream(self, modelId, messages, system=None, inferenceConfig=None, **kwargs):
+        self._enter('ConverseStream')
+        time.sleep(self.first_token_latency)
+        return {'stream': self._events(messages)}
+
+    def _events(self, messages):
+        # A chamada ocupa a capacidade até o último evento, como uma geração real
+        try:
+            words = self._words(messages)
+            yield {'messageStart': {'role': 'assistant'}}
+            for i, word in enumerate(words):
+                time.sleep(1 / self.tokens_per_second)
+                yield {'contentBlockDelta': {'delta': {'text': word if i == 0 else ' ' + word}, 'contentBlockIndex': 0}}
+            yield {'contentBlockStop': {'contentBlockIndex': 0}}
+            yield {'messageStop': {'stopReason': 'end_turn'}}
+            yield {'metadata': {'usage': self._usage(messages, words), 'metrics': {'latencyMs': 0}}}
+        finally:
+            self._exit()
+
+    def stats(self):
+        with self.lock:
+            return {'calls': self.calls, 'throttled': self.throttled, 'max_in_flight': self.max_in_flight}
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embeddings determinísticos (hashing de palavras) com latência simulada por texto.
+    Textos com as mesmas palavras ficam próximos, o que basta para exercitar a busca.
+    """
+    def __init__(self, size=1024, latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.calls = 0
+        self.texts = 0
+        self.lock = threading.Lock()
+
+    def _embed(self, text):
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text.lower()) if not unicodedata.combining(c))
+        vector = [0.0] * self.size
+        for word in re.findall(r'\w+', text):
+            digest = hashlib.md5(word.encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % self.size] += 1.0 if digest[4] % 2 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.calls += 1
+            self.texts += len(texts)
+        # Como o BedrockEmbeddings, uma chamada ao modelo por texto
+        time.sleep(self.latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class CannedLatencyChatModel(BaseChatModel):
+    """
+    Modelo de chat com resposta fixa e latência simulada: `first_token_latency` segundos até o primeiro
+    token e depois `tokens_per_second` palavras por segundo.
+    """
+    model_id: str = 'canned-model'
+    first_token_latency: float = 0.5
+    tokens_per_second: float = 60.0
+    response_words: int = 120
+
+    @property
+    def _llm_type(self) -> str:
+        return 'canned-latency'
+
+    def _words(self, messages):
+        question = str(messages[-1].content)[-200:] if messages else ''
+        words = f"Resposta simulada com base nos documentos. {question}".split()
+        return (words * (self.response_words // max(len(words), 1) + 1))[:self.response_words]
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None,
+                  **kwargs: Any) -> ChatResult:
+        words = self._words(messages)
+        time.sleep(self.first_token_latency + len(words) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=' '.join(words)))])
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for i, word in enumerate(self._words(messages)):
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else ' ' + word))
+
+
+class FakeTranscribeClient:
+    """
+    Client do Transcribe: o job fica pronto após `latency` segundos e a "transcrição" é o próprio
+    conteúdo do áudio enviado ao S3 local (o benchmark envia o texto da pergunta como áudio).
+    """
+    def __init__(self, s3_client, latency=1.0):
+        self.s3_client = s3_client
+        self.latency = latency
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def start_transcription_job(self, TranscriptionJobName, LanguageCode, MediaFormat, Media):
+        uri = urlparse(Media['MediaFileUri'])
+        with self.lock:
+            self.jobs[TranscriptionJobName] = {'started': time.monotonic(), 'bucket': uri.netloc,
+                                               'key': uri.path.lstrip('/')}
+        return {'TranscriptionJob': {'TranscriptionJobName': TranscriptionJobName,
+                                     'TranscriptionJobStatus': 'IN_PROGRESS'}}
+
+    def get_transcription_job(self, TranscriptionJobName):
+        with self.lock:
+            job = self.jobs[TranscriptionJobName]
+        if time.monotonic() - job['started'] < self.latency:
+            return {'TranscriptionJob': {'TranscriptionJobStatus': 'IN_PROGRESS'}}
+        if 'transcript' not in job:
+            job['transcript'] = self.s3_client.read_object(job['bucket'], job['key']).decode('utf-8')
+        return {'TranscriptionJob': {'TranscriptionJobStatus': 'COMPLETED',
+                                     'Transcript': {'TranscriptFileUri': f"fake://{TranscriptionJobName}"}}}
+
+    def delete_transcription_job(self, TranscriptionJobName):
+        with self.lock:
+            self.jobs.pop(TranscriptionJobName, None)
+
+    def transcript(self, job_name):
+        with self.lock:
+            return self.jobs[job_name]['transcript']
+
+
+class FakeTranscriptHttp:
+    """
+    Substituto do `requests` para baixar o JSON da transcrição do FakeTranscribeClient.
+    """
+    def __init__(self, transcribe_client):
+        self.transcribe_client = transcribe_client
+
+    def get(self, url):
+        transcript = self.transcribe_client.transcript(urlparse(url).netloc)
+        return SimpleNamespace(json=lambda: {'results': {'transcripts': [{'transcript': transcript}]}})
+
+
+class FakeTelegramBot:
+    """
+    Bot do Telegram em memória: registra os handlers como o `telebot.TeleBot`, entrega mensagens
+    simuladas e guarda as mensagens enviadas/editadas, com latência configurável por chamada da API.
+    `is_provisional(texto)` identifica as mensagens ainda em andamento (a mensagem provisória e as
+    parciais do streaming), que não contam como resposta até a edição final.
+    """
+    def __init__(self, latency=0.0, is_provisional=None):
+        self.latency = latency
+        self.is_provisional = is_provisional or (lambda text: False)
+        self.handlers = []
+        self.files = {}
+        self.sent = {}  # chat_id -> lista de textos enviados
+        self.messages = {}  # message_id -> (chat_id, texto atual)
+        self.edits = 0
+        self._next_message_id = 0
+        self.condition = threading.Condition()
+
+    def message_handler(self, func=None, content_types=None):
+        def decorator(handler):
+            self.handlers.append((content_types or ['text'], func, handler))
+            return handler
+        return decorator
+
+    def process_message(self, message):
+        for content_types, func, handler in self.handlers:
+            if message.content_type in content_types and (func is None or func(message)):
+                handler(message)
+                return
+
+    def send_message(self, chat_id, text, **kwargs):
+        time.sleep(self.latency)
+        with self.condition:
+            self._next_message_id += 1
+            self.sent.setdefault(chat_id, []).append(text)
+            self.messages[self._next_message_id] = (chat_id, text)
+            self.condition.notify_all()
+            return SimpleNamespace(message_id=self._next_message_id, chat=SimpleNamespace(id=chat_id), text=text)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        time.sleep(self.latency)
+        with self.condition:
+            self.edits += 1
+            self.messages[message_id] = (chat_id, text)
+            self.condition.notify_all()
+
+    def get_file(self, file_id):
+        return SimpleNamespace(file_id=file_id, file_path=file_id)
+
+    def download_file(self, file_path):
+        time.sleep(self.latency)
+        return self.files[file_path]
+
+    def _completed(self, chat_id):
+        return sum(1 for chat, text in self.messages.values() if chat == chat_id and not self.is_provisional(text))
+
+    def wait_for_messages(self, chat_id, count, timeout=120):
+        """
+        Aguarda até o chat ter recebido `count` mensagens concluídas (no streaming, a edição final).
+        Retorna False em caso de timeout.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self._completed(chat_id) >= count, timeout)
+
+    @staticmethod
+    def text_message(user_id, first_name, text):
+        return SimpleNamespace(content_type='text', text=text, voice=None, audio=None,
+                               chat=SimpleNamespace(id=user_id),
+                               from_user=SimpleNamespace(id=user_id, first_name=first_name))
+
+    def voice_message(self, user_id, first_name, audio_bytes):
+        file_id = f"voice-{hashlib.sha1(audio_bytes).hexdigest()[:12]}-{len(self.files)}"
+        self.files[file_id] = audio_bytes
+        return SimpleNamespace(content_type='voice', text=None, audio=None,
+                               voice=SimpleNamespace(file_id=file_id, file_unique_id=file_id),
+                               chat=SimpleNamespace(id=user_id),
+                               from_user=SimpleNamespace(id=user_id, first_name=first_name))
@@ -0,0 +1,178 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from langchain_core.documents import Document
+
+# "5º", "1ª" e "§ 2º" viram termos simples ("5", "1", "par 2"), para casar com "art. 5", "artigo 5o" etc.
+ORDINAL_PATTERN = re.compile(r'(\d+)\s*[ºª°o]\b')
+# Números com separadores ("1.022", "8.078/90", números de processo) formam um único termo
+TOKEN_PATTERN = re.compile(r'\d+(?:[./-]\d+)*|\w+')
+TERM_ALIASES = {
+    'artigo': 'art', 'artigos': 'art', 'arts': 'art',
+    'paragrafo': 'par', 'paragrafos': 'par',
+    'incisos': 'inciso', 'inc': 'inciso',
+    'alineas': 'alinea',
+}
+STOPWORDS = {
+    'a', 'ao', 'aos', 'as', 'com', 'como', 'da', 'das', 'de', 'do', 'dos', 'e', 'em', 'na', 'nas', 'no', 'nos',
+    'o', 'os', 'ou', 'para', 'pela', 'pelas', 'pelo', 'pelos', 'por', 'que', 'se', 'sua', 'suas', 'seu', 'seus',
+    'um', 'uma', 'qual', 'quais', 'sobre', 'diz',
+}
+
+
+def tokenize(text):
+    """
+    Divide o texto em termos para o índice léxico: minúsculas, sem acentos, sem stopwords, com
+    números ordinais normalizados e abreviações jurídicas comuns unificadas ("artigo" → "art", "§" → "par").
+    """
+    text = ORDINAL_PATTERN.sub(r'\1 ', text.lower().replace('§', ' par '))
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    terms = []
+    for term in TOKEN_PATTERN.findall(text):
+        if term[0].isdigit():
+            term = term.replace('.', '')
+        term = TERM_ALIASES.get(term, term)
+        if term not in STOPWORDS:
+            terms.append(term)
+    return terms
+
+
+class BM25Index:
+    """
+    Índice léxico (BM25) em memória sobre os mesmos chunks do vector store. Complementa a busca
+    vetorial em consultas com citações exatas ("art. 5º, inciso XI", números de leis e processos).
+    Persistido em JSON ao lado do vector store; o índice invertido é reconstruído ao carregar.
+    """
+    def __init__(self, path, k1=1.5, b=0.75):
+        """
+        Inicializa o índice. `path` é o arquivo JSON onde os chunks são persistidos.
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.documents = {}  # id -> {'text', 'metadata', 'length'}
+        self.postings = {}   # termo -> {id: frequência}
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_vector_store(cls, vector_store_path):
+        """
+        Retorna o índice associado a um vector store (salvo no diretório pai do vector store).
+        """
+        return cls(os.path.join(os.path.dirname(vector_store_path.rstrip('/')), 'bm25.json'))
+
+    def load(self):
+        """
+        Carrega os chunks do disco e reconstrói o índice invertido.
+        """
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Aviso: índice BM25 inválido em '{self.path}' ({e}). Ele será reconstruído.")
+            return self
+
+        stored = data.get('documents', {})
+        self.add_documents(list(stored), [Document(page_content=item['text'], metadata=item.get('metadata') or {})
+                                          for item in stored.values()])
+        return self
+
+    def save(self):
+        """
+        Grava os chunks no disco de forma atômica.
+        """
+        with self.lock:
+            data = {'version': 1,
+                    'documents': {chunk_id: {'text': item['text'], 'metadata': item['metadata']}
+                                  for chunk_id, item in self.documents.items()}}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def indexed_ids(self):
+        with self.lock:
+            return set(self.documents)
+
+    def add_documents(self, ids, documents):
+        """
+        Indexa os chunks com os IDs informados (os mesmos usados no vector store).
+        """
+        self.delete([chunk_id for chunk_id in ids if chunk_id in self.documents])
+        with self.lock:
+            for chunk_id, document in zip(ids, documents):
+                frequencies = Counter(tokenize(document.page_content))
+                length = sum(frequencies.values())
+                self.documents[chunk_id] = {'text': document.page_content,
+                                            'metadata': dict(document.metadata or {}),
+                                            'length': length}
+                self.total_length += length
+                for term, frequency in frequencies.items():
+                    self.postings.setdefault(term, {})[chunk_id] = frequency
+
+    def delete(self, ids):
+        """
+        Remove os chunks do índice.
+        """
+        with self.lock:
+            for chunk_id in ids:
+                item = self.documents.pop(chunk_id, None)
+                if item is None:
+                    continue
+                self.total_length -= item['length']
+                for term in set(tokenize(item['text'])):
+                    postings = self.postings.get(term)
+                    if postings is not None:
+                        postings.pop(chunk_id, None)
+                        if not postings:
+                            del self.postings[term]
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+            self.postings.clear()
+            self.total_length = 0
+
+    def search(self, query, k=4):
+        """
+        Retorna os `k` chunks com maior pontuação BM25 como lista de (id, pontuação).
+        """
+        with self.lock:
+            total = len(self.documents)
+            if not total:
+                return []
+            average_length = self.total_length / total or 1.0
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, frequency in postings.items():
+                    length = self.documents[chunk_id]['length']
+                    norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / norm
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def get_documents(self, ids):
+        """
+        Retorna os chunks indexados com os IDs informados, na mesma ordem.
+        """
+        with self.lock:
+            return [Document(id=chunk_id, page_content=self.documents[chunk_id]['text'],
+                             metadata=dict(self.documents[chunk_id]['metadata']))
+                    for chunk_id in ids if chunk_id in self.documents]
@@ -0,0 +1,287 @@
+import json
+import os
+import re
+import threading
+import unicodedata
+from itertools import product
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.hybridRetriever import reciprocal_rank_fusion
+
+# Nomes usuais das leis mais citadas, já sem acentos e em minúsculas, e a sigla usada na chave
+LAW_ALIASES = [
+    (r'constituicao(?: federal| da republica)?|cf(?:/88)?|crfb(?:/88)?', 'cf'),
+    (r'codigo de processo penal|cpp', 'cpp'),
+    (r'codigo de processo civil|cpc(?:/15)?', 'cpc'),
+    (r'codigo penal|cp', 'cp'),
+    (r'codigo civil|cc', 'cc'),
+    (r'codigo de defesa do consumidor|cdc', 'cdc'),
+    (r'consolidacao das leis do trabalho|clt', 'clt'),
+    (r'codigo tributario nacional|ctn', 'ctn'),
+    (r'estatuto da crianca e do adolescente|eca', 'eca'),
+]
+NUMBER = r'\d+(?:\.\d{3})*'
+ARTICLE_PATTERN = re.compile(rf'\bart(?:igo)?(?P<plural>s)?\.?\s*(?P<number>{NUMBER})(?:o\b)?'
+                             rf'(?:\s*-\s*(?P<letter>[a-z])\b)?')
+# Demais artigos de uma enumeração ("arts. 5º, 37 e 93")
+ARTICLE_LIST_ITEM = re.compile(rf'\s*(?:,|\be\b)\s*({NUMBER})(?:o\b)?(?!\s*[.,]?\d)')
+PARAGRAPH_PATTERN = re.compile(r'(?:§|\bpar(?:agrafo)?\.?)\s*(\d+|unico)')
+ROMAN = r'(?=[ivxlc]+\b)c{0,3}(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})'
+# "inciso XL" ou só o numeral romano após a vírgula ("art. 5º, LV"), exceto "c/c" e a sigla "CC"
+INCISO_PATTERN = re.compile(rf'\binc(?:iso)?\.?\s*({ROMAN})\b|,\s*(?!cc\b)({ROMAN})\b(?!/)')
+LAW_PATTERN = re.compile(rf'\blei(?: complementar)?\s*(?:n[o.]*\s*)?({NUMBER})'
+                         rf'|\b(?:d[aoe]\s+|nas?\s+|nos?\s+)?({"|".join(alias for alias, _ in LAW_ALIASES)})\b')
+# Até onde, depois do número do artigo, procurar parágrafo, inciso e lei da mesma citação
+CITATION_WINDOW = 80
+
+
+def normalize_text(text):
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text.lower()) if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text)
+
+
+def _law_key(match):
+    if match.group(1):
+        return f"lei{match.group(1).replace('.', '')}"
+    name = match.group(2)
+    for alias, key in LAW_ALIASES:
+        if re.fullmatch(alias, name):
+            return key
+    return None
+
+
+def _article_mentions(text):
+    """
+    Gera (início, fim, artigo, último) para cada artigo citado. Em uma enumeração ("arts. 5º e 93") cada
+    número é um artigo; `último` é o índice do último artigo da enumeração, cuja lei vale para todos.
+    """
+    mentions = []
+    for match in ARTICLE_PATTERN.finditer(text):
+        items = [(match.start(), match.end(), match.group('number').replace('.', '') + (match.group('letter') or ''))]
+        if match.group('plural'):
+            position = match.end()
+            while (item := ARTICLE_LIST_ITEM.match(text, position)) is not None:
+                items.append((item.start(1), item.end(), item.group(1).replace('.', '')))
+                position = item.end()
+        last = len(mentions) + len(items) - 1
+        mentions.extend((start, end, article, last) for start, end, article in items)
+    return mentions
+
+
+def extract_citations(text):
+    """
+    Extrai as referências a dispositivos legais do texto ("art. 5º, inciso XI, da CF", "Art. 121 do Código Penal",
+    "art. 1.022, § 1º, do CPC", "arts. 5º e 93, IX, da CF"). Retorna uma lista de dicts com as chaves law, art,
+    par e inc (None quando ausentes).
+    """
+    text = normalize_text(text)
+    mentions = _article_mentions(text)
+
+    def window(i):
+        end = mentions[i][1] + CITATION_WINDOW
+        if i + 1 < len(mentions):
+            end = min(end, mentions[i + 1][0])
+        return text[mentions[i][1]:end]
+
+    citations = []
+    for i, (_, _, article, last) in enumerate(mentions):
+        paragraph = PARAGRAPH_PATTERN.search(window(i))
+        inciso = INCISO_PATTERN.search(window(i))
+        law = LAW_PATTERN.search(window(i)) or LAW_PATTERN.search(window(last))
+        citations.append({
+            'law': _law_key(law) if law else None,
+            'art': article,
+            'par': paragraph.group(1) if paragraph else None,
+            'inc': (inciso.group(1) or inciso.group(2)) if inciso else None,
+        })
+    return citations
+
+
+def citation_keys(citation):
+    """
+    Todas as chaves sob as quais um trecho que contém a citação é indexado: da mais específica
+    (lei + artigo + parágrafo + inciso) à mais geral (só o artigo).
+    """
+    keys = []
+    for law, par, inc in product((citation['law'], None), (citation['par'], None), (citation['inc'], None)):
+        key = citation_key({'law': law, 'art': citation['art'], 'par': par, 'inc': inc})
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+def citation_key(citation):
+    """
+    Chave de busca exata de uma citação, ex.: "cf|art=5|inc=xi".
+    """
+    parts = [citation['law']] if citation.get('law') else []
+    parts.append(f"art={citation['art']}")
+    if citation.get('par'):
+        parts.append(f"par={citation['par']}")
+    if citation.get('inc'):
+        parts.append(f"inc={citation['inc']}")
+    return '|'.join(parts)
+
+
+class CitationIndex:
+    """
+    Índice pré-calculado de citações legais: mapeia cada referência (lei, artigo, parágrafo, inciso)
+    aos IDs dos chunks que a mencionam. Montado na indexação e consultado em tempo constante,
+    sem chamar o modelo de embeddings. Persistido em JSON ao lado do vector store.
+    """
+    def __init__(self, path):
+        """
+        Inicializa o índice. `path` é o arquivo JSON onde as citações são persistidas.
+        """
+        self.path = path
+        self.chunks = {}  # id -> {chave: ocorrências}
+        self.keys = {}    # chave -> {id: ocorrências}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_vector_store(cls, vector_store_path):
+        """
+        Retorna o índice associado a um vector store (salvo no diretório pai do vector store).
+        """
+        return cls(os.path.join(os.path.dirname(vector_store_path.rstrip('/')), 'citations.json'))
+
+    def load(self):
+        """
+        Carrega as citações do disco e reconstrói o mapa chave -> chunks.
+        """
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Aviso: índice de citações inválido em '{self.path}' ({e}). Ele será reconstruído.")
+            return self
+
+        with self.lock:
+            for chunk_id, keys in data.get('chunks', {}).items():
+                self._add(chunk_id, keys)
+        return self
+
+    def save(self):
+        """
+        Grava as citações no disco de forma atômica.
+        """
+        with self.lock:
+            data = {'version': 1, 'chunks': self.chunks}
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def indexed_ids(self):
+        with self.lock:
+            return set(self.chunks)
+
+    def _add(self, chunk_id, keys):
+        self.chunks[chunk_id] = keys
+        for key, count in keys.items():
+            self.keys.setdefault(key, {})[chunk_id] = count
+
+    def add_documents(self, ids, documents):
+        """
+        Extrai as citações dos chunks e as registra com os IDs informados (os mesmos usados no vector store).
+        Chunks sem citações também são registrados, para que o índice acompanhe o vector store.
+        """
+        extracted = []
+        for document in documents:
+            keys = {}
+            for citation in extract_citations(document.page_content):
+                for key in citation_keys(citation):
+                    keys[key] = keys.get(key, 0) + 1
+            extracted.append(keys)
+
+        self.delete([chunk_id for chunk_id in ids if chunk_id in self.chunks])
+        with self.lock:
+            for chunk_id, keys in zip(ids, extracted):
+                self._add(chunk_id, keys)
+
+    def delete(self, ids):
+        """
+        Remove os chunks do índice.
+        """
+        with self.lock:
+            for chunk_id in ids:
+                for key in self.chunks.pop(chunk_id, {}):
+                    chunk_counts = self.keys.get(key)
+                    if chunk_counts is not None:
+                        chunk_counts.pop(chunk_id, None)
+                        if not chunk_counts:
+                            del self.keys[key]
+
+    def clear(self):
+        with self.lock:
+            self.chunks.clear()
+            self.keys.clear()
+
+    def lookup(self, question, k=4):
+        """
+        Procura na pergunta citações de dispositivos legais e retorna os IDs dos chunks que mencionam
+        exatamente a citação (a lei, o parágrafo e o inciso que a pergunta nomeia), os que citam mais vezes
+        primeiro. Uma citação sem correspondência exata não é generalizada: citar "art. 5 da CLT" não traz
+        o art. 5 da CF. Retorna lista vazia se nenhum chunk menciona as citações da pergunta.
+        """
+        scores = {}
+        with self.lock:
+            for citation in extract_citations(question):
+                for chunk_id, count in self.keys.get(citation_key(citation), {}).items():
+                    scores[chunk_id] = scores.get(chunk_id, 0) + count
+        return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
+class CitationRetriever(BaseRetriever):
+    """
+    Retriever que responde pelo índice de citações as perguntas que citam um dispositivo legal: se ao menos
+    `k` chunks mencionam exatamente o dispositivo citado, eles são retornados direto do vector store, sem
+    calcular o embedding da pergunta. Com menos correspondências, os chunks encontrados entram na fusão (RRF)
+    com peso `citation_weight`, junto com os resultados do retriever `fallback`, que completam os `k`.
+    Sem correspondência exata, valem apenas os resultados do `fallback`.
+    """
+    citation_index: Any
+    vector_store: Any
+    fallback: Any
+    k: int = 4
+    citation_weight: float = 2.0
+    rrf_k: int = 60
+
+    def _fetch(self, chunk_ids):
+        """
+        Busca no vector store o texto e os metadados dos chunks, por ID.
+        """
+        stored = self.vector_store.get(ids=chunk_ids, include=["documents", "metadatas"])
+        return {chunk_id: Document(id=chunk_id, page_content=text or "", metadata=metadata or {})
+                for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])}
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        chunk_ids = self.citation_index.lookup(query, self.k)
+        if len(chunk_ids) >= self.k:
+            docs_by_id = self._fetch(chunk_ids)
+            print(f"Citação encontrada no índice: {len(chunk_ids)} chunk(s), sem busca vetorial.")
+            return [docs_by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in docs_by_id]
+
+        fallback_docs = self.fallback.invoke(query)
+        if not chunk_ids:
+            return fallback_docs
+
+        docs_by_id = {doc.id or doc.page_content: doc for doc in fallback_docs}
+        missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in docs_by_id]
+        if missing:
+            docs_by_id.update(self._fetch(missing))
+        fused_ids = reciprocal_rank_fusion([chunk_ids, [doc.id or doc.page_content for doc in fallback_docs]],
+                                           self.rrf_k, weights=[self.citation_weight, 1.0])[:self.k]
+        print(f"Citação encontrada no índice: {len(chunk_ids)} chunk(s) combinados com a busca.")
+        return [docs_by_id[chunk_id] for chunk_id in fused_ids if chunk_id in docs_by_id]
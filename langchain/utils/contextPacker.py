@@ -0,0 +1,99 @@
+import re
+
+from utils.historyManager import estimate_tokens
+
+# Chunks do mesmo trecho separados por até esta quantidade de caracteres (o separador removido pelo splitter)
+# são tratados como adjacentes e unidos
+ADJACENT_GAP = 2
+
+
+class ContextPacker:
+    """
+    Monta o contexto enviado ao modelo a partir dos chunks recuperados: une os chunks sobrepostos ou
+    adjacentes da mesma página (pelo `start_index`), descarta trechos repetidos, remove os metadados
+    e o excesso de espaços, e encaixa os trechos, do mais relevante ao menos, em um orçamento de tokens.
+    Cada trecho recebe um rótulo com o documento e a página de origem.
+    """
+    def __init__(self, token_budget=1200, min_tail_tokens=100):
+        """
+        `token_budget` é o limite de tokens do contexto; um trecho que não cabe inteiro só entra cortado
+        se sobrarem pelo menos `min_tail_tokens` tokens.
+        """
+        self.token_budget = token_budget
+        self.min_tail_tokens = min_tail_tokens
+
+    @staticmethod
+    def _label(metadata):
+        source = metadata.get('source', '')
+        name = source[len('dataset/'):] if source.startswith('dataset/') else (source or 'documento')
+        page = metadata.get('page')
+        return f"{name} (p. {page + 1})" if isinstance(page, int) else name
+
+    @staticmethod
+    def _clean(text):
+        text = re.sub(r'[ \t]+', ' ', text)
+        return re.sub(r'\s*\n\s*', '\n', text).strip()
+
+    def merge(self, documents):
+        """
+        Une os chunks sobrepostos ou adjacentes da mesma página. Retorna uma lista de
+        (posição do melhor chunk no ranking, rótulo, texto), na ordem de relevância.
+        """
+        groups = {}
+        for rank, doc in enumerate(documents):
+            metadata = doc.metadata or {}
+            key = (metadata.get('source'), metadata.get('page'))
+            groups.setdefault(key, []).append((rank, metadata.get('start_index'), doc.page_content, metadata))
+
+        blocks = []
+        for chunks in groups.values():
+            positioned = sorted((chunk for chunk in chunks if isinstance(chunk[1], int)), key=lambda chunk: chunk[1])
+            unpositioned = [chunk for chunk in chunks if not isinstance(chunk[1], int)]
+
+            current = None  # [melhor posição, início, fim, texto, metadados]
+            for rank, start, text, metadata in positioned:
+                if current is not None and start <= current[2] + ADJACENT_GAP:
+                    end = start + len(text)
+                    if end > current[2]:
+                        overlap = current[2] - start
+                        current[3] += text[overlap:] if overlap >= 0 else '\n' + text
+                        current[2] = end
+                    current[0] = min(current[0], rank)
+                    continue
+                if current is not None:
+                    blocks.append(current)
+                current = [rank, start, start + len(text), text, metadata]
+            if current is not None:
+                blocks.append(current)
+            blocks.extend([rank, None, None, text, metadata] for rank, _, text, metadata in unpositioned)
+
+        blocks.sort(key=lambda block: block[0])
+        return [(rank, self._label(metadata), text) for rank, _, _, text, metadata in blocks]
+
+    def pack(self, documents):
+        """
+        Retorna o texto do contexto pronto para o prompt.
+        """
+        parts = []
+        seen = []
+        used_tokens = 0
+        for _, label, text in self.merge(documents):
+            text = self._clean(text)
+            # Trechos já contidos em outro (ex.: o mesmo despacho em dois documentos) não são repetidos
+            if not text or any(text in previous for previous in seen):
+                continue
+
+            header = f"[{len(parts) + 1}] {label}\n"
+            available = self.token_budget - used_tokens - estimate_tokens(header)
+            tokens = estimate_tokens(text)
+            if tokens > available:
+                if available < self.min_tail_tokens:
+                    break
+                text = text[:available * 4].rsplit(' ', 1)[0] + ' [...]'
+                tokens = estimate_tokens(text)
+
+            seen.append(text)
+            parts.append(header + text)
+            used_tokens += estimate_tokens(header) + tokens
+
+        return '\n\n'.join(parts) if parts else "Nenhum documento relevante encontrado."
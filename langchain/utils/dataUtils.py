@@ -1,38 +1,168 @@
 import os
 import json
 
+from utils.metrics import metrics
+
 
 class DataHandler:
-    def __init__(self):
-        self.data_dir = 'historicos'
+    """
+    Armazena o histórico de cada usuário em um arquivo JSONL (uma mensagem por linha) em modo append-only.
+    """
+    # Tamanho do bloco lido do fim do arquivo ao carregar apenas as últimas mensagens
+    TAIL_BLOCK_SIZE = 8192
+
+    def __init__(self, data_dir='historicos', user_id=None):
+        self.data_dir = data_dir
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
 
-        self.user_id = None
+        self.user_id = user_id
+
+    def _file_path(self):
+        return os.path.join(self.data_dir, f'{self.user_id}.jsonl')
+
+    @staticmethod
+    def _encode(message):
+        return (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+
+    def append_data(self, messages):
+        """
+        Acrescenta apenas as novas mensagens ao final do arquivo do usuário.
+        """
+        file_path = self._file_path()
+        if not os.path.exists(file_path):
+            print(f"Arquivo para o usuário {self.user_id} não encontrado. Criando novo arquivo.")
+
+        with metrics.span('history_append'), open(file_path, 'ab+') as file:
+            # Se uma escrita anterior foi interrompida, a última linha está incompleta: começa em uma linha nova
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    file.write(b'\n')
+            file.write(b''.join(self._encode(message) for message in messages))
+            file.flush()
+            os.fsync(file.fileno())
 
     def save_data(self, data):
         """
-        Salva os dados em um arquivo JSON.
+        Regrava todo o histórico do usuário de forma atômica (arquivo temporário + rename).
         """
+        file_path = self._file_path()
+        tmp_path = f'{file_path}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(b''.join(self._encode(message) for message in data))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
 
-        nome_do_arquivo = f"{self.user_id}.json"
-        caminho_do_arquivo = os.path.join(self.data_dir, nome_do_arquivo)
+    def _summary_path(self):
+        # Sem a extensão .json, que a migração dos históricos antigos trataria como um histórico
+        return os.path.join(self.data_dir, f'{self.user_id}.summary')
 
-        if not os.path.exists(caminho_do_arquivo):
-            print(f"Arquivo para o usuário {self.user_id} não encontrado. Criando novo arquivo.")
+    def load_summary(self):
+        """
+        Carrega o resumo da conversa gravado por `save_summary`, ou None se não houver.
+        """
+        try:
+            with open(self._summary_path(), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Resumo do histórico do usuário {self.user_id} ignorado: {e}")
+            return None
 
-        file_path = os.path.join(self.data_dir, f'{self.user_id}.json')
-        with open(file_path, 'w') as file:
-            json.dump(data, file, indent=4, ensure_ascii=False)
+    def save_summary(self, data):
+        """
+        Grava o resumo da conversa do usuário de forma atômica, ao lado do histórico.
+        """
+        file_path = self._summary_path()
+        tmp_path = f'{file_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
 
-    def load_data(self):
+    def load_data(self, last_n=None):
         """
-        Carrega os dados de um arquivo JSON.
+        Carrega o histórico do usuário. Com `last_n`, lê apenas as últimas N mensagens a partir do fim do arquivo.
         """
-        file_path = os.path.join(self.data_dir, f'{self.user_id}.json')
+        file_path = self._file_path()
         if not os.path.exists(file_path):
             print(f"Arquivo para o usuário {self.user_id} não encontrado.")
             return None
 
-        with open(file_path, 'r') as file:
-            return json.load(file)
\ No newline at end of file
+        with metrics.span('history_load'):
+            if last_n is None:
+                with open(file_path, 'rb') as file:
+                    lines = file.read().splitlines()
+            else:
+                lines = self._tail_lines(file_path, last_n)
+
+        messages = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                messages.append(json.loads(line))
+            except ValueError:
+                # Linha incompleta de uma escrita interrompida
+                print(f"Linha inválida ignorada no histórico do usuário {self.user_id}.")
+        return messages[-last_n:] if last_n is not None else messages
+
+    def _tail_lines(self, file_path, count):
+        """
+        Lê as últimas `count` linhas (mais uma, para tolerar uma linha incompleta) sem ler o arquivo inteiro.
+        """
+        if count <= 0:
+            return []
+        with open(file_path, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            position = file.tell()
+            data = b''
+            while position > 0 and data.count(b'\n') <= count + 1:
+                read_size = min(self.TAIL_BLOCK_SIZE, position)
+                position -= read_size
+                file.seek(position)
+                data = file.read(read_size) + data
+        lines = data.splitlines()
+        # A primeira linha pode estar cortada no meio quando a leitura não chegou ao início do arquivo
+        if position > 0:
+            lines = lines[1:]
+        return lines[-(count + 1):]
+
+    @staticmethod
+    def migrate_legacy_files(data_dir='historicos'):
+        """
+        Migração única dos históricos antigos (<user_id>.json com a lista completa) para JSONL.
+        O arquivo antigo é mantido com a extensão .json.migrated.
+        """
+        if not os.path.exists(data_dir):
+            return 0
+
+        migrated = 0
+        for file_name in os.listdir(data_dir):
+            if not file_name.endswith('.json'):
+                continue
+
+            legacy_path = os.path.join(data_dir, file_name)
+            user_id = file_name[:-len('.json')]
+            try:
+                with open(legacy_path, 'r') as file:
+                    data = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Erro ao migrar o histórico '{legacy_path}': {e}")
+                continue
+
+            handler = DataHandler(data_dir, user_id)
+            if os.path.exists(handler._file_path()):
+                # Já existe histórico no formato novo: as mensagens antigas vêm antes dele
+                data = data + (handler.load_data() or [])
+            handler.save_data(data)
+            os.replace(legacy_path, f'{legacy_path}.migrated')
+            migrated += 1
+
+        if migrated:
+            print(f"{migrated} histórico(s) migrado(s) para o formato JSONL.")
+        return migrated
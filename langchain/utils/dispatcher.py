@@ -0,0 +1,163 @@
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Reservation:
+    """
+    Vaga reservada na fila de um usuário, preenchida mais tarde com a tarefa (ex.: quando a transcrição
+    de um áudio fica pronta). As mensagens enviadas depois da reserva só são processadas depois dela.
+    """
+    def __init__(self, dispatcher, user_id):
+        self.dispatcher = dispatcher
+        self.user_id = user_id
+        self.entry = None  # (contexto, tarefa, argumentos) depois de preenchida
+
+    def fill(self, task, *args):
+        """
+        Preenche a vaga com `task(*args)`, que roda com uma cópia do contexto de quem a preencheu.
+        """
+        self.dispatcher._fill(self, task, args)
+
+    def cancel(self):
+        """
+        Libera a vaga sem processar nada, para que as mensagens seguintes do usuário não fiquem presas.
+        """
+        self.fill(lambda: None)
+
+
+class UserDispatcher:
+    """
+    Processa as mensagens de usuários diferentes em paralelo em um pool de workers, mantendo a ordem
+    estrita das mensagens de cada usuário. Cada usuário tem uma fila própria com limite de tamanho,
+    e as filas são atendidas em rodízio: após cada mensagem o usuário volta para o fim da fila do pool.
+    Uma vaga pode ser reservada na fila antes de a tarefa existir (`reserve`); enquanto ela não é preenchida,
+    o usuário aguarda fora do pool, sem ocupar um worker.
+    """
+    def __init__(self, max_workers=8, max_queue_per_user=5, max_pending=200):
+        """
+        Inicializa o dispatcher com o número de workers e os limites das filas.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dispatcher")
+        self.max_queue_per_user = max_queue_per_user
+        self.max_pending = max_pending
+        self.queues = {}
+        self.parked = set()  # usuários cuja próxima tarefa é uma reserva ainda não preenchida
+        self.pending = 0
+        self.rejected = 0
+        self.processed = 0
+        self.lock = threading.Lock()
+
+    def submit(self, user_id, task, *args):
+        """
+        Enfileira `task(*args)` para o usuário. Retorna False se a fila do usuário ou a fila global estiver cheia.
+        A tarefa roda com uma cópia do contexto de quem a enfileirou (ex.: o ID da requisição nas métricas).
+        """
+        context = contextvars.copy_context()
+        with self.lock:
+            queue = self.queues.get(user_id)
+            if self.pending >= self.max_pending or (queue is not None and len(queue) >= self.max_queue_per_user):
+                self.rejected += 1
+                return False
+
+            self.pending += 1
+            if queue is not None:
+                # Já existe um worker responsável por este usuário; a tarefa entra na fila dele
+                queue.append((context, task, args))
+                return True
+
+            self.queues[user_id] = deque([(context, task, args)])
+
+        self.executor.submit(self._run_next, user_id)
+        return True
+
+    def reserve(self, user_id):
+        """
+        Reserva a próxima vaga na fila do usuário, a ser preenchida com `Reservation.fill` (ou liberada com
+        `Reservation.cancel`). Retorna None se a fila do usuário ou a fila global estiver cheia.
+        """
+        with self.lock:
+            queue = self.queues.get(user_id)
+            if self.pending >= self.max_pending or (queue is not None and len(queue) >= self.max_queue_per_user):
+                self.rejected += 1
+                return None
+
+            self.pending += 1
+            reservation = Reservation(self, user_id)
+            if queue is not None:
+                queue.append(reservation)
+            else:
+                self.queues[user_id] = deque([reservation])
+                self.parked.add(user_id)
+            return reservation
+
+    def _fill(self, reservation, task, args):
+        context = contextvars.copy_context()
+        user_id = reservation.user_id
+        with self.lock:
+            if reservation.entry is not None:
+                return
+            reservation.entry = (context, task, args)
+            resume = user_id in self.parked and self.queues[user_id][0] is reservation
+            if resume:
+                self.parked.discard(user_id)
+
+        if resume:
+            self.executor.submit(self._run_next, user_id)
+
+    def _run_next(self, user_id):
+        """
+        Executa a próxima tarefa do usuário e, se houver mais, reagenda o usuário no fim da fila do pool.
+        """
+        while True:
+            with self.lock:
+                entry = self.queues[user_id][0]
+                if isinstance(entry, Reservation):
+                    if entry.entry is None:
+                        # A reserva ainda não foi preenchida: `_fill` reagenda o usuário
+                        self.parked.add(user_id)
+                        return
+                    entry = entry.entry
+                context, task, args = entry
+
+            try:
+                context.run(task, *args)
+            except Exception as e:
+                print(f"Erro ao processar mensagem do usuário {user_id}: {e}")
+
+            with self.lock:
+                queue = self.queues[user_id]
+                queue.popleft()
+                self.pending -= 1
+                self.processed += 1
+                if not queue:
+                    del self.queues[user_id]
+                    return
+
+            try:
+                self.executor.submit(self._run_next, user_id)
+                return
+            except RuntimeError:
+                # Pool em encerramento: termina as mensagens restantes do usuário nesta mesma thread
+                continue
+
+    def metrics(self):
+        """
+        Profundidade das filas e contadores do dispatcher.
+        """
+        with self.lock:
+            return {
+                'pending': self.pending,
+                'active_users': len(self.queues),
+                'waiting_reservations': len(self.parked),
+                'max_user_queue': max((len(queue) for queue in self.queues.values()), default=0),
+                'processed': self.processed,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self, wait=True):
+        """
+        Encerra o pool, aguardando as mensagens em andamento.
+        """
+        self.executor.shutdown(wait=wait)
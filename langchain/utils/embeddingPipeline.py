@@ -0,0 +1,189 @@
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.exceptions import ClientError
+from langchain_core.embeddings import Embeddings
+
+# Códigos de erro do Bedrock que valem uma nova tentativa
+RETRYABLE_ERROR_CODES = (
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+    'ModelTimeoutException',
+    'InternalServerException',
+)
+
+
+def is_retryable_error(error):
+    """
+    Indica se um erro do Bedrock é transitório (throttling, indisponibilidade).
+    O langchain_aws encapsula o ClientError em ValueError, por isso a mensagem também é verificada.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES
+    message = str(error)
+    return any(code in message for code in RETRYABLE_ERROR_CODES)
+
+
+class EmbeddingCache:
+    """
+    Cache em disco (SQLite) de embeddings, indexado por (ID do modelo, hash do texto do chunk).
+    """
+    # Limite de parâmetros por consulta no SQLite
+    QUERY_BATCH_SIZE = 500
+
+    def __init__(self, path='cache/embeddings.sqlite3'):
+        """
+        Abre (ou cria) o banco do cache.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'model_id TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, '
+                'PRIMARY KEY (model_id, text_hash))'
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model_id, text_hashes):
+        """
+        Retorna {hash: vetor} para os hashes presentes no cache.
+        """
+        found = {}
+        text_hashes = list(text_hashes)
+        with self.lock:
+            for i in range(0, len(text_hashes), self.QUERY_BATCH_SIZE):
+                batch = text_hashes[i:i + self.QUERY_BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f'SELECT text_hash, vector FROM embeddings WHERE model_id = ? AND text_hash IN ({placeholders})',
+                    [model_id, *batch]
+                )
+                for text_hash, blob in rows:
+                    found[text_hash] = array('f', blob).tolist()
+        return found
+
+    def put_many(self, model_id, items):
+        """
+        Grava uma lista de pares (hash, vetor) no cache.
+        """
+        rows = [(model_id, text_hash, array('f', vector).tobytes()) for text_hash, vector in items]
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)', rows)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class EmbeddingPipeline(Embeddings):
+    """
+    Etapa de embeddings em lotes, com paralelismo limitado, retry com backoff e cache em disco.
+    Pode ser usada diretamente como `embedding_function` do vector store.
+    """
+    def __init__(self, embeddings, model_id, cache=None, batch_size=16, max_workers=4,
+                 max_retries=5, backoff_base=1.0, backoff_max=30.0, query_cache_size=256):
+        """
+        Inicializa o pipeline a partir de um modelo de embeddings do LangChain (ex.: BedrockEmbeddings).
+        """
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Perguntas recentes: o cache de respostas e o retriever embedam a mesma pergunta
+        self.query_cache_size = query_cache_size
+        self.query_cache = OrderedDict()
+        self.query_lock = threading.Lock()
+
+    def _with_retry(self, func, *args):
+        """
+        Executa `func` repetindo em erros transitórios, com backoff exponencial e jitter.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                delay = random.uniform(delay / 2, delay)
+                attempt += 1
+                print(f"Erro transitório no embedding ({e}). Tentativa {attempt}/{self.max_retries} em {delay:.1f}s...")
+                time.sleep(delay)
+
+    def _embed_batch(self, batch):
+        return self._with_retry(self.embeddings.embed_documents, batch)
+
+    def embed_documents(self, texts):
+        """
+        Retorna os embeddings dos textos, calculando apenas os que não estão no cache.
+        """
+        text_hashes = [EmbeddingCache.text_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model_id, set(text_hashes)) if self.cache else {}
+
+        # Textos faltantes, sem repetição
+        missing = {}
+        for text_hash, text in zip(text_hashes, texts):
+            if text_hash not in vectors and text_hash not in missing:
+                missing[text_hash] = text
+
+        if missing:
+            missing_hashes = list(missing)
+            batches = [missing_hashes[i:i + self.batch_size] for i in range(0, len(missing_hashes), self.batch_size)]
+            print(f"Embeddings: {len(texts) - len(missing)} do cache, {len(missing)} a calcular "
+                  f"em {len(batches)} lote(s).")
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {
+                    executor.submit(self._embed_batch, [missing[text_hash] for text_hash in batch]): batch
+                    for batch in batches
+                }
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    batch_vectors = future.result()
+                    # Grava cada lote assim que termina: uma falha posterior não perde o que já foi pago
+                    if self.cache:
+                        self.cache.put_many(self.model_id, zip(batch, batch_vectors))
+                    vectors.update(zip(batch, batch_vectors))
+
+        return [vectors[text_hash] for text_hash in text_hashes]
+
+    def embed_query(self, text):
+        """
+        Retorna o embedding de uma pergunta, reaproveitando as perguntas embedadas recentemente.
+        """
+        with self.query_lock:
+            if text in self.query_cache:
+                self.query_cache.move_to_end(text)
+                return self.query_cache[text]
+
+        vector = self._with_retry(self.embeddings.embed_query, text)
+
+        if self.query_cache_size > 0:
+            with self.query_lock:
+                self.query_cache[text] = vector
+                while len(self.query_cache) > self.query_cache_size:
+                    self.query_cache.popitem(last=False)
+        return vector
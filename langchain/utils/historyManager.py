@@ -0,0 +1,232 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.dataUtils import DataHandler
+
+SUMMARY_PROMPT = """\
+Você mantém o resumo de uma conversa entre um usuário e Themis, uma assistente jurídica virtual.
+Atualize o resumo atual incorporando as novas mensagens. Preserve os temas jurídicos discutidos,
+artigos, leis e documentos citados, e dúvidas ainda em aberto. Responda apenas com o resumo,
+em português, com no máximo {max_words} palavras.
+
+Resumo atual:
+{summary}
+
+Novas mensagens:
+{messages}
+"""
+
+
+def estimate_tokens(text):
+    """
+    Estimativa simples de tokens (~4 caracteres por token), suficiente para controlar o orçamento.
+    """
+    return max(1, len(text) // 4)
+
+
+class HistoryManager:
+    """
+    Ajusta o histórico da conversa a um orçamento de tokens: as mensagens mais recentes são enviadas
+    na íntegra e as mais antigas são condensadas em um resumo atualizado de forma incremental.
+    Com `data_dir`, o resumo é gravado ao lado do histórico do usuário e sobrevive a reinícios do bot.
+    """
+    # Mensagens finais do trecho resumido usadas para reencontrá-lo no histórico carregado
+    ANCHOR_MESSAGES = 6
+
+    def __init__(self, llm=None, token_budget=1500, min_recent_messages=2, summary_ratio=0.25, max_sessions=1000,
+                 max_summary_rounds=1, data_dir=None):
+        """
+        Inicializa o gerenciador. `llm` é o modelo usado para resumir; sem ele, o resumo
+        é um recorte das perguntas anteriores do usuário. Cada chamada de resumo recebe no máximo
+        `token_budget` tokens de mensagens; até `max_summary_rounds` chamadas são feitas durante a pergunta
+        e um atraso maior é resumido em segundo plano.
+        """
+        self.llm = llm
+        self.token_budget = token_budget
+        self.min_recent_messages = min_recent_messages
+        self.summary_budget = int(token_budget * summary_ratio)
+        self.recent_budget = token_budget - self.summary_budget
+        self.max_sessions = max_sessions
+        self.max_summary_rounds = max(1, max_summary_rounds)
+        self.data_dir = data_dir
+        # sessão -> (digest das últimas mensagens resumidas, resumo)
+        self.summaries = OrderedDict()
+        self.pending = set()  # sessões com resumo em andamento em segundo plano
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-summary')
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _digest(messages):
+        sha = hashlib.sha1()
+        for message in messages:
+            sha.update(f"{message.get('role')}:{message.get('content')}\n".encode('utf-8'))
+        return sha.hexdigest()
+
+    def _anchor(self, history, covered):
+        return self._digest(history[max(0, covered - self.ANCHOR_MESSAGES):covered]) if covered else None
+
+    def _locate(self, history, anchor):
+        """
+        Retorna quantas mensagens do início do histórico já estão no resumo: a posição logo após as
+        mensagens do `anchor`. Se elas não estão no histórico carregado (ex.: ficaram antes da janela lida
+        do disco), o resumo cobre só mensagens anteriores a ele e retorna 0.
+        """
+        if anchor is None:
+            return 0
+        for covered in range(len(history), 0, -1):
+            if self._anchor(history, covered) == anchor:
+                return covered
+        return 0
+
+    def _load(self, session_id):
+        """
+        Retorna (anchor, resumo) da sessão, da memória ou, na falta dela, do disco.
+        """
+        with self.lock:
+            state = self.summaries.get(session_id)
+            if state is not None:
+                self.summaries.move_to_end(session_id)
+                return state
+
+        state = (None, '')
+        if self.data_dir is not None and session_id is not None:
+            stored = DataHandler(self.data_dir, session_id).load_summary()
+            if stored:
+                state = (stored.get('anchor'), stored.get('summary', ''))
+        self._remember(session_id, state)
+        return state
+
+    def _remember(self, session_id, state):
+        with self.lock:
+            self.summaries[session_id] = state
+            self.summaries.move_to_end(session_id)
+            while len(self.summaries) > self.max_sessions:
+                self.summaries.popitem(last=False)
+
+    def _save(self, session_id, anchor, summary):
+        self._remember(session_id, (anchor, summary))
+        if self.data_dir is None or session_id is None:
+            return
+        try:
+            DataHandler(self.data_dir, session_id).save_summary({'anchor': anchor, 'summary': summary})
+        except OSError as e:
+            print(f"Erro ao gravar o resumo do histórico de {session_id}: {e}")
+
+    def _split(self, history, budget):
+        """
+        Retorna o índice a partir do qual as mensagens cabem no orçamento informado.
+        """
+        used = 0
+        split = len(history)
+        while split > 0:
+            cost = estimate_tokens(str(history[split - 1].get('content', '')))
+            kept = len(history) - split
+            if used + cost > budget and kept >= self.min_recent_messages:
+                break
+            used += cost
+            split -= 1
+
+        # Não separa uma pergunta da sua resposta: as recentes começam por uma mensagem do usuário
+        while 0 < split < len(history) and history[split].get('role') != 'user':
+            split += 1
+        return split
+
+    def _format_messages(self, messages):
+        lines = []
+        max_chars = self.token_budget * 4
+        for message in messages:
+            speaker = 'Usuário' if message.get('role') == 'user' else 'Themis'
+            content = str(message.get('content'))
+            lines.append(f"{speaker}: {content if len(content) <= max_chars else content[:max_chars] + '...'}")
+        return '\n'.join(lines)
+
+    def _batches(self, messages):
+        """
+        Divide as mensagens a resumir em lotes de até `token_budget` tokens.
+        """
+        batch, used = [], 0
+        for message in messages:
+            cost = min(estimate_tokens(str(message.get('content', ''))), self.token_budget)
+            if batch and used + cost > self.token_budget:
+                yield batch
+                batch, used = [], 0
+            batch.append(message)
+            used += cost
+        if batch:
+            yield batch
+
+    def _summarize(self, summary, messages):
+        """
+        Atualiza o resumo com as novas mensagens usando o LLM (ou um recorte, se não houver LLM).
+        """
+        max_words = max(30, self.summary_budget * 3 // 4)
+        if self.llm is not None:
+            try:
+                prompt = SUMMARY_PROMPT.format(max_words=max_words,
+                                               summary=summary or 'Nenhum.',
+                                               messages=self._format_messages(messages))
+                response = self.llm.invoke(prompt)
+                return self._truncate(str(getattr(response, 'content', response)).strip())
+            except Exception as e:
+                print(f"Erro ao resumir o histórico: {e}. Usando resumo simplificado.")
+
+        questions = [str(message.get('content')) for message in messages if message.get('role') == 'user']
+        combined = ' | '.join(filter(None, [summary] + [f"Perguntou: {question}" for question in questions]))
+        return self._truncate(combined, keep_end=True)
+
+    def _truncate(self, text, keep_end=False):
+        max_chars = self.summary_budget * 4
+        if len(text) <= max_chars:
+            return text
+        return '...' + text[-max_chars:] if keep_end else text[:max_chars] + '...'
+
+    def _summarize_later(self, session_id, summary, batches, anchor):
+        """
+        Resume os lotes em segundo plano e grava o resultado; uma sessão por vez.
+        """
+        with self.lock:
+            if session_id in self.pending:
+                return
+            self.pending.add(session_id)
+
+        def run():
+            try:
+                result = summary
+                for batch in batches:
+                    result = self._summarize(result, batch)
+                self._save(session_id, anchor, result)
+                print(f"Resumo do histórico de {session_id} atualizado em segundo plano ({len(batches)} lote(s)).")
+            finally:
+                with self.lock:
+                    self.pending.discard(session_id)
+
+        self.executor.submit(run)
+
+    def fit(self, session_id, history):
+        """
+        Retorna (mensagens recentes, resumo) que cabem no orçamento de tokens, sem repetir no resumo
+        o que é enviado na íntegra. Ao resumir, as recentes são reduzidas à metade do orçamento, para que
+        as próximas trocas caibam sem um novo resumo a cada mensagem. As mensagens antigas são resumidas
+        em lotes limitados; se há mais lotes que `max_summary_rounds` (ex.: conversa longa sem resumo
+        gravado), eles são resumidos em segundo plano e, enquanto isso, as mensagens que não cabem no
+        orçamento ficam de fora.
+        """
+        history = history or []
+        split = self._split(history, self.recent_budget)
+        anchor, summary = self._load(session_id)
+        covered = self._locate(history, anchor)
+
+        if split > covered:
+            new_covered = max(split, self._split(history, self.recent_budget // 2))
+            batches = list(self._batches(history[covered:new_covered]))
+            if len(batches) > self.max_summary_rounds:
+                self._summarize_later(session_id, summary, batches, self._anchor(history, new_covered))
+                return history[split:], summary
+            for batch in batches:
+                summary = self._summarize(summary, batch)
+            covered = new_covered
+            self._save(session_id, self._anchor(history, covered), summary)
+
+        return history[covered:], summary
@@ -0,0 +1,45 @@
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60, weights=None):
+    """
+    Combina listas ranqueadas de IDs pela fusão de rankings recíprocos (RRF):
+    cada ID recebe a soma de peso / (rrf_k + posição) nas listas em que aparece (peso 1 por padrão).
+    Retorna os IDs ordenados pela pontuação combinada.
+    """
+    scores = {}
+    for ranking, weight in zip(rankings, weights or [1.0] * len(rankings)):
+        for position, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (rrf_k + position)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever híbrido: busca vetorial no vector store e busca léxica (BM25) sobre os mesmos chunks,
+    combinadas por RRF. Os termos exatos (artigos, incisos, números de leis) que o embedding
+    não distingue bem são recuperados pelo BM25, então bastam menos candidatos de cada lado.
+    """
+    vector_store: Any
+    bm25_index: Any
+    k: int = 4
+    fetch_k: int = 8
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs = self.vector_store.similarity_search(query, k=self.fetch_k)
+        lexical_ids = [chunk_id for chunk_id, _ in self.bm25_index.search(query, k=self.fetch_k)]
+
+        docs_by_id = {doc.id: doc for doc in vector_docs if doc.id}
+        fused_ids = reciprocal_rank_fusion([[doc.id for doc in vector_docs if doc.id], lexical_ids],
+                                           self.rrf_k)[:self.k]
+
+        # Os chunks que vieram só do BM25 são lidos do próprio índice, sem nova consulta ao vector store
+        missing = [chunk_id for chunk_id in fused_ids if chunk_id not in docs_by_id]
+        docs_by_id.update({doc.id: doc for doc in self.bm25_index.get_documents(missing)})
+        return [docs_by_id[chunk_id] for chunk_id in fused_ids if chunk_id in docs_by_id]
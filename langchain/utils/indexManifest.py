@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+
+
+class IndexManifest:
+    """
+    Manifesto do vector store: para cada PDF indexado guarda o hash do conteúdo
+    e os IDs dos chunks gerados a partir dele.
+    """
+    VERSION = 1
+
+    def __init__(self, path):
+        """
+        Inicializa o manifesto a partir do caminho do arquivo JSON.
+        """
+        self.path = path
+        self.documents = {}
+
+    @classmethod
+    def for_vector_store(cls, vector_store_path):
+        """
+        Cria o manifesto que fica ao lado do diretório do vector store.
+        """
+        base_dir = os.path.dirname(os.path.normpath(vector_store_path))
+        manifest = cls(os.path.join(base_dir, 'manifest.json'))
+        manifest.load()
+        return manifest
+
+    def load(self):
+        """
+        Carrega o manifesto do disco. Um arquivo ausente ou corrompido resulta em manifesto vazio.
+        """
+        if not os.path.exists(self.path):
+            self.documents = {}
+            return self
+
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            self.documents = data.get('documents', {})
+        except (OSError, ValueError) as e:
+            print(f"Erro ao ler o manifesto '{self.path}': {e}. Iniciando manifesto vazio.")
+            self.documents = {}
+        return self
+
+    def save(self):
+        """
+        Salva o manifesto de forma atômica (arquivo temporário + rename).
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({'version': self.VERSION, 'documents': self.documents}, file, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def file_hash(file_path):
+        """
+        Calcula o SHA-256 do conteúdo de um arquivo, lendo em blocos.
+        """
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    @staticmethod
+    def chunk_id(document_name, content_hash, index):
+        """
+        Gera um ID determinístico para o chunk de número `index` de um documento.
+        """
+        prefix = hashlib.sha1(f"{document_name}:{content_hash}".encode('utf-8')).hexdigest()[:16]
+        return f"{prefix}-{index:05d}"
+
+    def diff(self, current_hashes):
+        """
+        Compara o manifesto com os hashes atuais ({documento: hash}).
+        Retorna as listas (novos, alterados, removidos).
+        """
+        added = [name for name in current_hashes if name not in self.documents]
+        changed = [name for name, content_hash in current_hashes.items()
+                   if name in self.documents and self.documents[name].get('hash') != content_hash]
+        removed = [name for name in self.documents if name not in current_hashes]
+        return added, changed, removed
+
+    def chunk_ids(self, document_name):
+        """
+        Retorna os IDs dos chunks de um documento indexado.
+        """
+        return list(self.documents.get(document_name, {}).get('chunk_ids', []))
+
+    def set_document(self, document_name, content_hash, chunk_ids):
+        """
+        Registra (ou substitui) um documento indexado.
+        """
+        self.documents[document_name] = {'hash': content_hash, 'chunk_ids': list(chunk_ids)}
+
+    def remove_document(self, document_name):
+        """
+        Remove um documento do manifesto.
+        """
+        self.documents.pop(document_name, None)
+
+    def fingerprint(self):
+        """
+        Identificador da versão do acervo indexado: muda sempre que um documento é adicionado, alterado ou removido.
+        """
+        sha = hashlib.sha256()
+        for name in sorted(self.documents):
+            sha.update(f"{name}:{self.documents[name].get('hash')}\n".encode('utf-8'))
+        return sha.hexdigest()[:16]
+
+    def is_empty(self):
+        return not self.documents
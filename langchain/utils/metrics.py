@@ -0,0 +1,257 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+# Limites (em segundos) dos buckets dos histogramas de latência
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = 'themis_'
+
+_current_request = contextvars.ContextVar('current_request', default=None)
+
+
+class RequestTrace:
+    """
+    Dados de uma requisição em andamento: ID e os spans (etapa, duração) registrados nela.
+    """
+    def __init__(self, request_id, kind):
+        self.request_id = request_id
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add_span(self, name, duration, labels):
+        with self.lock:
+            self.spans.append({'stage': name, 'seconds': round(duration, 4), **labels})
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + list(extra or [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in items) + '}'
+
+
+class MetricsRegistry:
+    """
+    Métricas do bot: contadores, histogramas de latência por etapa, medidores lidos de funções
+    `metrics()` dos componentes, e o registro das requisições lentas (amostradas) em um log JSONL.
+    Exportadas no formato texto do Prometheus.
+    """
+    def __init__(self, slow_request_seconds=10.0, slow_sample_rate=1.0, slow_log_path='logs/slow_requests.jsonl'):
+        """
+        Requisições com duração acima de `slow_request_seconds` são gravadas em `slow_log_path`
+        com probabilidade `slow_sample_rate`, junto com o detalhamento por etapa.
+        """
+        self.slow_request_seconds = slow_request_seconds
+        self.slow_sample_rate = slow_sample_rate
+        self.slow_log_path = slow_log_path
+        self.counters = {}    # (nome, labels) -> valor
+        self.histograms = {}  # (nome, labels) -> Histogram
+        self.gauge_sources = {}  # prefixo -> função que retorna um dict de valores
+        self.lock = threading.Lock()
+        self.slow_log_lock = threading.Lock()
+
+    def configure(self, slow_request_seconds=None, slow_sample_rate=None, slow_log_path=None):
+        if slow_request_seconds is not None:
+            self.slow_request_seconds = slow_request_seconds
+        if slow_sample_rate is not None:
+            self.slow_sample_rate = slow_sample_rate
+        if slow_log_path is not None:
+            self.slow_log_path = slow_log_path
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def register_gauges(self, prefix, source):
+        """
+        Registra uma função (ex.: `dispatcher.metrics`) cujos valores numéricos são exportados como medidores.
+        """
+        with self.lock:
+            self.gauge_sources[prefix] = source
+
+    @staticmethod
+    def request_id():
+        """
+        ID da requisição em andamento no contexto atual, ou None.
+        """
+        trace = _current_request.get()
+        return trace.request_id if trace is not None else None
+
+    @contextmanager
+    def request(self, kind, request_id=None):
+        """
+        Abre o escopo de uma requisição: os spans registrados dentro dele (inclusive em threads que
+        copiem o contexto) são associados ao mesmo ID. Se já houver uma requisição no contexto, o ID dela
+        é reaproveitado (ex.: o áudio transcrito que segue para a resposta).
+        """
+        parent = _current_request.get()
+        trace = RequestTrace(request_id or (parent.request_id if parent is not None else uuid4().hex[:12]), kind)
+        token = _current_request.set(trace)
+        status = 'ok'
+        try:
+            yield trace
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            _current_request.reset(token)
+            duration = time.perf_counter() - trace.start
+            self.observe('request_duration_seconds', duration, kind=kind)
+            self.increment('requests_total', kind=kind, status=status)
+            if duration >= self.slow_request_seconds and random.random() < self.slow_sample_rate:
+                self._log_slow_request(trace, duration, status)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """
+        Mede a duração de uma etapa: alimenta o histograma `stage_duration_seconds` e o detalhamento
+        da requisição em andamento.
+        """
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            yield
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, status, **labels)
+
+    def record(self, stage, duration, status='ok', **labels):
+        """
+        Registra a duração de uma etapa medida manualmente (ex.: o tempo até o primeiro token de um stream).
+        """
+        self.observe('stage_duration_seconds', duration, stage=stage)
+        if status == 'error':
+            self.increment('stage_errors_total', stage=stage)
+        trace = _current_request.get()
+        if trace is not None:
+            trace.add_span(stage, duration, dict(labels, status=status) if status == 'error' else labels)
+
+    def _log_slow_request(self, trace, duration, status):
+        entry = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'request_id': trace.request_id,
+            'kind': trace.kind,
+            'status': status,
+            'seconds': round(duration, 4),
+            'spans': list(trace.spans),
+        }
+        try:
+            with self.slow_log_lock:
+                os.makedirs(os.path.dirname(self.slow_log_path) or '.', exist_ok=True)
+                with open(self.slow_log_path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"Erro ao gravar o log de requisições lentas: {e}")
+
+    def summary(self, name, label):
+        """
+        Contagem e média de um histograma para cada valor do label (ex.: a duração média de cada etapa).
+        """
+        with self.lock:
+            return {dict(labels).get(label): {'count': histogram.count, 'mean': histogram.sum / histogram.count}
+                    for (metric, labels), histogram in self.histograms.items() if metric == name and histogram.count}
+
+    def render(self):
+        """
+        Exporta as métricas no formato texto do Prometheus.
+        """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+            gauge_sources = list(self.gauge_sources.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                typed.add(name)
+            lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                typed.add(name)
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+
+        for prefix, source in gauge_sources:
+            try:
+                values = source()
+            except Exception as e:
+                print(f"Erro ao ler as métricas de {prefix}: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {PREFIX}{prefix}_{key} gauge")
+                    lines.append(f"{PREFIX}{prefix}_{key} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port, host='127.0.0.1'):
+        """
+        Expõe as métricas em http://host:port/metrics em uma thread em segundo plano.
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Métricas disponíveis em http://{host}:{server.server_port}/metrics")
+        return server
+
+
+# Registro compartilhado pelos módulos do bot
+metrics = MetricsRegistry()
@@ -0,0 +1,386 @@
+import glob
+import json
+import os
+import threading
+from uuid import uuid4
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+
+class _State:
+    """
+    Versão imutável do store lida pelas buscas; cada gravação publica uma nova. As linhas da matriz
+    incluem as removidas (`live` falso) até a próxima compactação.
+    """
+    def __init__(self, ids=(), metadatas=(), ends=(0,), live=(), positions=None, matrix=None, texts=None):
+        self.ids = ids              # ID de cada linha
+        self.metadatas = metadatas  # metadados de cada linha
+        self.ends = ends            # o texto da linha i ocupa os bytes [ends[i], ends[i + 1]) do arquivo de textos
+        self.live = np.asarray(live, dtype=bool)
+        self.positions = positions or {}  # ID -> linha, apenas das linhas vivas
+        self.matrix = matrix
+        self.texts = texts
+
+    def text(self, row):
+        return bytes(self.texts[self.ends[row]:self.ends[row + 1]]).decode('utf-8') if self.texts is not None else ''
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store em processo: os embeddings ficam normalizados (L2, float32) em um arquivo mapeado
+    em memória, e a busca exata top-k e o MMR são feitos com operações matriciais do NumPy.
+    Abrir o store só mapeia os arquivos e lê o log de linhas (IDs e metadados), então a carga é rápida
+    e vários processos do bot compartilham a matriz e os textos pelo cache de páginas do sistema.
+
+    Os registros ficam em três arquivos de uma geração, gravados apenas com acréscimos no fim: a matriz
+    de vetores, os textos (UTF-8, lidos por deslocamento) e o log de linhas (JSONL com ID, metadados e
+    tamanho do texto de cada linha, e as remoções). O `meta.json` guarda só quantas linhas e bytes de cada
+    arquivo estão confirmados e é trocado de forma atômica ao fim de cada gravação: gravar custa o
+    tamanho do que foi acrescentado, e o que passar do tamanho confirmado (gravação interrompida) é
+    descartado. Remoções apenas marcam as linhas; quando as removidas passam das vivas, a geração é
+    compactada em arquivos novos. Quem já estava lendo continua com a versão anterior até recarregar.
+    """
+    META_FILE = 'meta.json'
+    VERSION = 2
+    # A compactação só acontece com pelo menos esta quantidade de linhas removidas
+    COMPACT_MIN_DEAD = 1000
+    # Linhas copiadas por vez na compactação e na migração do formato antigo
+    REWRITE_BATCH = 10000
+
+    def __init__(self, persist_directory, embedding_function):
+        """
+        Abre (ou cria) o store no diretório informado.
+        """
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.lock = threading.Lock()
+        self._state = _State()
+        self._meta = None
+        os.makedirs(persist_directory, exist_ok=True)
+        self.load()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def _path(self, kind, generation):
+        extension = {'vectors': 'f32', 'texts': 'bin', 'rows': 'jsonl'}[kind]
+        return os.path.join(self.persist_directory, f"{kind}-{generation}.{extension}")
+
+    def load(self):
+        """
+        (Re)carrega o store do disco, mapeando a matriz e os textos em modo somente leitura.
+        """
+        meta_path = os.path.join(self.persist_directory, self.META_FILE)
+        for _ in range(3):
+            if not os.path.exists(meta_path):
+                return self
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            if meta.get('version', 1) < self.VERSION:
+                with self.lock:
+                    self._migrate(meta)
+                return self
+            try:
+                with open(self._path('rows', meta['generation']), 'rb') as file:
+                    records = [json.loads(line) for line in file.read(meta['log_bytes']).splitlines()]
+                state = self._apply(_State(), records, meta)
+            except FileNotFoundError:
+                # Outro processo compactou o store entre a leitura do meta.json e a dos arquivos
+                continue
+            self._state, self._meta = state, meta
+            return self
+        raise RuntimeError(f"Não foi possível carregar o vector store em '{self.persist_directory}'.")
+
+    def _apply(self, state, records, meta):
+        """
+        Aplica ao estado os registros do log (linhas acrescentadas e remoções) e mapeia os arquivos
+        até os tamanhos confirmados em `meta`. Retorna um novo estado; `state` não é alterado.
+        """
+        ids, metadatas, ends = list(state.ids), list(state.metadatas), list(state.ends)
+        live, positions = state.live.tolist(), dict(state.positions)
+        for record in records:
+            if 'delete' in record:
+                for chunk_id in record['delete']:
+                    row = positions.pop(chunk_id, None)
+                    if row is not None:
+                        live[row] = False
+                continue
+            if record['id'] in positions:
+                live[positions[record['id']]] = False
+            positions[record['id']] = len(ids)
+            ids.append(record['id'])
+            metadatas.append(record['metadata'])
+            ends.append(ends[-1] + record['length'])
+            live.append(True)
+
+        generation = meta['generation']
+        matrix = texts = None
+        if meta['rows']:
+            matrix = np.memmap(self._path('vectors', generation), dtype=np.float32, mode='r',
+                               shape=(meta['rows'], meta['dim']))
+        if meta['texts_bytes']:
+            texts = np.memmap(self._path('texts', generation), dtype=np.uint8, mode='r',
+                              shape=(meta['texts_bytes'],))
+        return _State(ids, metadatas, ends, live, positions, matrix, texts)
+
+    @staticmethod
+    def _append_file(path, committed, data):
+        # O que passar do tamanho confirmado é resto de uma gravação interrompida
+        with open(path, 'ab') as file:
+            file.truncate(committed)
+            file.write(data)
+
+    def _write(self, meta, records, texts=(), vectors=None):
+        """
+        Acrescenta aos arquivos da geração de `meta` os registros do log, os textos e os vetores das
+        linhas novas (na mesma ordem dos registros de linha). Retorna o meta com os novos tamanhos,
+        ainda não publicado. Deve ser chamada com `self.lock`.
+        """
+        generation = meta['generation']
+        log_data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+        text_data = b''.join(texts)
+        rows = 0
+        if vectors is not None and len(vectors):
+            rows = len(vectors)
+            self._append_file(self._path('vectors', generation), meta['rows'] * meta['dim'] * 4,
+                              np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._append_file(self._path('texts', generation), meta['texts_bytes'], text_data)
+        self._append_file(self._path('rows', generation), meta['log_bytes'], log_data)
+        return {**meta, 'rows': meta['rows'] + rows, 'texts_bytes': meta['texts_bytes'] + len(text_data),
+                'log_bytes': meta['log_bytes'] + len(log_data)}
+
+    def _publish(self, meta):
+        """
+        Troca o meta.json de forma atômica, confirmando o que foi gravado.
+        """
+        meta_path = os.path.join(self.persist_directory, self.META_FILE)
+        with open(f"{meta_path}.tmp", 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        self._meta = meta
+
+    def _new_meta(self, dim):
+        return {'version': self.VERSION, 'generation': uuid4().hex, 'dim': int(dim),
+                'rows': 0, 'texts_bytes': 0, 'log_bytes': 0}
+
+    @staticmethod
+    def _row_records(ids, texts, metadatas):
+        encoded = [text.encode('utf-8') for text in texts]
+        records = [{'id': chunk_id, 'metadata': metadata, 'length': len(data)}
+                   for chunk_id, metadata, data in zip(ids, metadatas, encoded)]
+        return records, encoded
+
+    def _rewrite(self, dim, batches):
+        """
+        Grava uma nova geração com as linhas de `batches` (listas de (ids, textos, metadados, vetores)),
+        publica-a e remove os arquivos das gerações anteriores. Deve ser chamada com `self.lock`.
+        """
+        meta = self._new_meta(dim)
+        records = []
+        for ids, texts, metadatas, vectors in batches:
+            batch_records, encoded = self._row_records(ids, texts, metadatas)
+            meta = self._write(meta, batch_records, encoded, vectors)
+            records.extend(batch_records)
+        self._publish(meta)
+        self._state = self._apply(_State(), records, meta)
+
+        for pattern in ('vectors-*.f32', 'texts-*.bin', 'rows-*.jsonl'):
+            for old_file in glob.glob(os.path.join(self.persist_directory, pattern)):
+                if meta['generation'] not in os.path.basename(old_file):
+                    # Processos que ainda mapeiam os arquivos antigos continuam lendo normalmente
+                    os.remove(old_file)
+
+    def _compact(self):
+        """
+        Regrava apenas as linhas vivas quando as removidas passam de COMPACT_MIN_DEAD e das vivas.
+        """
+        state = self._state
+        dead = len(state.ids) - len(state.positions)
+        if dead < self.COMPACT_MIN_DEAD or dead <= len(state.positions):
+            return
+        rows = np.flatnonzero(state.live)
+
+        def batches():
+            for i in range(0, len(rows), self.REWRITE_BATCH):
+                batch = rows[i:i + self.REWRITE_BATCH]
+                yield ([state.ids[row] for row in batch], [state.text(row) for row in batch],
+                       [state.metadatas[row] for row in batch], np.asarray(state.matrix[batch]))
+
+        self._rewrite(self._meta['dim'], batches())
+
+    def _migrate(self, meta):
+        """
+        Converte o formato antigo (um meta.json com todos os textos e uma matriz por gravação).
+        """
+        ids = meta['ids']
+        matrix = None
+        if ids:
+            matrix = np.memmap(os.path.join(self.persist_directory, meta['vectors']), dtype=np.float32,
+                               mode='r', shape=(len(ids), meta['dim']))
+
+        def batches():
+            for i in range(0, len(ids), self.REWRITE_BATCH):
+                yield (ids[i:i + self.REWRITE_BATCH], meta['documents'][i:i + self.REWRITE_BATCH],
+                       meta['metadatas'][i:i + self.REWRITE_BATCH], np.asarray(matrix[i:i + self.REWRITE_BATCH]))
+
+        self._rewrite(meta.get('dim', 0), batches())
+        print(f"Vector store em '{self.persist_directory}' convertido para o formato incremental ({len(ids)} chunks).")
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def count(self):
+        return len(self._state.positions)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """
+        Embeda e grava os textos, acrescentando-os ao fim dos arquivos. IDs já existentes são substituídos.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = list(ids) if ids else [uuid4().hex for _ in texts]
+        metadatas = [dict(metadata or {}) for metadata in (metadatas or [{}] * len(texts))]
+        vectors = self._normalize(self.embedding_function.embed_documents(texts))
+
+        with self.lock:
+            meta = self._meta or self._new_meta(vectors.shape[1])
+            if not meta['rows']:
+                meta = {**meta, 'dim': int(vectors.shape[1])}
+            records, encoded = self._row_records(ids, texts, metadatas)
+            meta = self._write(meta, records, encoded, vectors)
+            self._publish(meta)
+            self._state = self._apply(self._state, records, meta)
+            self._compact()
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        """
+        Remove os registros com os IDs informados.
+        """
+        if not ids:
+            return None
+        with self.lock:
+            removed = [chunk_id for chunk_id in ids if chunk_id in self._state.positions]
+            if not removed:
+                return True
+            records = [{'delete': removed}]
+            meta = self._write(self._meta, records)
+            self._publish(meta)
+            self._state = self._apply(self._state, records, meta)
+            self._compact()
+        return True
+
+    @staticmethod
+    def _matches(metadata, where):
+        return all(metadata.get(key) == value for key, value in (where or {}).items())
+
+    def get(self, ids=None, where=None, include=None, **kwargs):
+        """
+        Lê registros pelos IDs e/ou por igualdade de metadados, no mesmo formato do `Chroma.get`.
+        """
+        state = self._state
+        if ids is not None:
+            rows = [state.positions[chunk_id] for chunk_id in ids if chunk_id in state.positions]
+        else:
+            rows = np.flatnonzero(state.live).tolist()
+        rows = [row for row in rows if self._matches(state.metadatas[row], where)]
+
+        include = include if include is not None else ["documents", "metadatas"]
+        return {
+            'ids': [state.ids[row] for row in rows],
+            'documents': [state.text(row) for row in rows] if "documents" in include else None,
+            'metadatas': [state.metadatas[row] for row in rows] if "metadatas" in include else None,
+        }
+
+    def get_by_ids(self, ids):
+        stored = self.get(ids=list(ids))
+        return [Document(id=chunk_id, page_content=text, metadata=dict(metadata))
+                for chunk_id, text, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])]
+
+    def _top_k(self, state, query_vector, k, filter=None):
+        """
+        Retorna (posições, similaridades) dos `k` registros mais próximos, do mais ao menos similar.
+        `state` é o estado lido uma única vez pela busca, para não misturar versões durante uma gravação.
+        """
+        if state.matrix is None or not state.positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = state.matrix @ self._normalize(query_vector)
+        mask = state.live
+        if filter:
+            mask = mask & np.fromiter((self._matches(metadata, filter) for metadata in state.metadatas), bool,
+                                      len(state.metadatas))
+        if not mask.all():
+            scores = np.where(mask, scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        return top, scores[top]
+
+    @staticmethod
+    def _to_document(state, position):
+        return Document(id=state.ids[position], page_content=state.text(position),
+                        metadata=dict(state.metadatas[position]))
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        state = self._state
+        top, _ = self._top_k(state, embedding, k, filter)
+        return [self._to_document(state, position) for position in top]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        """
+        Busca exata por similaridade de cosseno. A pontuação é a similaridade (maior é melhor).
+        """
+        state = self._state
+        top, scores = self._top_k(state, self.embedding_function.embed_query(query), k, filter)
+        return [(self._to_document(state, position), float(score)) for position, score in zip(top, scores)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5,
+                                                filter=None, **kwargs):
+        """
+        MMR vetorizado: a similaridade entre os candidatos é calculada de uma vez (fetch_k x fetch_k)
+        e cada passo da seleção é uma operação sobre vetores.
+        """
+        state = self._state
+        candidates, query_scores = self._top_k(state, embedding, fetch_k, filter)
+        if not len(candidates):
+            return []
+
+        vectors = np.asarray(state.matrix[candidates])
+        pairwise = vectors @ vectors.T
+        selected = [0]
+        max_redundancy = pairwise[0].copy()
+        available = np.ones(len(candidates), dtype=bool)
+        available[0] = False
+        while len(selected) < min(k, len(candidates)):
+            mmr_scores = np.where(available, lambda_mult * query_scores - (1 - lambda_mult) * max_redundancy, -np.inf)
+            best = int(np.argmax(mmr_scores))
+            selected.append(best)
+            available[best] = False
+            np.maximum(max_redundancy, pairwise[best], out=max_redundancy)
+        return [self._to_document(state, candidates[i]) for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(self.embedding_function.embed_query(query),
+                                                            k, fetch_k, lambda_mult, filter)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory='vector_store/numpy/index',
+                   **kwargs):
+        store = cls(persist_directory, embedding)
+        store.add_texts(texts, metadatas, ids)
+        return store
@@ -0,0 +1,156 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pypdf
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+# Versão da extração de texto usada na chave do cache de páginas: muda com a biblioteca ou com a função abaixo
+PARSER_VERSION = f"pypdf-{pypdf.__version__}-1"
+
+
+def count_pages(pdf_path):
+    """
+    Retorna o número de páginas de um PDF.
+    """
+    return len(PdfReader(pdf_path).pages)
+
+
+def parse_pages(pdf_path, start, end):
+    """
+    Extrai o texto das páginas [start, end) de um PDF.
+    Executada nos processos do pool, por isso retorna apenas tipos simples.
+    """
+    reader = PdfReader(pdf_path)
+    return [(reader.pages[i].extract_text(), {'source': pdf_path, 'page': i}) for i in range(start, end)]
+
+
+class PdfPipeline:
+    """
+    Pipeline de ingestão dos PDFs: extração de texto em vários processos (por faixas de páginas),
+    com as páginas sendo entregues em ordem e em streaming para o text splitter.
+    A memória fica limitada pela janela de tarefas em andamento, não pelo tamanho do acervo.
+    Com um PageTextCache, o texto extraído é guardado por hash do PDF e os PDFs já extraídos
+    são lidos do cache sem abrir o arquivo.
+    """
+    def __init__(self, splitter, max_workers=None, pages_per_task=8, max_in_flight=None, text_cache=None):
+        """
+        Inicializa o pipeline com o text splitter, os limites de paralelismo e o cache de texto opcional.
+        """
+        self.splitter = splitter
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = max(1, pages_per_task)
+        self.max_in_flight = max_in_flight or self.max_workers * 2
+        self.text_cache = text_cache
+
+    def _tasks(self, pdf_paths, content_hashes):
+        """
+        Gera as tarefas (pdf, início, fim, última, erro, páginas) de cada PDF. PDFs ilegíveis geram uma
+        tarefa de erro; PDFs presentes no cache de texto geram tarefas com as `páginas` já prontas.
+        """
+        for pdf_path in pdf_paths:
+            content_hash = content_hashes.get(pdf_path)
+            if self.text_cache is not None and self.text_cache.has(content_hash):
+                yield from self._cached_tasks(pdf_path, content_hash)
+                continue
+
+            try:
+                total_pages = count_pages(pdf_path)
+            except Exception as e:
+                yield pdf_path, None, None, True, e, None
+                continue
+
+            if total_pages == 0:
+                yield pdf_path, 0, 0, True, None, None
+                continue
+
+            for start in range(0, total_pages, self.pages_per_task):
+                end = min(start + self.pages_per_task, total_pages)
+                yield pdf_path, start, end, end == total_pages, None, None
+
+    def _cached_tasks(self, pdf_path, content_hash):
+        """
+        Lê as páginas do cache em lotes de `pages_per_task`.
+        """
+        pages = []
+        page_number = 0
+        try:
+            for text in self.text_cache.iter_pages(content_hash):
+                # Um lote cheio só é entregue quando chega a página seguinte, para saber se é o último
+                if len(pages) == self.pages_per_task:
+                    yield pdf_path, None, None, False, None, pages
+                    pages = []
+                pages.append(Document(page_content=text, metadata={'source': pdf_path, 'page': page_number}))
+                page_number += 1
+        except (OSError, EOFError, ValueError) as e:
+            # Entrada corrompida: é descartada para que a próxima sincronização extraia o PDF de novo
+            self.text_cache.discard(content_hash)
+            yield pdf_path, None, None, True, e, None
+            return
+        yield pdf_path, None, None, True, None, pages
+
+    def iter_pages(self, pdf_paths, content_hashes=None):
+        """
+        Gera (pdf, páginas, última, erro) na ordem original dos PDFs e das páginas.
+        `páginas` é uma lista de Document; `última` indica o fim do PDF; `erro` é a exceção, se houver.
+        `content_hashes` ({pdf: hash}) identifica os PDFs no cache de texto.
+        """
+        content_hashes = content_hashes or {}
+        in_flight = deque()
+        writers = {}
+        try:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                for pdf_path, start, end, is_last, error, pages in self._tasks(pdf_paths, content_hashes):
+                    future = None
+                    if pages is None and error is None and end > start:
+                        future = executor.submit(parse_pages, pdf_path, start, end)
+                    in_flight.append((pdf_path, future, pages, is_last, error))
+
+                    while len(in_flight) >= self.max_in_flight:
+                        yield self._collect(*in_flight.popleft(), writers, content_hashes)
+
+                while in_flight:
+                    yield self._collect(*in_flight.popleft(), writers, content_hashes)
+        finally:
+            for writer in writers.values():
+                writer.abort()
+
+    def _collect(self, pdf_path, future, cached_pages, is_last, error, writers, content_hashes):
+        if cached_pages is not None:
+            return pdf_path, cached_pages, is_last, error
+
+        pages = []
+        if future is not None:
+            try:
+                pages = [Document(page_content=text or '', metadata=metadata) for text, metadata in future.result()]
+            except Exception as e:
+                is_last, error = True, e
+
+        if self.text_cache is not None and content_hashes.get(pdf_path):
+            self._cache_pages(writers, pdf_path, content_hashes[pdf_path], pages, is_last, error)
+        return pdf_path, pages, is_last, error
+
+    def _cache_pages(self, writers, pdf_path, content_hash, pages, is_last, error):
+        """
+        Acrescenta as páginas extraídas à entrada do PDF no cache; a entrada só é publicada ao fim do PDF.
+        """
+        writer = writers.get(pdf_path)
+        if error is not None:
+            if writer is not None:
+                writers.pop(pdf_path).abort()
+            return
+
+        if writer is None:
+            writer = writers[pdf_path] = self.text_cache.writer(content_hash)
+        writer.write(page.page_content for page in pages)
+        if is_last:
+            writers.pop(pdf_path).commit()
+
+    def iter_chunks(self, pdf_paths, content_hashes=None):
+        """
+        Gera (pdf, chunks, último, erro): as páginas de cada tarefa já divididas pelo text splitter.
+        """
+        for pdf_path, pages, is_last, error in self.iter_pages(pdf_paths, content_hashes):
+            chunks = self.splitter.split_documents(pages) if pages else []
+            yield pdf_path, chunks, is_last, error
@@ -1,18 +1,24 @@
 import boto3
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from botocore.exceptions import ClientError
+from utils.metrics import metrics
 
 
 class S3Utils:
     """
     Classe para interagir com o Amazon S3.
     """
-    def __init__(self, bucket_name):
+    def __init__(self, bucket_name, s3_resource=None):
         """ 
         Inicializa a classe S3Utils com o nome do bucket.
+        `s3_resource` permite usar outro resource do S3 (ex.: o S3 local do benchmark).
         """
         self.bucket_name = bucket_name
-        self.s3_resource = boto3.resource('s3')
+        self.s3_resource = s3_resource or boto3.resource('s3')
+        # O client (diferente do resource) é thread-safe e é compartilhado pelos downloads paralelos
+        self.s3_client = self.s3_resource.meta.client
         try:
             # Checa se o bucket existe e se temos acesso a ele
             self.s3_resource.meta.client.head_bucket(Bucket=bucket_name)
@@ -85,6 +91,141 @@ class S3Utils:
         print(f"\nTotal de arquivos PDF processados: {len(pdf_list)}")
         return pdf_list
 
+    def list_pdf_objects(self):
+        """
+        Lista os PDFs do bucket com os metadados usados na sincronização (ETag, tamanho, data de modificação).
+        """
+        if not self.bucket:
+            print("Não é possível listar os arquivos, pois o bucket não foi inicializado corretamente.")
+            return {}
+
+        pdf_objects = {}
+        try:
+            for obj in self.bucket.objects.all():
+                if obj.key.lower().endswith('.pdf'):
+                    pdf_objects[obj.key] = {
+                        'etag': obj.e_tag.strip('"'),
+                        'size': obj.size,
+                        'last_modified': obj.last_modified.isoformat(),
+                    }
+        except ClientError as e:
+            print(f"Ocorreu um erro ao listar os objetos: {e}")
+            return None
+
+        print(f"Total de arquivos PDF no bucket: {len(pdf_objects)}")
+        return pdf_objects
+
+    def sync_pdfs(self, dataset_path="dataset", max_workers=8):
+        """
+        Sincroniza a pasta dataset com o bucket, mantendo a estrutura de prefixos das chaves.
+        Compara ETag/tamanho/data com o manifesto local e baixa em paralelo apenas os PDFs novos ou alterados;
+        PDFs removidos do bucket são apagados localmente.
+        Retorna um dicionário com as listas 'added', 'changed', 'deleted', 'unchanged', 'failed'
+        e 'pdfs' (caminhos relativos à pasta dataset de todos os PDFs disponíveis).
+        """
+        manifest_path = os.path.join(dataset_path, '.s3_manifest.json')
+        manifest = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r') as file:
+                    manifest = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Erro ao ler o manifesto do dataset: {e}. Todos os arquivos serão verificados.")
+
+        with metrics.span('s3_list'):
+            remote = self.list_pdf_objects()
+        if remote is None:
+            # Falha na listagem: mantém o que já existe localmente em vez de apagar tudo
+            remote = manifest
+
+        result = {'added': [], 'changed': [], 'deleted': [], 'unchanged': [], 'failed': []}
+        to_download = []
+        for key, info in remote.items():
+            local_path = S3Utils._local_path(dataset_path, key)
+            if local_path is None:
+                print(f"Chave ignorada, pois aponta para fora da pasta '{dataset_path}': {key}")
+                result['failed'].append(key)
+                continue
+            if key not in manifest or not os.path.exists(local_path):
+                to_download.append((key, 'added'))
+            elif manifest[key] != info:
+                to_download.append((key, 'changed'))
+            else:
+                result['unchanged'].append(key)
+
+        for key in manifest:
+            if key not in remote:
+                local_path = S3Utils._local_path(dataset_path, key)
+                if local_path is not None and os.path.exists(local_path):
+                    os.remove(local_path)
+                result['deleted'].append(key)
+                print(f"Removido do bucket: {key}")
+
+        new_manifest = {key: manifest[key] for key in result['unchanged']}
+
+        if to_download:
+            print(f"Baixando {len(to_download)} arquivo(s) com até {max_workers} downloads simultâneos...")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self._download_object, key, os.path.join(dataset_path, key)): (key, status)
+                    for key, status in to_download
+                }
+                for future in as_completed(futures):
+                    key, status = futures[future]
+                    try:
+                        future.result()
+                        new_manifest[key] = remote[key]
+                        result[status].append(key)
+                        metrics.increment('s3_downloads_total')
+                        print(f"Download completo: {key}")
+                    except Exception as e:
+                        # Qualquer falha (S3, rede, disco) afeta só esta chave; as demais seguem e o manifesto é salvo
+                        print(f"Erro ao fazer download de '{key}': {e}")
+                        result['failed'].append(key)
+                        # Um arquivo alterado que falhou continua disponível na versão anterior
+                        if status == 'changed':
+                            new_manifest[key] = manifest[key]
+
+        os.makedirs(dataset_path, exist_ok=True)
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(new_manifest, file, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+
+        result['pdfs'] = sorted(new_manifest)
+        print(f"Sincronização do dataset: {len(result['added'])} novo(s), {len(result['changed'])} alterado(s), "
+              f"{len(result['deleted'])} removido(s), {len(result['unchanged'])} inalterado(s), "
+              f"{len(result['failed'])} com falha.")
+        return result
+
+    @staticmethod
+    def _local_path(dataset_path, key):
+        """
+        Caminho local de uma chave do bucket, ou None se a chave sair da pasta do dataset
+        (caminho absoluto ou com '..').
+        """
+        if not key or key.startswith(('/', '\\')) or '..' in key.replace('\\', '/').split('/'):
+            return None
+        root = os.path.abspath(dataset_path)
+        local_path = os.path.abspath(os.path.join(root, key))
+        if os.path.commonpath([root, local_path]) != root or local_path == root:
+            return None
+        return local_path
+
+    def _download_object(self, key, local_path):
+        """
+        Baixa um objeto para um arquivo temporário e o move para o destino final.
+        """
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        tmp_path = f"{local_path}.part"
+        try:
+            with metrics.span('s3_download'):
+                self.s3_client.download_file(self.bucket_name, key, tmp_path)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
     def get_local_pdfs(self):
         """
         Lista todos os arquivos PDF disponíveis localmente na pasta dataset.
@@ -102,12 +243,23 @@ class S3Utils:
         return local_pdfs
     
     
-    def upload_file(self, file):
+    def upload_file(self, file, s3_path=None):
         try:
-            s3_path = 'audios/audio.ogg'
-            self.bucket.upload_file(file, s3_path)
+            s3_path = s3_path or 'audios/audio.ogg'
+            with metrics.span('s3_upload'):
+                self.bucket.upload_file(file, s3_path)
             print('Audio salvo no s3')
             return s3_path
         except ClientError as e:
             print(f'Erro ao fazer upload do audio {e}')
-            return
\ No newline at end of file
+            return
+
+    def delete_object(self, s3_path):
+        """
+        Remove um objeto do bucket (ex.: áudio temporário já transcrito).
+        """
+        try:
+            with metrics.span('s3_delete'):
+                self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_path)
+        except ClientError as e:
+            print(f"Erro ao remover '{s3_path}' do bucket: {e}")
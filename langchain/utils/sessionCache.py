@@ -0,0 +1,196 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from utils.dataUtils import DataHandler
+
+
+class Session:
+    """
+    Conversa de um usuário mantida em memória.
+    """
+    def __init__(self, user_id, messages):
+        self.user_id = user_id
+        self.messages = messages
+        self.pending = []  # mensagens ainda não gravadas em disco
+        self.last_access = time.monotonic()
+
+
+class SessionCache:
+    """
+    Cache das conversas ativas com limite de tamanho, expulsão LRU/por inatividade e gravação
+    em segundo plano (write-behind): as novas mensagens são acumuladas e gravadas em lote.
+    """
+    def __init__(self, data_dir='historicos', max_sessions=500, idle_ttl=1800, flush_interval=2.0,
+                 load_messages=100):
+        """
+        Inicializa o cache. `load_messages` é o número de mensagens carregadas do disco por usuário;
+        a memória de cada sessão fica limitada ao dobro desse valor.
+        """
+        self.data_dir = data_dir
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self.load_messages = load_messages
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        # Serializa as gravações e as leituras do disco, para que uma sessão recarregada sempre veja tudo o que foi gravado
+        self.io_lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+        self.flushes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Inicia a thread que grava as mensagens pendentes e expulsa as sessões inativas.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-cache", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.evict_idle()
+            except Exception as e:
+                print(f"Erro na gravação do histórico em segundo plano: {e}")
+
+    def _get_session(self, user_id):
+        with self.lock:
+            session = self.sessions.get(user_id)
+            if session is not None:
+                self.sessions.move_to_end(user_id)
+                session.last_access = time.monotonic()
+                return session
+
+        with self.io_lock:
+            with self.lock:
+                # Outra thread pode ter carregado a sessão enquanto esta esperava
+                session = self.sessions.get(user_id)
+                if session is not None:
+                    return session
+
+            print(f"Usuário {user_id} não está em cache. Carregando histórico do disco...")
+            loaded_history = DataHandler(self.data_dir, user_id).load_data(last_n=self.load_messages)
+            session = Session(user_id, loaded_history if loaded_history is not None else [])
+
+            with self.lock:
+                self.sessions[user_id] = session
+                self.loads += 1
+                overflow = self._pop_overflow()
+            self._write(overflow)
+        return session
+
+    def get_history(self, user_id):
+        """
+        Retorna uma cópia do histórico em memória do usuário, carregando do disco se necessário.
+        """
+        session = self._get_session(user_id)
+        with self.lock:
+            return list(session.messages)
+
+    def append(self, user_id, messages):
+        """
+        Acrescenta mensagens ao histórico do usuário; a gravação em disco acontece em segundo plano.
+        """
+        while True:
+            session = self._get_session(user_id)
+            with self.lock:
+                # A sessão pode ter sido expulsa entre a busca e a escrita: nesse caso é carregada de novo
+                if self.sessions.get(user_id) is not session:
+                    continue
+                session.messages.extend(messages)
+                session.pending.extend(messages)
+                session.last_access = time.monotonic()
+                # Corta em blocos: cortar a cada mensagem mudaria o início do histórico (e invalidaria o resumo) toda vez
+                if len(session.messages) > 2 * self.load_messages:
+                    del session.messages[:-self.load_messages]
+                return
+
+    def _pop_overflow(self):
+        """
+        Remove as sessões menos usadas acima do limite. Deve ser chamada com `self.lock`.
+        """
+        evicted = []
+        while len(self.sessions) > self.max_sessions:
+            _, session = self.sessions.popitem(last=False)
+            evicted.append(session)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _write(self, sessions):
+        """
+        Grava as mensagens pendentes das sessões. Deve ser chamada com `self.io_lock`.
+        """
+        for session in sessions:
+            with self.lock:
+                pending, session.pending = session.pending, []
+            if not pending:
+                continue
+            try:
+                DataHandler(self.data_dir, session.user_id).append_data(pending)
+                self.flushes += 1
+            except Exception as e:
+                print(f"Erro ao gravar o histórico do usuário {session.user_id}: {e}")
+                with self.lock:
+                    session.pending = pending + session.pending
+
+    def flush(self):
+        """
+        Grava em disco as mensagens pendentes de todas as sessões.
+        """
+        with self.io_lock:
+            with self.lock:
+                sessions = [session for session in self.sessions.values() if session.pending]
+            self._write(sessions)
+
+    def evict_idle(self):
+        """
+        Expulsa as sessões inativas há mais de `idle_ttl` segundos, gravando antes o que estiver pendente.
+        """
+        now = time.monotonic()
+        with self.io_lock:
+            with self.lock:
+                idle = [user_id for user_id, session in self.sessions.items()
+                        if now - session.last_access > self.idle_ttl]
+                evicted = [self.sessions.pop(user_id) for user_id in idle]
+                self.evictions += len(evicted)
+            self._write(evicted)
+
+        if evicted:
+            metrics = self.metrics()
+            print(f"{len(evicted)} sessão(ões) inativa(s) expulsa(s). Residentes: {metrics['resident_sessions']} "
+                  f"sessões, {metrics['resident_messages']} mensagens, ~{metrics['approx_bytes'] / 1024:.0f} KiB.")
+
+    def close(self):
+        """
+        Para a thread de gravação e grava tudo o que estiver pendente.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+        print("Histórico pendente gravado.")
+
+    def metrics(self):
+        """
+        Métricas do cache: sessões residentes, mensagens em memória e estimativa de memória usada.
+        """
+        with self.lock:
+            messages = [message for session in self.sessions.values() for message in session.messages]
+            approx_bytes = sum(sys.getsizeof(str(message.get('content', ''))) + sys.getsizeof(message)
+                               for message in messages)
+            return {
+                'resident_sessions': len(self.sessions),
+                'resident_messages': len(messages),
+                'pending_messages': sum(len(session.pending) for session in self.sessions.values()),
+                'approx_bytes': approx_bytes,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'flushes': self.flushes,
+            }
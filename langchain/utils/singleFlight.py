@@ -0,0 +1,121 @@
+import threading
+
+from utils.metrics import metrics
+
+
+class Flight:
+    """
+    Execução em andamento compartilhada: as partes produzidas até agora e o resultado final.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def append(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+
+class SingleFlight:
+    """
+    Agrupa chamadas simultâneas com a mesma chave: a primeira executa a função e as que chegam enquanto
+    ela está em andamento aguardam e recebem o mesmo resultado (ou o mesmo erro). No modo streaming,
+    quem aguarda recebe as partes à medida que são produzidas. Terminada a execução, a chave é liberada.
+    """
+    def __init__(self):
+        self.flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def _join(self, key):
+        """
+        Retorna (flight, True se esta chamada deve executar a função).
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                metrics.increment('coalesced_requests_total')
+                return flight, False
+            flight = self.flights[key] = Flight()
+            self.leaders += 1
+            return flight, True
+
+    def _finish(self, key, flight, error=None):
+        # A chave é liberada antes de acordar quem aguarda: chamadas posteriores executam de novo
+        with self.lock:
+            self.flights.pop(key, None)
+        flight.finish(error)
+
+    def run(self, key, fn):
+        """
+        Executa `fn()` ou aguarda a execução em andamento com a mesma chave e retorna o resultado.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                result = fn()
+            except Exception as e:
+                self._finish(key, flight, e)
+                raise
+            flight.append(result)
+            self._finish(key, flight)
+            return result
+
+        with flight.condition:
+            flight.condition.wait_for(lambda: flight.done)
+        if flight.error is not None:
+            raise flight.error
+        return ''.join(flight.chunks)
+
+    def stream(self, key, produce):
+        """
+        Gera as partes de `produce()` ou acompanha a execução em andamento com a mesma chave.
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            yield from self._follow(flight)
+            return
+
+        error = None
+        try:
+            for chunk in produce():
+                flight.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            error = RuntimeError("a resposta compartilhada foi interrompida")
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._finish(key, flight, error)
+
+    @staticmethod
+    def _follow(flight):
+        position = 0
+        while True:
+            with flight.condition:
+                flight.condition.wait_for(lambda: len(flight.chunks) > position or flight.done)
+                chunks = flight.chunks[position:]
+                done, error = flight.done, flight.error
+            position += len(chunks)
+            yield from chunks
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+    def metrics(self):
+        with self.lock:
+            return {'in_flight': len(self.flights), 'leaders': self.leaders, 'coalesced': self.coalesced}
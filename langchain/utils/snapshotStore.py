@@ -0,0 +1,193 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+SNAPSHOTS_PATH = 'vector_store/snapshots'
+
+
+class SnapshotStore:
+    """
+    Versões do índice geradas pelo comando de ingestão (`ingest.py`): cada snapshot é um diretório
+    `<raiz>/<AAAAMMDD-HHMMSS>/` com o vector store (`store/`), o manifesto, os índices BM25 e de citações
+    e um `snapshot.json` com os dados da versão. O arquivo `CURRENT` aponta para o snapshot em uso e é
+    trocado de forma atômica; os processos do bot registram em `.leases/` os snapshots que ainda usam,
+    para que a limpeza não apague uma versão com requisições em andamento.
+    """
+    CURRENT_FILE = 'CURRENT'
+    INFO_FILE = 'snapshot.json'
+    LOCK_FILE = '.ingest.lock'
+    STAGING_PREFIX = '.building-'
+
+    def __init__(self, root=SNAPSHOTS_PATH):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def vector_store_path(self, name):
+        """
+        Diretório do vector store do snapshot. O manifesto e os índices auxiliares ficam no diretório acima.
+        """
+        return os.path.join(self.root, name, 'store') + os.sep
+
+    def current(self):
+        """
+        Nome do snapshot em uso, ou None se nenhum foi publicado.
+        """
+        try:
+            with open(os.path.join(self.root, self.CURRENT_FILE), 'r') as file:
+                name = file.read().strip()
+        except FileNotFoundError:
+            return None
+        return name if name and os.path.isdir(self.path(name)) else None
+
+    def info(self, name):
+        try:
+            with open(os.path.join(self.path(name), self.INFO_FILE), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def list(self):
+        """
+        Snapshots publicados, do mais antigo ao mais recente.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isdir(self.path(name)) and not name.startswith('.'))
+
+    @contextmanager
+    def ingest_lock(self):
+        """
+        Garante que apenas uma ingestão (ou limpeza) rode por vez.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, self.LOCK_FILE), 'w') as file:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError("Outra ingestão já está em andamento.")
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def new_name(self):
+        name = time.strftime('%Y%m%d-%H%M%S')
+        while os.path.exists(self.path(name)):
+            time.sleep(1)
+            name = time.strftime('%Y%m%d-%H%M%S')
+        return name
+
+    def stage(self, name, base=None):
+        """
+        Cria o diretório temporário de um novo snapshot. Com `base`, parte de uma cópia do snapshot
+        informado, para que a sincronização embede apenas os PDFs que mudaram.
+        Retorna o caminho do diretório temporário.
+        """
+        staging_path = os.path.join(self.root, f"{self.STAGING_PREFIX}{name}")
+        if os.path.exists(staging_path):
+            shutil.rmtree(staging_path)
+        if base is not None:
+            shutil.copytree(self.path(base), staging_path, ignore=shutil.ignore_patterns('.leases'))
+            if os.path.exists(os.path.join(staging_path, self.INFO_FILE)):
+                os.remove(os.path.join(staging_path, self.INFO_FILE))
+        else:
+            os.makedirs(staging_path)
+        return staging_path
+
+    def publish(self, name, info):
+        """
+        Move o snapshot temporário para o nome definitivo e aponta o CURRENT para ele (troca atômica).
+        """
+        staging_path = os.path.join(self.root, f"{self.STAGING_PREFIX}{name}")
+        with open(os.path.join(staging_path, self.INFO_FILE), 'w', encoding='utf-8') as file:
+            json.dump(info, file, ensure_ascii=False, indent=2)
+        os.replace(staging_path, self.path(name))
+        self.activate(name)
+
+    def activate(self, name):
+        """
+        Aponta o CURRENT para um snapshot existente (também usado para voltar a uma versão anterior).
+        """
+        if not os.path.isdir(self.path(name)):
+            raise ValueError(f"Snapshot '{name}' não encontrado.")
+        current_path = os.path.join(self.root, self.CURRENT_FILE)
+        with open(f"{current_path}.tmp", 'w') as file:
+            file.write(name)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f"{current_path}.tmp", current_path)
+
+    def _lease_path(self, name, pid=None):
+        return os.path.join(self.path(name), '.leases', str(pid or os.getpid()))
+
+    def acquire(self, name):
+        """
+        Registra que este processo está usando o snapshot.
+        """
+        lease_path = self._lease_path(name)
+        os.makedirs(os.path.dirname(lease_path), exist_ok=True)
+        with open(lease_path, 'w') as file:
+            file.write(str(time.time()))
+
+    def release(self, name):
+        """
+        Remove o registro de uso do snapshot por este processo.
+        """
+        try:
+            os.remove(self._lease_path(name))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _process_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def in_use(self, name):
+        """
+        Indica se algum processo vivo ainda usa o snapshot. Registros de processos encerrados são removidos.
+        """
+        leases_dir = os.path.join(self.path(name), '.leases')
+        if not os.path.isdir(leases_dir):
+            return False
+        in_use = False
+        for lease in os.listdir(leases_dir):
+            if lease.isdigit() and self._process_alive(int(lease)):
+                in_use = True
+            else:
+                os.remove(os.path.join(leases_dir, lease))
+        return in_use
+
+    def cleanup(self, keep=3):
+        """
+        Apaga os snapshots antigos: mantém o CURRENT, os `keep` mais recentes e os que ainda estão em uso.
+        Também remove diretórios temporários de ingestões interrompidas. Deve ser chamada com `ingest_lock`.
+        Retorna os nomes apagados.
+        """
+        removed = []
+        if not os.path.isdir(self.root):
+            return removed
+
+        for name in os.listdir(self.root):
+            if name.startswith(self.STAGING_PREFIX):
+                shutil.rmtree(self.path(name), ignore_errors=True)
+
+        current = self.current()
+        names = self.list()
+        for name in names[:max(len(names) - keep, 0)]:
+            if name == current or self.in_use(name):
+                continue
+            shutil.rmtree(self.path(name), ignore_errors=True)
+            removed.append(name)
+        return removed
@@ -0,0 +1,76 @@
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+from utils.metrics import metrics
+
+
+class TelegramStreamer:
+    """
+    Entrega uma resposta gerada em partes no Telegram: envia uma mensagem provisória e a atualiza com
+    `edit_message_text` em intervalos controlados, respeitando os limites de requisições da API.
+    """
+    MAX_MESSAGE_LENGTH = 4096
+    CURSOR = " ▌"
+    PLACEHOLDER = "✍️ Analisando os documentos..."
+
+    def __init__(self, bot, chat_id, min_interval=1.5, placeholder=PLACEHOLDER):
+        """
+        Inicializa o streamer para um chat. `min_interval` é o tempo mínimo, em segundos, entre duas edições.
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.placeholder = placeholder
+        self.edits = 0
+
+    def _edit(self, message_id, text, final=False):
+        """
+        Edita a mensagem. Em caso de limite de requisições (429), aumenta o intervalo entre edições;
+        a edição final aguarda o tempo pedido pela API e tenta novamente.
+        """
+        try:
+            with metrics.span('telegram_edit'):
+                self.bot.edit_message_text(text, self.chat_id, message_id)
+            self.edits += 1
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                metrics.increment('telegram_rate_limited_total')
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', self.min_interval)
+                self.min_interval = max(self.min_interval * 2, retry_after)
+                print(f"Limite de edições do Telegram atingido. Novo intervalo: {self.min_interval}s")
+                if final:
+                    time.sleep(retry_after)
+                    self.bot.edit_message_text(text, self.chat_id, message_id)
+                    self.edits += 1
+            elif 'message is not modified' not in str(e):
+                raise
+
+    def stream(self, chunks):
+        """
+        Consome os pedaços da resposta atualizando a mensagem provisória e retorna o texto completo.
+        O texto final é escrito uma única vez ao término; o que passar do limite do Telegram
+        é enviado em mensagens adicionais.
+        """
+        with metrics.span('telegram_send'):
+            message = self.bot.send_message(self.chat_id, self.placeholder)
+        limit = self.MAX_MESSAGE_LENGTH - len(self.CURSOR)
+        text = ''
+        last_edit = time.monotonic()
+
+        for chunk in chunks:
+            text += chunk
+            now = time.monotonic()
+            # Enquanto a resposta não cabe em uma mensagem, a parcial mostra só o início
+            if text.strip() and now - last_edit >= self.min_interval and len(text) <= limit:
+                self._edit(message.message_id, text + self.CURSOR)
+                last_edit = time.monotonic()
+
+        if not text.strip():
+            text = "Não foi possível gerar uma resposta."
+
+        parts = [text[i:i + self.MAX_MESSAGE_LENGTH] for i in range(0, len(text), self.MAX_MESSAGE_LENGTH)]
+        self._edit(message.message_id, parts[0], final=True)
+        for part in parts[1:]:
+            self.bot.send_message(self.chat_id, part)
+        return text
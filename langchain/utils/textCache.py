@@ -0,0 +1,64 @@
+import gzip
+import json
+import os
+from uuid import uuid4
+
+
+class PageTextCache:
+    """
+    Cache em disco do texto extraído de cada página dos PDFs, indexado pelo hash do conteúdo do PDF
+    e pela versão do parser. Cada PDF vira um arquivo JSONL comprimido (gzip, uma página por linha),
+    lido em streaming: refazer os chunks com outro splitter não precisa abrir os PDFs de novo.
+    """
+    def __init__(self, directory='cache/page_text', parser_version='1'):
+        """
+        `parser_version` entra na chave: mudar o parser (ou a versão da biblioteca) invalida o cache.
+        """
+        self.directory = directory
+        self.parser_version = parser_version
+
+    def _path(self, content_hash):
+        return os.path.join(self.directory, content_hash[:2], f"{content_hash}-{self.parser_version}.jsonl.gz")
+
+    def has(self, content_hash):
+        return bool(content_hash) and os.path.exists(self._path(content_hash))
+
+    def iter_pages(self, content_hash):
+        """
+        Gera o texto das páginas, em ordem, lendo o arquivo aos poucos.
+        """
+        with gzip.open(self._path(content_hash), 'rt', encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)['text']
+
+    def discard(self, content_hash):
+        if os.path.exists(self._path(content_hash)):
+            os.remove(self._path(content_hash))
+
+    def writer(self, content_hash):
+        return PageTextWriter(self._path(content_hash))
+
+
+class PageTextWriter:
+    """
+    Grava as páginas de um PDF em um arquivo temporário, à medida que são extraídas. O arquivo só
+    aparece no cache em `commit`, então uma extração interrompida nunca deixa uma entrada incompleta.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.{uuid4().hex}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = gzip.open(self.tmp_path, 'wt', encoding='utf-8', compresslevel=6)
+
+    def write(self, texts):
+        for text in texts:
+            self.file.write(json.dumps({'text': text}, ensure_ascii=False) + '\n')
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
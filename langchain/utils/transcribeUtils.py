@@ -1,38 +1,56 @@
 import boto3
+import time
 from uuid import uuid4
 import requests
 import json
+from utils.metrics import metrics
 
 class Trasncribe:
-    def __init__(self):
-        self.transcribe = boto3.client('transcribe')
+    def __init__(self, transcribe_client=None, http_session=None):
+        """
+        `transcribe_client` e `http_session` (usado para baixar a transcrição) podem ser substituídos
+        por dublês locais, como no benchmark.
+        """
+        self.transcribe = transcribe_client or boto3.client('transcribe')
+        self.http = http_session or requests
 
 
-    def audio_transcripition(self, s3_audio_url):
+    def audio_transcripition(self, s3_audio_url, job_name=None):
         try:
-            job_name = Trasncribe.get_job_name()
-            response = self.transcribe.start_transcription_job(
-            TranscriptionJobName = job_name,
-            LanguageCode = 'pt-BR',
-            MediaFormat = 'ogg',
-            Media = {'MediaFileUri':  s3_audio_url}
-            )
+            job_name = job_name or Trasncribe.get_job_name()
+            with metrics.span('transcribe_start'):
+                response = self.transcribe.start_transcription_job(
+                TranscriptionJobName = job_name,
+                LanguageCode = 'pt-BR',
+                MediaFormat = 'ogg',
+                Media = {'MediaFileUri':  s3_audio_url}
+                )
             return job_name
         except Exception as e:
             print(f'erro na trancrição do audio {e}')
     
-    def wait_trancripition(self, job_name):
+    def wait_trancripition(self, job_name, initial_interval=1.0, max_interval=10.0, timeout=300):
+        """
+        Aguarda o fim do job consultando o status com intervalo crescente (backoff exponencial).
+        Retorna a URL da transcrição, ou None em caso de falha ou timeout.
+        """
+        interval = initial_interval
+        start = time.monotonic()
+        deadline = start + timeout
         try:
             while True:
                 response = self.transcribe.get_transcription_job(
                     TranscriptionJobName = job_name 
                 )
+                metrics.increment('transcribe_polls_total')
 
                 job_status = response['TranscriptionJob']['TranscriptionJobStatus']
 
                 if job_status in ['COMPLETED', 'FAILED']:
                     print(f'status {job_status}')
 
+                    metrics.record('transcribe_wait', time.monotonic() - start,
+                                   'ok' if job_status == 'COMPLETED' else 'error')
                     if job_status == 'COMPLETED':
                         print('Transcrição realizada com Sucesso')
                         url = response['TranscriptionJob']['Transcript']['TranscriptFileUri']
@@ -42,11 +60,27 @@ class Trasncribe:
                     else:
                         print('Falha na transcrição') 
                         return
+
+                if time.monotonic() + interval > deadline:
+                    metrics.record('transcribe_wait', time.monotonic() - start, 'error')
+                    print(f'Tempo esgotado aguardando a transcrição {job_name}')
+                    return
+
+                time.sleep(interval)
+                interval = min(interval * 2, max_interval)
         except Exception as e:
             print(f'Erro ao receber a trancrição {e}')
 
-    
+    def delete_job(self, job_name):
+        """
+        Remove o job de transcrição concluído.
+        """
+        try:
+            self.transcribe.delete_transcription_job(TranscriptionJobName = job_name)
+        except Exception as e:
+            print(f'Erro ao remover o job de transcrição {job_name}: {e}')
 
+    @staticmethod
     def get_job_name():
         num = uuid4().hex
         return f'job_name_{num}'
@@ -54,8 +88,9 @@ class Trasncribe:
 
     def download_transcription(self, transcription_url):
         try:
-            response = requests.get(transcription_url)
-            data = response.json()
+            with metrics.span('transcript_download'):
+                response = self.http.get(transcription_url)
+                data = response.json()
             return data['results']['transcripts'][0]['transcript']
         except requests.RequestException as e:
             print(f'Falha no dowlload da transcrição: {e}')
\ No newline at end of file
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class TranscriptCache:
+    """
+    Cache persistente (SQLite) de transcrições de áudio. A chave principal é o `file_unique_id`
+    do Telegram; como alternativa, o hash do conteúdo do áudio (áudios reenviados que geram outro id).
+    O tamanho total é limitado, expulsando as transcrições usadas há mais tempo.
+    """
+    def __init__(self, path='cache/transcripts.sqlite3', max_bytes=20 * 1024 * 1024, max_entries=20000):
+        """
+        Abre (ou cria) o banco do cache.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits_by_id = 0
+        self.hits_by_hash = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS transcripts ('
+                'key TEXT PRIMARY KEY, transcript TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS transcripts_last_used ON transcripts (last_used)')
+            self.conn.commit()
+
+    @staticmethod
+    def audio_hash(audio_bytes):
+        return hashlib.sha256(audio_bytes).hexdigest()
+
+    def _get(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT transcript FROM transcripts WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.conn.execute('UPDATE transcripts SET last_used = ? WHERE key = ?', (time.time(), key))
+                self.conn.commit()
+        return row[0] if row is not None else None
+
+    def get_by_id(self, file_unique_id):
+        """
+        Busca a transcrição pelo `file_unique_id` do Telegram.
+        """
+        if not file_unique_id:
+            return None
+        transcript = self._get(f'id:{file_unique_id}')
+        if transcript is not None:
+            with self.lock:
+                self.hits_by_id += 1
+        return transcript
+
+    def get_by_hash(self, audio_hash):
+        """
+        Busca a transcrição pelo hash do conteúdo do áudio. Conta como falha se não encontrar.
+        """
+        transcript = self._get(f'sha:{audio_hash}')
+        with self.lock:
+            if transcript is not None:
+                self.hits_by_hash += 1
+            else:
+                self.misses += 1
+        return transcript
+
+    def put(self, transcript, file_unique_id=None, audio_hash=None):
+        """
+        Guarda a transcrição sob as chaves informadas e aplica o limite de tamanho.
+        """
+        keys = []
+        if file_unique_id:
+            keys.append(f'id:{file_unique_id}')
+        if audio_hash:
+            keys.append(f'sha:{audio_hash}')
+        size = len(transcript.encode('utf-8'))
+        now = time.time()
+
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?)',
+                                  [(key, transcript, size, now) for key in keys])
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """
+        Remove as entradas usadas há mais tempo até respeitar os limites. Deve ser chamada com `self.lock`.
+        """
+        total_bytes, total_entries = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0), COUNT(*) FROM transcripts').fetchone()
+        if total_bytes <= self.max_bytes and total_entries <= self.max_entries:
+            return
+
+        removed = 0
+        for key, size in self.conn.execute('SELECT key, size FROM transcripts ORDER BY last_used').fetchall():
+            if total_bytes <= self.max_bytes and total_entries <= self.max_entries:
+                break
+            self.conn.execute('DELETE FROM transcripts WHERE key = ?', (key,))
+            total_bytes -= size
+            total_entries -= 1
+            removed += 1
+        self.evictions += removed
+
+    def stats(self):
+        """
+        Contadores de acerto do cache.
+        """
+        with self.lock:
+            hits = self.hits_by_id + self.hits_by_hash
+            total = hits + self.misses
+            entries = self.conn.execute('SELECT COUNT(*) FROM transcripts').fetchone()[0]
+            return {
+                'entries': entries,
+                'hits_by_id': self.hits_by_id,
+                'hits_by_hash': self.hits_by_hash,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': hits / total if total else 0.0,
+            }
@@ -0,0 +1,152 @@
+import contextvars
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from utils.metrics import metrics
+
+
+class TranscriptionScheduler:
+    """
+    Agenda as transcrições de áudio fora das threads de atendimento: cada áudio usa um arquivo local,
+    uma chave no S3 e um job exclusivos, o status é consultado com backoff e o número de jobs
+    simultâneos é limitado. Quando a transcrição fica pronta, o fluxo da mensagem continua pelo callback.
+    """
+    def __init__(self, s3_handler, transcribe_handle, bucket_name, max_concurrent_jobs=4,
+                 initial_poll_interval=1.0, max_poll_interval=10.0, timeout=300, transcript_cache=None):
+        """
+        Inicializa o agendador com os utilitários de S3 e Transcribe.
+        `transcript_cache` é um TranscriptCache opcional para áudios repetidos.
+        """
+        self.s3_handler = s3_handler
+        self.transcribe_handle = transcribe_handle
+        self.bucket_name = bucket_name
+        self.transcript_cache = transcript_cache
+        self.initial_poll_interval = initial_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix="transcribe")
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def submit(self, fetch_audio, callback, error_callback=None, file_unique_id=None):
+        """
+        Agenda a transcrição. `fetch_audio` retorna os bytes do áudio (ex.: download do Telegram);
+        `callback(transcrição)` é chamado ao final e `error_callback(erro)` em caso de falha.
+        `file_unique_id` é o identificador do arquivo no Telegram, usado como chave do cache.
+        """
+        with self.lock:
+            self.in_flight += 1
+        return self.executor.submit(contextvars.copy_context().run, self._run, fetch_audio, callback,
+                                    error_callback, file_unique_id)
+
+    def _cached_transcribe(self, fetch_audio, file_unique_id):
+        """
+        Retorna a transcrição do cache (pelo id do arquivo ou pelo hash do áudio) ou transcreve e guarda no cache.
+        """
+        if self.transcript_cache is None:
+            return self.transcribe(self._fetch(fetch_audio))
+
+        transcript = self.transcript_cache.get_by_id(file_unique_id)
+        if transcript is not None:
+            print('Transcrição encontrada no cache (id do arquivo).')
+            metrics.increment('transcript_cache_lookups_total', result='hit_id')
+            return transcript
+
+        audio_bytes = self._fetch(fetch_audio)
+        audio_hash = self.transcript_cache.audio_hash(audio_bytes)
+        transcript = self.transcript_cache.get_by_hash(audio_hash)
+        if transcript is not None:
+            print('Transcrição encontrada no cache (hash do áudio).')
+            metrics.increment('transcript_cache_lookups_total', result='hit_hash')
+            # Registra também o novo id, para que o próximo reenvio nem precise baixar o áudio
+            self.transcript_cache.put(transcript, file_unique_id=file_unique_id)
+            return transcript
+
+        metrics.increment('transcript_cache_lookups_total', result='miss')
+        transcript = self.transcribe(audio_bytes)
+        self.transcript_cache.put(transcript, file_unique_id=file_unique_id, audio_hash=audio_hash)
+        return transcript
+
+    @staticmethod
+    def _fetch(fetch_audio):
+        with metrics.span('audio_download'):
+            return fetch_audio()
+
+    def _run(self, fetch_audio, callback, error_callback, file_unique_id):
+        # Os callbacks rodam dentro do escopo da requisição, para que a resposta ao áudio herde o mesmo ID
+        with metrics.request('transcription'):
+            self._process(fetch_audio, callback, error_callback, file_unique_id)
+
+    def _process(self, fetch_audio, callback, error_callback, file_unique_id):
+        try:
+            transcript = self._cached_transcribe(fetch_audio, file_unique_id)
+        except Exception as e:
+            with self.lock:
+                self.in_flight -= 1
+                self.failed += 1
+            print(f'erro na trancrição do audio {e}')
+            if error_callback is not None:
+                error_callback(e)
+            return
+
+        with self.lock:
+            self.in_flight -= 1
+            self.completed += 1
+        callback(transcript)
+
+    def transcribe(self, audio_bytes):
+        """
+        Envia o áudio ao S3, executa o job do Transcribe e retorna o texto transcrito.
+        Os objetos temporários (arquivo local, objeto no S3 e job) são sempre removidos.
+        """
+        audio_id = uuid4().hex
+        s3_path = f'audios/{audio_id}.ogg'
+        job_name = f'job_name_{audio_id}'
+        uploaded = False
+        job_started = False
+
+        fd, local_filename = tempfile.mkstemp(prefix=f'audio_{audio_id}_', suffix='.ogg')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(audio_bytes)
+
+            if not self.s3_handler.upload_file(local_filename, s3_path):
+                raise RuntimeError('falha no upload do áudio para o S3')
+            uploaded = True
+
+            if not self.transcribe_handle.audio_transcripition(f's3://{self.bucket_name}/{s3_path}', job_name):
+                raise RuntimeError('falha ao iniciar o job de transcrição')
+            job_started = True
+
+            transcription_url = self.transcribe_handle.wait_trancripition(
+                job_name,
+                initial_interval=self.initial_poll_interval,
+                max_interval=self.max_poll_interval,
+                timeout=self.timeout
+            )
+            if not transcription_url:
+                raise RuntimeError('transcrição não concluída')
+
+            transcript = self.transcribe_handle.download_transcription(transcription_url)
+            if not transcript:
+                raise RuntimeError('transcrição vazia')
+            return transcript
+        finally:
+            if os.path.exists(local_filename):
+                os.remove(local_filename)
+            if uploaded:
+                self.s3_handler.delete_object(s3_path)
+            if job_started:
+                self.transcribe_handle.delete_job(job_name)
+
+    def metrics(self):
+        with self.lock:
+            return {'in_flight': self.in_flight, 'completed': self.completed, 'failed': self.failed}
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)